@@ -6,7 +6,7 @@ import logging
 import math
 import os
 import time
-from typing import Tuple
+from typing import List, Tuple
 import pandas as pd
 ## Apparently there's an issue with the latest version of pandas.
 ## Got this fix from here:
@@ -28,11 +28,12 @@ from pymatgen.core.periodic_table import Element
 from pymatgen.core import Composition, Structure
 from pymatgen.analysis.phase_diagram import PDEntry
 
-from rlmolecule.crystal.builder import CrystalBuilder
+from rlmolecule.crystal.builder import CrystalBuilder, CSRCrystalBuilder
 from rlmolecule.crystal.crystal_problem import CrystalTFAlphaZeroProblem
 from rlmolecule.crystal.crystal_state import CrystalState
 from rlmolecule.crystal.preprocessor import CrystalPreprocessor
-from rlmolecule.crystal.ehull import fere_entries
+from rlmolecule.crystal.ehull import CompetingPhaseIndex, fere_entries
+from rlmolecule.crystal.structure_store import StructureStore
 from rlmolecule.sql.run_config import RunConfig
 from rlmolecule.tree_search.reward import LinearBoundedRewardFactory
 from rlmolecule.tree_search.reward import RankedRewardFactory
@@ -112,6 +113,10 @@ class CrystalEnergyStabilityOptProblem(CrystalTFAlphaZeroProblem):
     def get_reward(self, state: CrystalState) -> Tuple[float, dict]:
         return self.rewarder.get_reward(state)
 
+    def get_rewards(self, states: List[CrystalState]) -> List[Tuple[float, dict]]:
+        # the terminal leaves of a batch go through the reward stages together
+        return self.rewarder.get_rewards(states)
+
 
 def create_problem():
     run_id = run_config.run_id
@@ -169,11 +174,16 @@ def run_games():
     from rlmolecule.alphazero.alphazero import AlphaZero
 
     prob_config = run_config.problem_config
-    builder = CrystalBuilder(G=prob_config.get('action_graph1'),
-                             G2=prob_config.get('action_graph2'),
-                             actions_to_ignore=prob_config.get('actions_to_ignore'),
-                             prototypes=prototype_structures,
-                             )
+    # the CSR builder finds the next actions with array operations rather than by walking the networkx graphs
+    builder_class = CSRCrystalBuilder if prob_config.get('csr_builder', False) else CrystalBuilder
+    builder = builder_class(G=prob_config.get('action_graph1'),
+                            G2=prob_config.get('action_graph2'),
+                            actions_to_ignore=prob_config.get('actions_to_ignore'),
+                            prototypes=prototype_structures,
+                            compact_states=prob_config.get('compact_states', False),
+                            # compiled action graphs, see scripts/compile_action_graphs.py
+                            action_graphs_dir=prob_config.get('action_graphs_dir'),
+                            )
 
     config = run_config.mcts_config
     game = AlphaZero(
@@ -187,6 +197,12 @@ def run_games():
         # MCTS parameters
         ucb_constant=config.get('ucb_constant', math.sqrt(2)),
         state_builder=builder,
+        # the crystal action graph is layered, so the search graph can't contain cycles
+        acyclic=True,
+        # the action space is finite, so decorations (and their ancestors) that were already scored can be marked
+        # as solved and skipped, rather than removed through the states_to_ignore
+        solver=config.get('solver', False),
+        persist_graph=config.get('persist_graph', False),
     )
 
     # TEMP: Try running without removing states already seen
@@ -237,16 +253,17 @@ def set_states_seen(game, states_seen, states_seen_file=None):
         else:
             logger.warning(f"states_seen_file '{states_seen_file}' not found")
 
+    # ignore only updates the ancestors of the new states that become dead-ends,
+    # e.g., compositions with no prototypes available
     for state in states - states_seen:
-        comp = state.split('|')[0]
-        decoration_node = '|'.join(state.split('|')[1:])
-        game.state_builder.states_to_ignore[comp].add(decoration_node)
+        try:
+            game.state_builder.ignore(state)
+        except ValueError as e:
+            logger.warning(e)
 
     states_seen |= states
     #print(f"{len(states - states_seen)} new states since last checked. "
     #      f"len(states_seen): {len(states_seen)}")
-    # check to make sure there are no dead-ends e.g., compositions with no prototypes available
-    game.state_builder.remove_dead_ends()
     logger.info(f"{len(game.state_builder.actions_to_ignore)}, "
                 f"{len(game.state_builder.actions_to_ignore_G2)}, "
                 f"{len(game.state_builder.states_to_ignore)} "
@@ -337,21 +354,29 @@ if __name__ == "__main__":
     energy_model = tf.keras.models.load_model(args.energy_model,
                                               custom_objects={**custom_objects,
                                                               **{'RBFExpansion': RBFExpansion}})
-    # Dataframe containing competing phases from NRELMatDB
-    print("Building phase diagram entries from inputs/competing_phases.csv")
-    df_competing_phases = pd.read_csv('inputs/competing_phases.csv')
-    df_competing_phases['energy'] = (
-        df_competing_phases.energyperatom *
-        df_competing_phases.sortedformula.apply(lambda x: Composition(x).num_atoms)
-    )
-    # convert the dataframe to a list of PDEntries used to create the convex hull
-    pd_entries = df_competing_phases.apply(
-        lambda row: PDEntry(Composition(row.sortedformula),
-                            row.energy),
-        axis=1
-    )
-    print(f"\t{len(pd_entries)} entries")
-    competing_phases = pd.concat([pd.Series(fere_entries), pd_entries]).reset_index()[0]
+    # Dataframe containing competing phases from NRELMatDB.
+    # Parsing the formulas is slow, so the entries are read from the saved index if there is one
+    competing_phases_index = run_config.problem_config.get('competing_phases_index')
+    if competing_phases_index is not None and os.path.isfile(competing_phases_index):
+        competing_phases = CompetingPhaseIndex()
+        competing_phases.load(competing_phases_index)
+    else:
+        print("Building phase diagram entries from inputs/competing_phases.csv")
+        df_competing_phases = pd.read_csv('inputs/competing_phases.csv')
+        df_competing_phases['energy'] = (
+            df_competing_phases.energyperatom *
+            df_competing_phases.sortedformula.apply(lambda x: Composition(x).num_atoms)
+        )
+        # convert the dataframe to a list of PDEntries used to create the convex hull
+        pd_entries = df_competing_phases.apply(
+            lambda row: PDEntry(Composition(row.sortedformula),
+                                row.energy),
+            axis=1
+        )
+        print(f"\t{len(pd_entries)} entries")
+        competing_phases = CompetingPhaseIndex(pd.concat([pd.Series(fere_entries), pd_entries]).reset_index()[0])
+        if competing_phases_index is not None:
+            competing_phases.save(competing_phases_index)
 
     site_bias = None
     if args.vol_pred_site_bias is not None:
@@ -379,12 +404,17 @@ if __name__ == "__main__":
     # load the icsd prototype structures
     prototypes_file = "../../rlmolecule/crystal/inputs/icsd_prototypes_lt50atoms_lt100dist.json.gz"
     prototypes_file = prob_config.get('prototypes_file', prototypes_file)
-    prototype_structures = read_structures_file(prototypes_file)
-    # make sure the prototype structures don't have oxidation states
-    from pymatgen.transformations.standard_transformations import OxidationStateRemovalTransformation
-    oxidation_remover = OxidationStateRemovalTransformation()
-    prototype_structures = {s_id: oxidation_remover.apply_transformation(s)
-                            for s_id, s in prototype_structures.items()}
+    if os.path.isdir(prototypes_file):
+        # a StructureStore (see scripts/compile_structures.py) only builds the structures that are used.
+        # It doesn't store oxidation states
+        prototype_structures = StructureStore(prototypes_file)
+    else:
+        prototype_structures = read_structures_file(prototypes_file)
+        # make sure the prototype structures don't have oxidation states
+        from pymatgen.transformations.standard_transformations import OxidationStateRemovalTransformation
+        oxidation_remover = OxidationStateRemovalTransformation()
+        prototype_structures = {s_id: oxidation_remover.apply_transformation(s)
+                                for s_id, s in prototype_structures.items()}
 
     Base.metadata.create_all(engine, checkfirst=True)
     Session.configure(bind=engine)
@@ -0,0 +1,30 @@
+### Compile the action graph edgelists into the binary format loaded by CrystalBuilder(action_graphs_dir=...)
+
+import argparse
+from pathlib import Path
+
+from rlmolecule.crystal.action_graph import save_action_graphs
+from rlmolecule.crystal.builder import read_action_graph, read_action_graph2
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Compile the two action graph edgelists into a directory of memory-mappable .npy files, '
+                    'which are much faster to load than the edgelists')
+    parser.add_argument('--action-graph1',
+                        type=Path,
+                        help="Edgelist of the first action graph, from element combinations to compositions. "
+                             "Uses the default action graph if not given")
+    parser.add_argument('--action-graph2',
+                        type=Path,
+                        help="Edgelist of the second action graph, from composition types to decorations. "
+                             "Uses the default action graph if not given")
+    parser.add_argument('--out-dir', '-o',
+                        type=Path,
+                        required=True,
+                        help="Output directory for the compiled action graphs")
+    args = parser.parse_args()
+
+    G = read_action_graph(str(args.action_graph1) if args.action_graph1 is not None else None)
+    G2 = read_action_graph2(str(args.action_graph2) if args.action_graph2 is not None else None)
+    save_action_graphs(str(args.out_dir), G, G2)
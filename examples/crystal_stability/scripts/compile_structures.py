@@ -0,0 +1,26 @@
+### Convert a gzipped json file of structures (e.g., the ICSD prototypes) to a StructureStore directory,
+### which can be given as the 'prototypes_file' in the run config
+
+import argparse
+from pathlib import Path
+
+from rlmolecule.crystal.structure_store import StructureStore
+from rlmolecule.crystal.utils import read_structures_file
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Convert a gzipped json file of pymatgen structures to a directory of memory-mappable .npy files. '
+                    'Oxidation states are removed')
+    parser.add_argument('--structures-file', '-s',
+                        type=Path,
+                        default="../../../rlmolecule/crystal/inputs/icsd_prototypes_lt50atoms_lt100dist.json.gz",
+                        help="json.gz file of structures, keyed by structure id")
+    parser.add_argument('--out-dir', '-o',
+                        type=Path,
+                        required=True,
+                        help="Output directory for the structure store")
+    args = parser.parse_args()
+
+    structures = read_structures_file(str(args.structures_file))
+    StructureStore.write(str(args.out_dir), structures)
@@ -26,7 +26,8 @@ from rlmolecule.crystal.builder import CrystalBuilder
 from rlmolecule.crystal.crystal_problem import CrystalTFAlphaZeroProblem
 from rlmolecule.crystal.crystal_state import CrystalState
 from rlmolecule.crystal.preprocessor import CrystalPreprocessor
-from rlmolecule.crystal.ehull import fere_entries
+from rlmolecule.crystal.ehull import CompetingPhaseIndex, fere_entries
+from rlmolecule.crystal.structure_store import StructureStore
 from rlmolecule.sql.run_config import RunConfig
 from rlmolecule.crystal.crystal_reward import CrystalStateReward
 from rlmolecule.crystal import utils, crystal_reward, reward_utils
@@ -50,13 +51,24 @@ class AtomicNumberPreprocessor(PymatgenPreprocessor):
         return self._max_atomic_num
 
 
-def setup_competing_phases(competing_phases_files):
+def setup_competing_phases(competing_phases_files, index_file=None):
+    """ Build the index of competing phases from the csv files,
+    or load it from the index_file if it exists (otherwise it's written there)
+    """
+    if index_file is not None and os.path.isfile(index_file):
+        competing_phases = CompetingPhaseIndex()
+        competing_phases.load(index_file)
+        return competing_phases
+
     if not isinstance(competing_phases_files, list):
         competing_phases_files = [competing_phases_files]
     all_competing_phases = [load_competing_phases(f) for f in competing_phases_files]
 
     # also add the individual elements
-    competing_phases = pd.concat([pd.Series(fere_entries)] + all_competing_phases).reset_index()[0]
+    competing_phases = CompetingPhaseIndex(
+        pd.concat([pd.Series(fere_entries)] + all_competing_phases).reset_index()[0])
+    if index_file is not None:
+        competing_phases.save(index_file)
     return competing_phases
 
 
@@ -112,19 +124,40 @@ def generate_structures(decor_ids, rewarder):
         yield(decor_id, structure)
 
 
-def compute_rewards(decor_ids, rewarder, info_to_keep=None):
-    for decor_id in tqdm(decor_ids):
-        yield compute_reward(decor_id, rewarder, info_to_keep)
+def compute_rewards(decor_ids, rewarder, info_to_keep=None, chunk_size=1000, **pipeline_kwargs):
+    """ Compute the rewards of the decorations in chunks, each going through the stages of
+    CrystalStateReward.get_rewards concurrently. The worker processes (and their caches) are reused across chunks
+    """
+    decor_ids = list(decor_ids)
+    try:
+        with tqdm(total=len(decor_ids)) as progress:
+            for start in range(0, len(decor_ids), chunk_size):
+                chunk = decor_ids[start:start + chunk_size]
+                rewards = rewarder.get_rewards([get_state(decor_id) for decor_id in chunk], **pipeline_kwargs)
+                for decor_id, (reward, info) in zip(chunk, rewards):
+                    yield format_reward(decor_id, reward, info, info_to_keep)
+                progress.update(len(chunk))
+    finally:
+        rewarder.close()
+    # only counts the phase diagrams used by this process, i.e., not those of worker processes
+    print(f"Phase diagram cache: {rewarder.phase_diagram_cache.stats()}")
 
 
 def compute_reward(decor_id, rewarder, info_to_keep=None):
     # generate the decorated structure and get the reward
+    reward, info = rewarder.get_reward(get_state(decor_id))
+    return format_reward(decor_id, reward, info, info_to_keep)
+
+
+def get_state(decor_id):
     #Example state:
     # CrystalState("_1_3_6|trigonal|icsd_401335|1", composition="Li3Sc1Br6", terminal=True)
     comp = decor_id.split('|')[0]
     action_node = '|'.join(decor_id.split('|')[1:])
-    state = CrystalState(action_node, composition=comp, terminal=True)
-    reward, info = rewarder.get_reward(state)
+    return CrystalState(action_node, composition=comp, terminal=True)
+
+
+def format_reward(decor_id, reward, info, info_to_keep=None):
     if info_to_keep is not None:
         info = [round(info[c], 3) for c in info_to_keep if c in info]
     else:
@@ -211,6 +244,12 @@ def main(decor_ids):
         # generate the decorated structures
         decorations = generate_structures(decor_ids, rewarder)
         # Now write the structures
+        if args.structure_store:
+            print(f"Writing structure store {args.out_file}")
+            StructureStore.write(str(args.out_file),
+                                 ((decor_id, structure) for decor_id, structure in decorations
+                                  if structure is not None))
+            return
         df = pd.DataFrame(list(decorations), columns=['decor_id', 'structure'])
         print(f"Writing pickle file {args.out_file}")
         df.to_pickle(args.out_file)
@@ -224,7 +263,14 @@ def main(decor_ids):
                     'oxidation',
                     'stability_window',
                     ]
-    decoration_rewards = compute_rewards(decor_ids, rewarder, info_to_keep=info_to_keep)
+    # decorating, preprocessing and scoring the structures are split over the workers,
+    # while the energies are predicted in batches
+    decoration_rewards = compute_rewards(decor_ids, rewarder, info_to_keep=info_to_keep,
+                                         num_workers={'decorate': args.num_workers,
+                                                      'scale_volume': args.num_workers,
+                                                      'preprocess': args.num_workers,
+                                                      'score': args.num_workers},
+                                         use_processes=args.processes)
     with gzip.open(args.out_file, 'w') as out:
         #header = ','.join(["id", "reward"] + info_to_keep) + '\n'
         #out.write(header.encode())
@@ -284,6 +330,18 @@ if __name__ == "__main__":
                         type=pathlib.Path,
                         action='append',
                         help='File with decoration ids for which the reward will be computed')
+    parser.add_argument('--structure-store',
+                        action='store_true',
+                        help='When generating decorated structures (i.e., without an energy model), '
+                             'write them to a StructureStore directory at --out-file rather than a pickle file')
+    parser.add_argument('--num-workers',
+                        type=int,
+                        default=1,
+                        help='Number of workers for each of the reward stages other than the energy prediction')
+    parser.add_argument('--processes',
+                        action='store_true',
+                        help='Use worker processes rather than threads for the reward stages '
+                             'other than the energy prediction')
     #parser.add_argument('--vol-pred-site-bias', type=pathlib.Path,
     #                    help='Apply a volume prediction to the decorated structure '
     #                    'before passing it to the GNN. '
@@ -298,17 +356,23 @@ if __name__ == "__main__":
     # Dataframe containing competing phases from NRELMatDB
     competing_phases_file = "inputs/competing_phases.csv"
     competing_phases = setup_competing_phases(prob_config.get('competing_phases_files',
-                                                              competing_phases_file))
+                                                              competing_phases_file),
+                                              index_file=prob_config.get('competing_phases_index'))
 
     # load the icsd prototype structures
     prototypes_file = "../../rlmolecule/crystal/inputs/icsd_prototypes_lt50atoms_lt100dist.json.gz"
     prototypes_file = prob_config.get('prototypes_file', prototypes_file)
-    prototype_structures = read_structures_file(prototypes_file)
-    # make sure the prototype structures don't have oxidation states
-    from pymatgen.transformations.standard_transformations import OxidationStateRemovalTransformation
-    oxidation_remover = OxidationStateRemovalTransformation()
-    prototype_structures = {s_id: oxidation_remover.apply_transformation(s)
-                            for s_id, s in prototype_structures.items()}
+    if os.path.isdir(prototypes_file):
+        # a StructureStore (see scripts/compile_structures.py) only builds the structures that are used.
+        # It doesn't store oxidation states
+        prototype_structures = StructureStore(prototypes_file)
+    else:
+        prototype_structures = read_structures_file(prototypes_file)
+        # make sure the prototype structures don't have oxidation states
+        from pymatgen.transformations.standard_transformations import OxidationStateRemovalTransformation
+        oxidation_remover = OxidationStateRemovalTransformation()
+        prototype_structures = {s_id: oxidation_remover.apply_transformation(s)
+                                for s_id, s in prototype_structures.items()}
     proto_to_crystal_sys = {proto_id.split('|')[-1]: proto_id.split('|')[1]
                             for proto_id in prototype_structures.keys()}
 
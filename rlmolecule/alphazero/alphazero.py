@@ -1,10 +1,12 @@
 import logging
 import math
+from typing import NamedTuple, Optional
 
 import numpy as np
 
 from rlmolecule.alphazero.alphazero_problem import AlphaZeroProblem
 from rlmolecule.alphazero.alphazero_vertex import AlphaZeroVertex
+from rlmolecule.alphazero.array_alphazero_vertex import ArrayAlphaZeroVertex
 from rlmolecule.mcts.mcts import MCTS
 from rlmolecule.mcts.mcts_vertex import MCTSVertex
 from rlmolecule.tree_search.graph_search_state import GraphSearchState
@@ -15,6 +17,12 @@ logger = logging.getLogger(__name__)
 random_state = np.random.RandomState()
 
 
+class RankedSuccessor(NamedTuple):
+    """ A pending successor of an evaluated vertex, with its prior (see AlphaZero._rank_successors) """
+    prior: float
+    state: GraphSearchState
+
+
 class AlphaZero(MCTS):
     """
     This class defines the interface for implementing AlphaZero-based games within this framework.
@@ -31,6 +39,7 @@ class AlphaZero(MCTS):
                  dirichlet_noise: bool = True,
                  dirichlet_alpha: float = 1.0,
                  dirichlet_x: float = 0.25,
+                 leaf_batch_size: int = 1,
                  **kwargs) -> None:
         """
         Constructor.
@@ -40,8 +49,12 @@ class AlphaZero(MCTS):
         :param dirichlet_noise: whether to add dirichlet noise
         :param dirichlet_alpha: dirichlet 'shape' parameter. Larger values spread out probability over more moves.
         :param dirichlet_x: percentage to favor dirichlet noise vs. prior estimation. Smaller means less noise
+        :param leaf_batch_size: number of leaves collected (using virtual loss) before they are evaluated with a single
+            call to problem.get_values_and_policies
         """
-        super().__init__(problem, vertex_class=AlphaZeroVertex, **kwargs)
+        vertex_class = AlphaZeroVertex if kwargs.get('tree_store') is None else ArrayAlphaZeroVertex
+        kwargs.setdefault('num_parallel', leaf_batch_size)
+        super().__init__(problem, vertex_class=vertex_class, **kwargs)
         self._min_reward: float = min_reward
         self._pb_c_base: float = pb_c_base
         self._pb_c_init: float = pb_c_init
@@ -56,9 +69,19 @@ class AlphaZero(MCTS):
 
     def _accumulate_path_data(self, vertex: MCTSVertex, path: []):
         children = vertex.children
-        visit_sum = sum(child.visit_count for child in children)
-        child_visits = [(child, child.visit_count / visit_sum) for child in children]
-        path.append((vertex, child_visits))
+        if self.tree_store is not None:
+            visit_counts = self.tree_store.child_visit_counts(vertex.id).astype(np.float64)
+        else:
+            visit_counts = np.array([child.visit_count for child in children], dtype=np.float64)
+
+        visit_sum = visit_counts.sum()
+        if visit_sum == 0:
+            # children of vertices that weren't sampled (e.g., forced moves with an adaptive budget) are equally likely
+            visit_probabilities = np.full(len(children), 1. / max(len(children), 1))
+        else:
+            visit_probabilities = visit_counts / visit_sum
+
+        path.append((vertex, list(zip(children, visit_probabilities.tolist()))))
 
     @collect_metrics
     def _evaluate(
@@ -69,30 +92,115 @@ class AlphaZero(MCTS):
         Expansion step of AlphaZero, overrides MCTS evaluate step.
         Estimates the value of a leaf vertex.
         """
-        assert len(search_path) > 0, 'Invalid attempt to evaluate an empty search path.'
-        leaf = search_path[-1]
-        self._expand(leaf)
-
-        children = leaf.children
-        if len(children) == 0:
-            return self.problem.reward_wrapper(leaf)
-
-        # get value estimate and child priors
-        value, child_priors = self.problem.get_value_and_policy(leaf)
+        return self._evaluate_batch([search_path])[0]
 
-        # Store prior values for child vertices predicted from the policy network, and add dirichlet noise as
-        # specified in the game configuration.
-        prior_array: np.ndarray = np.array([child_priors[child] for child in children])
+    @collect_metrics
+    def _evaluate_batch(self, search_paths: [[AlphaZeroVertex]]) -> [Reward]:
+        """
+        Estimates the values of several leaf vertices, using a single call to problem.get_values_and_policies for all
+        the non-terminal leaves.
+        """
+        assert all(len(search_path) > 0 for search_path in search_paths), \
+            'Invalid attempt to evaluate an empty search path.'
+        leaves = [search_path[-1] for search_path in search_paths]
+        for leaf in leaves:
+            self._expand(leaf)
+
+        values: [Optional[Reward]] = [None] * len(leaves)
+        parents = []
+        terminals = []
+        for i, leaf in enumerate(leaves):
+            if self.solver and leaf.solved:
+                values[i] = self.problem.reward_class(raw_reward=leaf.solved_value)
+            elif len(leaf.children) == 0:
+                terminals += [(i, leaf)]
+            else:
+                parents += [(i, leaf)]
+
+        # the rewards of the terminal leaves are computed together
+        if terminals:
+            for (i, _), reward in zip(terminals, self.problem.reward_wrappers([leaf for _, leaf in terminals])):
+                values[i] = reward
+
+        if not parents:
+            return values
+
+        # get value estimates and child priors
+        values_and_policies = self.problem.get_values_and_policies([leaf for _, leaf in parents])
+        for (i, leaf), (value, child_priors) in zip(parents, values_and_policies):
+            self._set_child_priors(leaf, child_priors)
+            if self.widening_coefficient is not None:
+                self._rank_successors(leaf)
+            values[i] = self.problem.reward_class(scaled_reward=value)
+
+        return values
+
+    def _expand(self, leaf: AlphaZeroVertex) -> None:
+        """
+        Expansion step of AlphaZero. The policy needs the inputs of every child, so with lazy children (or progressive
+        widening, until the leaf is evaluated) they are all built here, before the leaf is evaluated (and, for parallel
+        sampling, on the thread that selected it).
+        """
+        if leaf.children is None:
+            # the priors of vertices collapsed by the canonicalizer no longer match their children
+            leaf.child_prior_array = None
+        super()._expand(leaf)
+        if leaf in self._pending_successors and \
+                (self.widening_coefficient is None or leaf.child_prior_array is None):
+            self._admit(leaf, len(self._pending_successors[leaf]))
+
+    def _rank_successors(self, vertex: AlphaZeroVertex) -> None:
+        """
+        Progressive widening for AlphaZero: once a vertex is evaluated with all of its successors as children, only
+        keep those with the highest priors as children, and keep the others pending by descending prior, so that they
+        are admitted in that order. Admitted children keep their share of the full prior vector.
+        """
+        children = vertex.children
+        num_admitted = self._num_admitted(vertex.visit_count)
+        if len(children) <= num_admitted:
+            return
+
+        priors = np.array(vertex.child_prior_array)
+        order = np.argsort(-priors, kind='stable')
+        vertex.children = [children[i] for i in order[:num_admitted]]
+        self.canonicalizer.remove_edges(vertex, [children[i] for i in order[num_admitted:]])
+        vertex.child_prior_array = priors[order[:num_admitted]]
+        # kept in reverse so that admitting successors pops them from the end
+        self._pending_successors[vertex] = [RankedSuccessor(float(priors[i]), children[i].state)
+                                            for i in order[:num_admitted - 1:-1]]
+
+    def _set_child_priors(self, leaf: AlphaZeroVertex, child_priors: {AlphaZeroVertex: float}) -> None:
+        """
+        Store prior values for child vertices predicted from the policy network, and add dirichlet noise as specified
+        in the game configuration.
+        """
+        prior_array: np.ndarray = np.array([child_priors[child] for child in leaf.children])
 
         if self._dirichlet_noise:
             noise = random_state.dirichlet(np.ones_like(prior_array) * self._dirichlet_alpha)
             prior_array = prior_array * (1 - self._dirichlet_x) + (noise * self._dirichlet_x)
 
-        child_priors = prior_array.tolist()
-        normalization_factor = sum(child_priors)
-        leaf.child_priors = {child: prior / normalization_factor for child, prior in zip(children, child_priors)}
+        leaf.child_prior_array = prior_array / prior_array.sum()
+
+    def _admit(self, vertex: AlphaZeroVertex, num_new: int) -> bool:
+        """
+        The pending successors of an evaluated vertex are ranked, and carry their priors (see `_rank_successors`), so
+        admitting them doesn't evaluate the vertex again.
+        """
+        priors = vertex.child_prior_array
+        if priors is not None:
+            pending = self._pending_successors[vertex]
+            priors = np.append(priors, [successor.prior for successor in pending[:-num_new - 1:-1]])
+        if not super()._admit(vertex, num_new):
+            return False
+
+        vertex.child_prior_array = priors
+        return True
 
-        return self.problem.reward_class(scaled_reward=value)
+    def _admit_successor(self, vertex: AlphaZeroVertex, successor: any) -> AlphaZeroVertex:
+        if isinstance(successor, RankedSuccessor):
+            return self.get_vertex_for_state(successor.state)
+        return super()._admit_successor(vertex, successor)
 
     def run(self, *args, **kwargs) -> ([], float):
         path, reward = MCTS.run(self, *args, **kwargs)
@@ -115,5 +223,24 @@ class AlphaZero(MCTS):
         prior_score = pb_c * child_priors[child]
         return prior_score + child.value
 
-    def _make_new_vertex(self, state: GraphSearchState) -> AlphaZeroVertex:
-        return AlphaZeroVertex(state)
+    def _ucb_scores(self,
+                    parent_visits: int,
+                    visit_counts: np.ndarray,
+                    value_sums: np.ndarray,
+                    priors: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Vectorized version of _ucb_score, scoring all children of a vertex at once from contiguous arrays.
+
+        :param parent_visits: visit count of the parent vertex
+        :param visit_counts: visit counts of each child
+        :param value_sums: value sums of each child
+        :param priors: prior of each child, or None if the parent has not been evaluated yet
+        :return: UCB scores for each child
+        """
+        if priors is None:
+            return np.full(len(visit_counts), math.inf)
+
+        pb_c = np.log((parent_visits + self._pb_c_base + 1) / self._pb_c_base) + self._pb_c_init
+        pb_c = pb_c * (np.sqrt(parent_visits) / (visit_counts + 1))
+        values = np.divide(value_sums, visit_counts, out=np.zeros(len(value_sums)), where=visit_counts != 0)
+        return pb_c * priors + values
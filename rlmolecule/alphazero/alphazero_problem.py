@@ -3,7 +3,7 @@ import os
 import random
 import time
 from abc import abstractmethod
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 import sqlalchemy
@@ -50,6 +50,16 @@ class AlphaZeroProblem(MCTSProblem):
         """
         pass
 
+    def get_values_and_policies(self, parents: List[AlphaZeroVertex]) -> List[Tuple[float, Dict[AlphaZeroVertex, float]]]:
+        """
+        Get value and child prior estimates for several vertices at once. Problems with a costly per-call overhead
+        (such as a neural network evaluation) should override this to evaluate all the given vertices together.
+
+        :param parents: the (expanded, non-terminal) vertices to evaluate
+        :return: a list of (value_of_vertex, {child_vertex: child_prior}) tuples, one per given vertex
+        """
+        return [self.get_value_and_policy(parent) for parent in parents]
+
     @abstractmethod
     def get_policy_inputs(self, state: GraphSearchState) -> {str: np.ndarray}:
         """
@@ -71,32 +81,44 @@ class AlphaZeroProblem(MCTSProblem):
         :param vertex: The vertex for which state rewards are cached
         :return: the scaled reward
         """
+        return self.reward_wrappers([vertex])[0]
 
-        policy_digest, policy_inputs = self._get_policy_inputs_and_digest(vertex)
-
-        existing_record = self.session.query(RewardStore).get((policy_digest, vertex.state.hash(), self.run_id))
-
-        if existing_record is not None:
-            reward = existing_record.reward
-
-        else:
-            reward, data = self.get_reward(vertex.state)
-            record = RewardStore(digest=policy_digest,
-                                 hash=vertex.state.hash(),
-                                 run_id=self.run_id,
-                                 reward=reward,
-                                 data=data)
-
-            try:
-                # Here we handle the possibility of a race condition where another thread has already added the
-                # current state's reward to the database before this thread has completed.
-                self.session.merge(record)
-                self.session.commit()
-            except exc.IntegrityError:
-                logger.debug(f"Duplicate reward entry encountered with {vertex.state}")
-                self.session.rollback()
-
-        return self.reward_class(raw_reward=reward)
+    def reward_wrappers(self, vertices: List[AlphaZeroVertex]) -> List[Reward]:
+        """ See reward_wrapper. The rewards that aren't already in the database are computed together by
+        self.get_rewards
+        """
+        rewards = [None] * len(vertices)
+        missing = []
+        for i, vertex in enumerate(vertices):
+            policy_digest, policy_inputs = self._get_policy_inputs_and_digest(vertex)
+
+            existing_record = self.session.query(RewardStore).get((policy_digest, vertex.state.hash(), self.run_id))
+
+            if existing_record is not None:
+                rewards[i] = existing_record.reward
+            else:
+                missing += [(i, vertex, policy_digest)]
+
+        if missing:
+            computed_rewards = self.get_rewards([vertex.state for _, vertex, _ in missing])
+            for (i, vertex, policy_digest), (reward, data) in zip(missing, computed_rewards):
+                rewards[i] = reward
+                record = RewardStore(digest=policy_digest,
+                                     hash=vertex.state.hash(),
+                                     run_id=self.run_id,
+                                     reward=reward,
+                                     data=data)
+
+                try:
+                    # Here we handle the possibility of a race condition where another thread has already added the
+                    # current state's reward to the database before this thread has completed.
+                    self.session.merge(record)
+                    self.session.commit()
+                except exc.IntegrityError:
+                    logger.debug(f"Duplicate reward entry encountered with {vertex.state}")
+                    self.session.rollback()
+
+        return [self.reward_class(raw_reward=reward) for reward in rewards]
 
     def policy_input_wrapper(self, vertex: AlphaZeroVertex) -> {str: np.ndarray}:
         """ Cache policy inputs in the vertex class. Skip this if we aren't caching policy inputs, i.e., for problems
@@ -1,6 +1,8 @@
 import logging
 from typing import (Dict, Optional)
 
+import numpy as np
+
 from rlmolecule.mcts.mcts_vertex import MCTSVertex
 from rlmolecule.tree_search.graph_search_state import GraphSearchState
 
@@ -15,10 +17,29 @@ class AlphaZeroVertex(MCTSVertex):
     Users must implement a `policy` function, that takes as inputs the next possible actions and returns a value
     score for the current vertex and prior score for each child.
     """
+    __slots__ = ('child_prior_array', 'policy_inputs', 'policy_digest')
 
     def __init__(self, state: GraphSearchState) -> None:
         super().__init__(state)
 
-        self.child_priors: Optional[Dict['AlphaZeroVertex', float]] = None  # lazily initialized
+        # priors of each child, in the same order as self.children
+        self.child_prior_array: Optional['np.ndarray'] = None  # lazily initialized
         self.policy_inputs: Optional[Dict[str, 'np.ndarray']] = None  # lazily initialized
         self.policy_digest: Optional[str] = None  # lazily initialized
+
+    def reset_statistics(self) -> None:
+        super().reset_statistics()
+        self.child_prior_array = None
+
+    @property
+    def child_priors(self) -> Optional[Dict['AlphaZeroVertex', float]]:
+        if self.child_prior_array is None:
+            return None
+        return dict(zip(self.children, self.child_prior_array.tolist()))
+
+    @child_priors.setter
+    def child_priors(self, child_priors: Optional[Dict['AlphaZeroVertex', float]]) -> None:
+        if child_priors is None:
+            self.child_prior_array = None
+        else:
+            self.child_prior_array = np.array([child_priors[child] for child in self.children])
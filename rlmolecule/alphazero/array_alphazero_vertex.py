@@ -0,0 +1,60 @@
+import logging
+from typing import Dict, Optional
+
+from rlmolecule.mcts.array_tree import ArrayMCTSVertex
+
+logger = logging.getLogger(__name__)
+
+
+class ArrayAlphaZeroVertex(ArrayMCTSVertex):
+    """
+    A handle for an AlphaZero vertex of an ArrayTree. Child priors are stored in the tree's edge arrays, and policy
+    inputs and digests in fields of the tree.
+    """
+    __slots__ = ()
+    tree_fields = ('policy_inputs', 'policy_digest')
+
+    def reset_statistics(self) -> None:
+        super().reset_statistics()
+        self.tree.clear_priors(self.id)
+
+    @property
+    def policy_inputs(self) -> Optional[Dict[str, 'np.ndarray']]:
+        return self.tree.fields['policy_inputs'][self.id]
+
+    @policy_inputs.setter
+    def policy_inputs(self, policy_inputs: Optional[Dict[str, 'np.ndarray']]) -> None:
+        self.tree.fields['policy_inputs'][self.id] = policy_inputs
+
+    @property
+    def policy_digest(self) -> Optional[str]:
+        return self.tree.fields['policy_digest'][self.id]
+
+    @policy_digest.setter
+    def policy_digest(self, policy_digest: Optional[str]) -> None:
+        self.tree.fields['policy_digest'][self.id] = policy_digest
+
+    @property
+    def child_prior_array(self) -> Optional['np.ndarray']:
+        return self.tree.priors(self.id)
+
+    @child_prior_array.setter
+    def child_prior_array(self, priors: Optional['np.ndarray']) -> None:
+        if priors is None:
+            self.tree.clear_priors(self.id)
+        else:
+            self.tree.set_priors(self.id, priors)
+
+    @property
+    def child_priors(self) -> Optional[Dict['ArrayAlphaZeroVertex', float]]:
+        priors = self.tree.priors(self.id)
+        if priors is None:
+            return None
+        return dict(zip(self.children, priors.tolist()))
+
+    @child_priors.setter
+    def child_priors(self, child_priors: Optional[Dict['ArrayAlphaZeroVertex', float]]) -> None:
+        if child_priors is None:
+            self.tree.clear_priors(self.id)
+        else:
+            self.tree.set_priors(self.id, [child_priors[child] for child in self.children])
@@ -5,7 +5,7 @@ import time
 from abc import abstractmethod
 from functools import partial
 from pathlib import Path
-from typing import Dict, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 import sqlalchemy
@@ -36,6 +36,10 @@ class TFAlphaZeroProblem(AlphaZeroProblem):
         self.policy_evaluator = tf.function(experimental_relax_shapes=True)(single_position_policy.predict_step)
         self._checkpoint = None
 
+    @property
+    def checkpoint(self) -> Optional[str]:
+        return self._checkpoint
+
     @abstractmethod
     def policy_model(self) -> 'tf.keras.Model':
         pass
@@ -73,15 +77,16 @@ class TFAlphaZeroProblem(AlphaZeroProblem):
         else:
             logger.info('No checkpoint found')
 
-    def _get_batched_policy_inputs(self, parent: AlphaZeroVertex) -> Dict:
+    def _get_batched_policy_inputs(self, *parents: AlphaZeroVertex) -> Dict:
         """
-        :return the given nodes policy inputs, concatenated together with the
-        inputs of its successor nodes. Used as the inputs for the policy neural
-        network
+        :return the given nodes policy inputs, each followed by the inputs of
+        its successor nodes, concatenated together into one padded batch. Used
+        as the inputs for the policy neural network
         """
         # Get the list of policy inputs
         return self._batch_policy_inputs(
-            [self.policy_input_wrapper(vertex) for vertex in itertools.chain((parent,), parent.children)])
+            [self.policy_input_wrapper(vertex)
+             for parent in parents for vertex in itertools.chain((parent,), parent.children)])
 
     def _batch_policy_inputs(self, list_of_policy_inputs: [{str: np.ndarray}]) -> {str: np.ndarray}:
         return {
@@ -93,20 +98,32 @@ class TFAlphaZeroProblem(AlphaZeroProblem):
 
     @collect_metrics
     def get_value_and_policy(self, parent: AlphaZeroVertex) -> Tuple[float, dict]:
+        return self.get_values_and_policies([parent])[0]
+
+    @collect_metrics
+    def get_values_and_policies(self, parents: List[AlphaZeroVertex]) -> List[Tuple[float, dict]]:
+        """
+        Evaluate several vertices with a single call to the policy model. The (parent, children) inputs of each vertex
+        are concatenated into one padded batch, and the outputs are split back by each parent's offset.
+        """
+        offsets = np.cumsum([0] + [1 + len(parent.children) for parent in parents])
+        batch_size = int(offsets[-1])
 
-        values, prior_logits = self.policy_evaluator(self._get_batched_policy_inputs(parent))
+        values, prior_logits = self.policy_evaluator(self._get_batched_policy_inputs(*parents))
+        values = tf.nn.sigmoid(values).numpy().reshape(batch_size, -1)[:, 0]
+        prior_logits = prior_logits.numpy().reshape(batch_size, -1)[:, 0]
 
-        # Softmax the child priors.  Be careful here that you're slicing all needed
-        # dimensions, otherwise you can end up with elementwise softmax (i.e., all 1's).
-        # if this will always be the case.  Might need another level inspection
-        # here for output shape, or enforce an output shape (?).
-        priors = tf.nn.softmax(prior_logits[1:, 0]).numpy().flatten()
+        values_and_policies = []
+        for parent, offset in zip(parents, offsets):
+            # Softmax the child priors, which follow the parent's entry in the batch
+            logits = prior_logits[offset + 1:offset + 1 + len(parent.children)]
+            priors = np.exp(logits - logits.max())
+            priors /= priors.sum()
 
-        # Update child nodes with predicted prior_logits
-        children_priors = {vertex: prior for vertex, prior in zip(parent.children, priors)}
-        value = float(tf.nn.sigmoid(values[0]))
+            children_priors = {vertex: prior for vertex, prior in zip(parent.children, priors)}
+            values_and_policies += [(float(values[offset]), children_priors)]
 
-        return value, children_priors
+        return values_and_policies
 
     def _get_policy_inputs_from_digests(self, digests: 'tf.Tensor') -> Tuple[np.ndarray, ...]:
         """ Get a batched dictionary of policy inputs for the given list of digests
@@ -0,0 +1,212 @@
+import logging
+import os
+from typing import Dict, Hashable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import networkx as nx
+import numpy as np
+
+from rlmolecule.crystal.crystal_state import CrystalState
+from rlmolecule.crystal.utils import PackedStringTable, decode_string, pack_strings
+
+logger = logging.getLogger(__name__)
+
+
+class ActionGraph:
+    """
+    A read-only, integer-indexed copy of a networkx.DiGraph action graph. Nodes are numbered in the graph's node order,
+    and the successors of node i are stored (in the graph's neighbor order) in targets[offsets[i]:offsets[i + 1]],
+    i.e., as a compressed sparse row (CSR) adjacency matrix. The predecessors are stored the same way.
+
+    The subset of the networkx API used by the CrystalBuilder (has_node, out_degree, neighbors, predecessors, nodes)
+    is also available, so an ActionGraph can be used in place of the networkx graph it was built from.
+
+    Action graphs can be saved as a set of .npy files (see save_action_graphs), which are memory-mapped when loaded.
+    """
+
+    def __init__(self,
+                 labels: Union[List[Hashable], PackedStringTable],
+                 offsets: np.ndarray,
+                 targets: np.ndarray,
+                 in_offsets: Optional[np.ndarray] = None,
+                 sources: Optional[np.ndarray] = None,
+                 comp_types: Optional[np.ndarray] = None,
+                 comp_type_ids: Optional[np.ndarray] = None,
+                 ) -> None:
+        """
+        :param labels: The node labels, in id order. Either a list, or a PackedStringTable for loaded graphs
+        :param offsets: The successors of node i are targets[offsets[i]:offsets[i + 1]]
+        :param targets: The successor ids
+        :param in_offsets: The predecessors of node i are sources[in_offsets[i]:in_offsets[i + 1]]. Computed if not given
+        :param sources: The predecessor ids
+        :param comp_types: For the first action graph, the encoded composition type of each composition node (and b''
+            for the other nodes). Only stored in compiled action graphs
+        :param comp_type_ids: For the first action graph, the id in the second action graph of each composition node's
+            composition type (and -1 for the other nodes). Only stored in compiled action graphs
+        """
+        self.labels = labels
+        # a PackedStringTable can also look up ids
+        self.ids: Union[dict, PackedStringTable] = \
+            labels if isinstance(labels, PackedStringTable) else {node: i for i, node in enumerate(labels)}
+        self.offsets = offsets
+        self.targets = targets
+        if in_offsets is None or sources is None:
+            in_offsets, sources = self._build_predecessors()
+        self.in_offsets = in_offsets
+        self.sources = sources
+        # nodes with no successors are the ends of the action graph
+        self.terminal = np.asarray(self.offsets[1:] == self.offsets[:-1])
+        self.comp_types = comp_types
+        self.comp_type_ids = comp_type_ids
+
+    @classmethod
+    def from_networkx(cls, G: nx.DiGraph) -> 'ActionGraph':
+        labels = list(G.nodes())
+        ids = {node: i for i, node in enumerate(labels)}
+        out_degree = np.fromiter((len(G.adj[node]) for node in labels), dtype=np.int64, count=len(labels))
+        offsets = np.zeros(len(labels) + 1, dtype=np.int64)
+        np.cumsum(out_degree, out=offsets[1:])
+        targets = np.fromiter((ids[child] for node in labels for child in G.adj[node]),
+                              dtype=np.int32, count=int(offsets[-1]))
+        return cls(labels, offsets, targets)
+
+    def _build_predecessors(self) -> Tuple[np.ndarray, np.ndarray]:
+        num_nodes = len(self.offsets) - 1
+        sources = np.repeat(np.arange(num_nodes, dtype=np.int32), np.diff(self.offsets))
+        sources = sources[np.argsort(self.targets, kind='stable')]
+        in_offsets = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.targets, minlength=num_nodes), out=in_offsets[1:])
+        return in_offsets, sources
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def __contains__(self, node: Hashable) -> bool:
+        return self.ids.get(node) is not None
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(self.labels)
+
+    def index(self, node: Hashable) -> int:
+        """ :return: the integer id of the given node """
+        node_id = self.ids.get(node)
+        if node_id is None:
+            raise KeyError(f"Node {node} is not in the action graph")
+        return node_id
+
+    def successor_ids(self, node_id: int) -> np.ndarray:
+        return self.targets[self.offsets[node_id]:self.offsets[node_id + 1]]
+
+    def predecessor_ids(self, node_id: int) -> np.ndarray:
+        return self.sources[self.in_offsets[node_id]:self.in_offsets[node_id + 1]]
+
+    def mask(self, nodes: Sequence[Hashable]) -> np.ndarray:
+        """ :return: a boolean array over the node ids, which is True for the given nodes that are in the graph """
+        mask = np.zeros(len(self.labels), dtype=bool)
+        node_ids = (self.ids.get(node) for node in nodes)
+        mask[[node_id for node_id in node_ids if node_id is not None]] = True
+        return mask
+
+    def get_comp_to_comp_type(self) -> Optional[Dict[str, str]]:
+        """ :return: the composition type of each composition, if they were stored with the graph """
+        if self.comp_types is None:
+            return None
+        return {self.labels[i]: decode_string(self.comp_types[i]) for i in np.flatnonzero(self.terminal).tolist()}
+
+    # networkx.DiGraph API
+
+    def has_node(self, node: Hashable) -> bool:
+        return self.ids.get(node) is not None
+
+    def nodes(self, data: bool = False) -> Sequence[Hashable]:
+        assert not data, "ActionGraph nodes don't store any data"
+        return self.labels
+
+    def number_of_nodes(self) -> int:
+        return len(self.labels)
+
+    def number_of_edges(self) -> int:
+        return len(self.targets)
+
+    def out_degree(self, node: Hashable) -> int:
+        node_id = self.index(node)
+        return int(self.offsets[node_id + 1] - self.offsets[node_id])
+
+    def neighbors(self, node: Hashable) -> Iterator[Hashable]:
+        labels = self.labels
+        return (labels[i] for i in self.successor_ids(self.index(node)).tolist())
+
+    successors = neighbors
+
+    def predecessors(self, node: Hashable) -> Iterator[Hashable]:
+        labels = self.labels
+        return (labels[i] for i in self.predecessor_ids(self.index(node)).tolist())
+
+    # compiled action graphs
+
+    def save(self, prefix: str) -> None:
+        """ Write the graph as a set of .npy files starting with the given prefix """
+        labels = self.labels if isinstance(self.labels, PackedStringTable) else \
+            PackedStringTable.from_keys(self.labels)
+        labels.save(f"{prefix}_labels")
+        arrays = {'offsets': self.offsets, 'targets': self.targets, 'in_offsets': self.in_offsets,
+                  'sources': self.sources, 'comp_types': self.comp_types, 'comp_type_ids': self.comp_type_ids}
+        for name, array in arrays.items():
+            if array is not None:
+                np.save(f"{prefix}_{name}.npy", array)
+
+    @classmethod
+    def load(cls, prefix: str, mmap_mode: Optional[str] = 'r') -> 'ActionGraph':
+        """ Load a graph written by `save`. By default, the arrays are memory-mapped rather than read """
+
+        def load_array(name: str) -> Optional[np.ndarray]:
+            array_file = f"{prefix}_{name}.npy"
+            return np.load(array_file, mmap_mode=mmap_mode) if os.path.isfile(array_file) else None
+
+        return cls(PackedStringTable.load(f"{prefix}_labels", mmap_mode=mmap_mode),
+                   load_array('offsets'),
+                   load_array('targets'),
+                   in_offsets=load_array('in_offsets'),
+                   sources=load_array('sources'),
+                   comp_types=load_array('comp_types'),
+                   comp_type_ids=load_array('comp_type_ids'))
+
+
+def save_action_graphs(directory: str, G: Union[nx.DiGraph, ActionGraph], G2: Union[nx.DiGraph, ActionGraph]) -> None:
+    """ Compile the two action graphs, along with the composition type of each composition in the first graph, and
+    write them to the given directory. See `load_action_graphs`.
+
+    :param directory: Output directory, created if needed
+    :param G: The first action graph, going from element combinations to compositions
+    :param G2: The second action graph, going from composition types to decorations
+    """
+    G = G if isinstance(G, ActionGraph) else ActionGraph.from_networkx(G)
+    G2 = G2 if isinstance(G2, ActionGraph) else ActionGraph.from_networkx(G2)
+
+    comp_types = [''] * len(G)
+    comp_type_ids = np.full(len(G), -1, dtype=np.int32)
+    for i in np.flatnonzero(G.terminal).tolist():
+        comp_type = CrystalState.split_comp_to_eles_and_type(G.labels[i])[1]
+        comp_types[i] = comp_type
+        comp_type_ids[i] = G2.ids.get(comp_type, -1)
+    G.comp_types = pack_strings(comp_types)
+    G.comp_type_ids = comp_type_ids
+
+    os.makedirs(directory, exist_ok=True)
+    G.save(os.path.join(directory, 'G'))
+    G2.save(os.path.join(directory, 'G2'))
+    print(f"Wrote action graphs to {directory}: G ({G.number_of_nodes()} nodes, {G.number_of_edges()} edges), "
+          f"G2 ({G2.number_of_nodes()} nodes, {G2.number_of_edges()} edges)")
+
+
+def load_action_graphs(directory: str, mmap_mode: Optional[str] = 'r') -> Tuple[ActionGraph, ActionGraph]:
+    """ Load the action graphs written by `save_action_graphs`
+
+    :param directory: The directory containing the compiled action graphs
+    :param mmap_mode: Passed to np.load. With the default 'r', the graphs are memory-mapped, so they are only read as
+        needed, and their pages are shared between the processes that load them
+    """
+    G = ActionGraph.load(os.path.join(directory, 'G'), mmap_mode=mmap_mode)
+    G2 = ActionGraph.load(os.path.join(directory, 'G2'), mmap_mode=mmap_mode)
+    print(f"Loaded action graphs from {directory}: G ({G.number_of_nodes()} nodes, {G.number_of_edges()} edges), "
+          f"G2 ({G2.number_of_nodes()} nodes, {G2.number_of_edges()} edges)")
+    return G, G2
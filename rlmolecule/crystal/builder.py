@@ -1,11 +1,15 @@
 import logging
 import os, sys
-from typing import Iterable, Optional, Union
-from collections import defaultdict
+import threading
+from typing import Dict, Iterable, Optional, Sequence, Union
+from collections import OrderedDict, defaultdict
 
 import networkx as nx
+import numpy as np
 
-from rlmolecule.crystal.crystal_state import CrystalState
+from rlmolecule.crystal.action_graph import ActionGraph, load_action_graphs
+from rlmolecule.crystal.crystal_state import CompactCrystalState, CrystalState
+from rlmolecule.crystal.decoration_index import DecorationIndex, PrototypeInfo, decoration_index
 
 logger = logging.getLogger(__name__)
 dir_path = os.path.dirname(os.path.realpath(__file__))
@@ -19,12 +23,42 @@ default_action_graph2_file = os.path.join(dir_path,
                                   'comp_type_to_decors_lt50atoms_lt100dist.edgelist.gz')
 
 
+def read_action_graph(action_graph_file: Optional[str] = None) -> nx.DiGraph:
+    """ Read the first action graph, going from element combinations to compositions """
+    action_graph_file = action_graph_file if action_graph_file is not None else default_action_graph_file
+    G = nx.read_edgelist(action_graph_file,
+                         delimiter='\t',
+                         data=False,
+                         create_using=nx.DiGraph())
+    # some of the nodes are meant to be tuples. Fix that here
+    nx.relabel_nodes(G, {n: eval(n) for n in G.nodes(data=False) if '(' in n}, copy=False)
+    print(f"Read G1: {action_graph_file} "
+          f"({G.number_of_nodes()} nodes, {G.number_of_edges()} edges)")
+    return G
+
+
+def read_action_graph2(action_graph2_file: Optional[str] = None) -> nx.DiGraph:
+    """ Read the second action graph, going from composition types to decorations """
+    action_graph2_file = action_graph2_file if action_graph2_file is not None else default_action_graph2_file
+    G2 = nx.read_edgelist(action_graph2_file,
+                          delimiter='\t',
+                          data=False,
+                          create_using=nx.DiGraph())
+    print(f"Read G2: {action_graph2_file} "
+          f"({G2.number_of_nodes()} nodes, {G2.number_of_edges()} edges)")
+    return G2
+
+
 class CrystalBuilder:
     def __init__(self,
                  G: Optional[Union[nx.DiGraph, str]] = None,
                  G2: Optional[Union[nx.DiGraph, str]] = None,
                  actions_to_ignore: Optional[set] = None,
                  prototypes: Optional[dict] = None,
+                 compact_states: bool = False,
+                 successor_cache_size: int = 10000,
+                 action_graphs_dir: Optional[str] = None,
+                 decoration_index_file: Optional[str] = None,
                  ) -> None:
         """A class to build crystals according to a number of different options
 
@@ -35,36 +69,50 @@ class CrystalBuilder:
         Can also specify state representations 
             e.g., Mg1Sc1F5|1_1_5|Orthorhombic|POSCAR_sg62_icsd_261430|2
         structures: Mapping from a decoration string to a pymatgen structure object
+        compact_states: Build CompactCrystalStates, which store interned integer ids rather than strings.
+            Useful to reduce the memory used by large search trees
+        successor_cache_size: Maximum number of states whose next states are cached (least recently used first out),
+            so that repeated expansions of a state, e.g., across games, don't rebuild its children. 0 disables the cache.
+            The cache is cleared whenever the ignore sets are updated through remove_dead_ends.
+            ignore and unignore only drop the entries they affect
+        action_graphs_dir: A directory of compiled action graphs (see action_graph.save_action_graphs) to load
+            instead of G and G2. Much faster to load than the edgelists, and memory-mapped
+        decoration_index_file: A file written by DecorationIndex.save, with the decorations of each composition and
+            prototype stoichiometry, to load into the shared decoration index
         """
 
+        if action_graphs_dir is not None:
+            G, G2 = load_action_graphs(action_graphs_dir)
         if G is None or isinstance(G, str):
-            action_graph_file = G if isinstance(G, str) else default_action_graph_file
-            G = nx.read_edgelist(action_graph_file,
-                                 delimiter='\t',
-                                 data=False,
-                                 create_using=nx.DiGraph())
-            # some of the nodes are meant to be tuples. Fix that here
-            nx.relabel_nodes(G, {n: eval(n) for n in G.nodes(data=False) if '(' in n}, copy=False)
-            print(f"Read G1: {action_graph_file} "
-                  f"({G.number_of_nodes()} nodes, {G.number_of_edges()} edges)")
-
+            G = read_action_graph(G)
         if G2 is None or isinstance(G2, str):
-            action_graph2_file = G2 if isinstance(G2, str) else default_action_graph2_file
-            G2 = nx.read_edgelist(action_graph2_file,
-                                  delimiter='\t',
-                                  data=False,
-                                  create_using=nx.DiGraph())
-            print(f"Read G2: {action_graph2_file} "
-                  f"({G2.number_of_nodes()} nodes, {G2.number_of_edges()} edges)")
+            G2 = read_action_graph2(G2)
 
         self.G = G
         self.G2 = G2
         self.prototypes = prototypes
+        # the stoichiometry and elements of each prototype, used to decorate it
+        self._prototype_infos: Dict[str, PrototypeInfo] = {}
+        if decoration_index_file is not None:
+            decoration_index.load(decoration_index_file)
+        self.state_class = CompactCrystalState if compact_states else CrystalState
+        self.successor_cache_size = successor_cache_size
+        self._successor_cache: OrderedDict = OrderedDict()
+        # the cached states of each action node, so that the entries affected by `ignore` can be dropped
+        self._successor_cache_index = defaultdict(set)
+        self._successor_cache_lock = threading.Lock()
+        self._successor_cache_generation = 0
+        # used by ignore and unignore. See `_init_live_children`
+        self._ignore_lock = threading.Lock()
+        self._explicit_ignores = None
 
         # Update: build the comp_to_comp_type dictionary on the fly
         # the first action graph G ends in the compositions, so we can extract those using the out degree
-        compositions = [n for n in G.nodes() if G.out_degree(n) == 0]
-        self.comp_to_comp_type = {c: CrystalState.split_comp_to_eles_and_type(c)[1] for c in compositions}
+        # (compiled action graphs store it)
+        self.comp_to_comp_type = G.get_comp_to_comp_type() if isinstance(G, ActionGraph) else None
+        if self.comp_to_comp_type is None:
+            compositions = [n for n in G.nodes() if G.out_degree(n) == 0]
+            self.comp_to_comp_type = {c: CrystalState.split_comp_to_eles_and_type(c)[1] for c in compositions}
         self.comp_type_to_comp = defaultdict(set)
         for comp, comp_type in self.comp_to_comp_type.items():
             self.comp_type_to_comp[comp_type].add(comp)
@@ -80,19 +128,17 @@ class CrystalBuilder:
             for a in actions_to_ignore:
                 # if a state that has a composition and an action from G2 is given, skip those separately 
                 # e.g., Mg1Sc1F5|1_1_5|Orthorhombic|POSCAR_sg62_icsd_261430|2
-                if isinstance(a, str):
-                    comp = a.split('|')[0]
-                    action_node = '|'.join(a.split('|')[1:])
-                if G.has_node(a):
-                    self.actions_to_ignore.add(a)
-                elif G2.has_node(a):
-                    self.actions_to_ignore_G2.add(a)
-                elif isinstance(a, str) and \
-                     G.has_node(comp) and \
-                     G2.has_node(action_node):
-                    self.states_to_ignore[comp].add(action_node)
-                else:
+                action = self._parse_action(a)
+                if action is None:
                     actions_not_recognized.add(a)
+                    continue
+                graph, action_node, comp = action
+                if graph == 'G':
+                    self.actions_to_ignore.add(action_node)
+                elif comp is None:
+                    self.actions_to_ignore_G2.add(action_node)
+                else:
+                    self.states_to_ignore[comp].add(action_node)
             print(f"{len(self.actions_to_ignore)} and {len(self.actions_to_ignore_G2)} "
                    "actions to ignore in G and G2, respectively")
             if len(self.states_to_ignore) > 0:
@@ -103,6 +149,20 @@ class CrystalBuilder:
                     print(actions_not_recognized)
             # check to make sure there are no dead-ends e.g., compositions with no prototypes available
             self.remove_dead_ends()
+        else:
+            self._on_ignore_sets_changed()
+
+    def _on_ignore_sets_changed(self) -> None:
+        """ Called once the ignore sets (actions_to_ignore, actions_to_ignore_G2 and states_to_ignore) are set up,
+        and again whenever they're updated by remove_dead_ends. Subclasses can use this to rebuild anything derived
+        from them.
+        """
+        with self._successor_cache_lock:
+            self._successor_cache.clear()
+            self._successor_cache_index.clear()
+            self._successor_cache_generation += 1
+        # the live children counts are rebuilt from the new ignore sets when next needed
+        self._explicit_ignores = None
 
     def __call__(self, parent_state: any) -> Iterable[any]:
         # inputs = [parent_state]
@@ -115,8 +175,50 @@ class CrystalBuilder:
         """
         For the given state, find the next possible states in the action graphs
         """
+        if self.successor_cache_size <= 0:
+            return [self.materialize(descriptor) for descriptor in self.find_next_action_descriptors(crystal_state)]
+
+        with self._successor_cache_lock:
+            next_states = self._successor_cache.get(crystal_state)
+            if next_states is not None:
+                self._successor_cache.move_to_end(crystal_state)
+                return list(next_states)
+            generation = self._successor_cache_generation
+
+        next_states = [self.materialize(descriptor) for descriptor in self.find_next_action_descriptors(crystal_state)]
+        with self._successor_cache_lock:
+            if generation != self._successor_cache_generation:
+                # the ignore sets changed while these states were built
+                return list(next_states)
+            self._successor_cache[crystal_state] = next_states
+            self._successor_cache_index[crystal_state.action_node].add(crystal_state)
+            if len(self._successor_cache) > self.successor_cache_size:
+                evicted_state, _ = self._successor_cache.popitem(last=False)
+                self._discard_from_successor_index(evicted_state)
+        return list(next_states)
+
+    def _discard_from_successor_index(self, crystal_state: CrystalState) -> None:
+        cached_states = self._successor_cache_index.get(crystal_state.action_node)
+        if cached_states is not None:
+            cached_states.discard(crystal_state)
+            if len(cached_states) == 0:
+                del self._successor_cache_index[crystal_state.action_node]
+
+    def _invalidate_successors(self, action_node: any, composition: Optional[str] = None) -> None:
+        """ Drop the cached next states of the states at the given action node (only for the given composition,
+        if set). Must be called with the successor cache lock held """
+        for cached_state in list(self._successor_cache_index.get(action_node, ())):
+            if composition is None or cached_state.composition == composition:
+                del self._successor_cache[cached_state]
+                self._discard_from_successor_index(cached_state)
+
+    def find_next_action_descriptors(self, crystal_state: CrystalState) -> Sequence[Union[tuple, CrystalState]]:
+        """
+        For the given state, find the next possible actions in the action graphs, as lightweight
+        (action_node, composition, terminal) tuples. See `materialize` to build the corresponding states.
+        """
         n = crystal_state.action_node
-        next_states = []
+        next_actions = []
         node_found_G = False
         node_found_G2 = False
         if self.G.has_node(n):
@@ -133,11 +235,8 @@ class CrystalBuilder:
                     # if this is not a branch of the tree we want to follow, then skip it
                     if neighbor in self.actions_to_ignore:
                         continue
-                    next_state = CrystalState(action_node=neighbor,
-                                              composition=composition,
-                                              )
-                    next_states.append(next_state)
-                return next_states
+                    next_actions.append((neighbor, composition, False))
+                return next_actions
 
         if self.G2.has_node(n):
             node_found_G2 = True
@@ -156,18 +255,8 @@ class CrystalBuilder:
                     terminal = False
                     if self.G2.out_degree(neighbor) == 0:
                         terminal = True
-                    next_state = CrystalState(action_node=neighbor,
-                                              composition=crystal_state.composition,
-                                              # structure=decorated_structure,
-                                              terminal=terminal,
-                                              )
-                    if terminal and self.prototypes is not None:
-                        # add the element replacements to the state
-                        structure_key = '|'.join(next_state.action_node.split('|')[:-1])
-                        icsd_prototype = self.prototypes[structure_key]
-                        next_state.set_proto_ele_replacements(icsd_prototype)
-                    next_states.append(next_state)
-                return next_states
+                    next_actions.append((neighbor, crystal_state.composition, terminal))
+                return next_actions
 
         if node_found_G is False and node_found_G2 is False:
             raise (f"StateNotFound: Action node '{n}' was not in either action graph.")
@@ -175,6 +264,29 @@ class CrystalBuilder:
             raise (f"StateNotFound: Action node '{crystal_state.action_node}' "
                    f"comp_type '{n}' not found in G2")
 
+    def materialize(self, descriptor: Union[tuple, CrystalState]) -> CrystalState:
+        """
+        Build the state for an action descriptor returned by `find_next_action_descriptors`
+        """
+        if isinstance(descriptor, CrystalState):
+            return descriptor
+
+        action_node, composition, terminal = descriptor
+        next_state = self.state_class(action_node=action_node,
+                                      composition=composition,
+                                      # structure=decorated_structure,
+                                      terminal=terminal,
+                                      )
+        if terminal and self.prototypes is not None:
+            # add the element replacements to the state. They're only computed when used
+            structure_key = action_node[:action_node.rindex('|')]
+            prototype_info = self._prototype_infos.get(structure_key)
+            if prototype_info is None:
+                prototype_info = DecorationIndex.get_prototype_info(self.prototypes[structure_key])
+                self._prototype_infos[structure_key] = prototype_info
+            next_state.set_prototype_info(prototype_info)
+        return next_state
+
     def remove_dead_ends(self,
                          #new_actions_to_ignore=None,
                          #new_actions_to_ignore_G2=None,
@@ -229,6 +341,7 @@ class CrystalBuilder:
                 self.actions_to_ignore.add(c)
                 del self.states_to_ignore[c]
 
+        self._on_ignore_sets_changed()
         return
 
     def find_dead_ends(self, G, actions_to_ignore):
@@ -258,3 +371,293 @@ class CrystalBuilder:
         parents_to_ignore |= self.find_dead_ends(G, parents_to_ignore)
         return parents_to_ignore
 
+    def _parse_action(self, action: any) -> Optional[tuple]:
+        """ :return: the (graph, action_node, composition) of an action to ignore, where graph is 'G' or 'G2',
+        and composition is only set for states of G2, or None if the action isn't in the action graphs """
+        if isinstance(action, CrystalState):
+            if self.G.has_node(action.action_node):
+                return 'G', action.action_node, None
+            if self.G2.has_node(action.action_node):
+                return 'G2', action.action_node, action.composition
+            return None
+        if self.G.has_node(action):
+            return 'G', action, None
+        if self.G2.has_node(action):
+            return 'G2', action, None
+        if isinstance(action, str):
+            comp = action.split('|')[0]
+            action_node = '|'.join(action.split('|')[1:])
+            if self.G.has_node(comp) and self.G2.has_node(action_node):
+                return 'G2', action_node, comp
+        return None
+
+    def ignore(self, action: any) -> None:
+        """ Ignore an action node or state, and any of its ancestors left without a child to explore,
+        without recomputing all of the dead ends as remove_dead_ends does.
+        The number of live (i.e., not ignored) children of each node is kept, so only the affected ancestors are
+        visited. Useful to continuously prune the decorations that were already evaluated.
+
+        action: An action node of G or G2, a CrystalState, or a state representation,
+            e.g., Mg1Sc1F5|1_1_5|Orthorhombic|POSCAR_sg62_icsd_261430|2
+        """
+        self._update_ignored(action, True)
+
+    def unignore(self, action: any) -> None:
+        """ Undo `ignore` for an action node or state, and explore the ancestors that were only ignored because of it
+        again. Nodes that are still dead-ends, e.g., a prototype whose decorations are all ignored, stay ignored.
+        """
+        self._update_ignored(action, False)
+
+    def _init_live_children(self) -> None:
+        # The nodes in the current ignore sets are taken as ignored explicitly, as they could have been given
+        # as actions_to_ignore. The ignore sets then also hold the dead-ends found by ignore, which are kept apart
+        # so that unignore can revive them
+        self._explicit_ignores = {'G': set(self.actions_to_ignore),
+                                  'G2': set(self.actions_to_ignore_G2),
+                                  'states': defaultdict(set, {comp: set(action_nodes) for comp, action_nodes
+                                                              in self.states_to_ignore.items()})}
+        # number of children that aren't ignored, for the nodes visited so far
+        self._live_children = {}
+        self._live_children_G2 = {}
+        # for states_to_ignore, the children of a G2 node that are ignored depend on the composition
+        self._live_children_states = defaultdict(dict)
+        self._live_children_compositions = defaultdict(set)
+
+    def _count_live_children(self, graph: str, node: any, comp: Optional[str] = None) -> int:
+        """ :return: the number of children of the node that aren't ignored (for the given composition, if set) """
+        if graph == 'G':
+            counts = self._live_children
+            ignored = self.actions_to_ignore
+            num_live = counts.get(node)
+            if num_live is None:
+                num_live = counts[node] = sum(1 for child in self.G.neighbors(node) if child not in ignored)
+            return num_live
+
+        ignored = self.actions_to_ignore_G2
+        if comp is None:
+            counts = self._live_children_G2
+            num_live = counts.get(node)
+            if num_live is None:
+                num_live = counts[node] = sum(1 for child in self.G2.neighbors(node) if child not in ignored)
+            return num_live
+
+        counts = self._live_children_states[comp]
+        num_live = counts.get(node)
+        if num_live is None:
+            comp_ignored = self.states_to_ignore.get(comp, ())
+            num_live = counts[node] = sum(1 for child in self.G2.neighbors(node)
+                                          if child not in ignored and child not in comp_ignored)
+            self._live_children_compositions[node].add(comp)
+        return num_live
+
+    def _update_live_children(self, graph: str, node: any, delta: int, comp: Optional[str] = None) -> None:
+        """ Add delta to the live children count of the node (if it was already counted) """
+        if graph == 'G':
+            counts = self._live_children
+        elif comp is None:
+            counts = self._live_children_G2
+        else:
+            counts = self._live_children_states[comp]
+        if node in counts:
+            counts[node] += delta
+
+    def _is_dead_end(self, graph: str, node: any, comp: Optional[str] = None) -> bool:
+        """ :return: True if the node should be in its ignore set, i.e., if it was ignored explicitly,
+        or if none of its children are left to explore """
+        if graph == 'G':
+            if node in self._explicit_ignores['G']:
+                return True
+            if self.G.out_degree(node) > 0:
+                return self._count_live_children('G', node) == 0
+            # a composition is a dead-end if its composition type is
+            comp_type = self.comp_to_comp_type.get(node)
+            if comp_type is None or not self.G2.has_node(comp_type):
+                return False
+            return comp_type in self.actions_to_ignore_G2 or comp_type in self.states_to_ignore.get(node, ())
+
+        if node in (self._explicit_ignores['G2'] if comp is None else self._explicit_ignores['states'][comp]):
+            return True
+        return self.G2.out_degree(node) > 0 and self._count_live_children('G2', node, comp) == 0
+
+    def _update_ignored(self, action: any, ignore: bool) -> None:
+        parsed_action = self._parse_action(action)
+        if parsed_action is None:
+            raise ValueError(f"Action '{action}' was not found in the action graphs")
+        graph, action_node, comp = parsed_action
+
+        with self._ignore_lock:
+            if self._explicit_ignores is None:
+                self._init_live_children()
+            explicit = self._explicit_ignores[graph] if comp is None else self._explicit_ignores['states'][comp]
+            if ignore:
+                explicit.add(action_node)
+            else:
+                explicit.discard(action_node)
+
+            # propagate the change up the action graphs, as long as the ignored status of the nodes changes
+            changes = []
+            to_check = [(graph, action_node, comp)]
+            while to_check:
+                graph, node, comp = to_check.pop()
+                dead_end = self._is_dead_end(graph, node, comp)
+                if graph == 'G':
+                    ignored = self.actions_to_ignore
+                elif comp is None:
+                    ignored = self.actions_to_ignore_G2
+                else:
+                    ignored = self.states_to_ignore.get(comp, ())
+                if dead_end == (node in ignored):
+                    continue
+                self._set_ignored(graph, node, dead_end, comp)
+                changes.append((graph, node, comp))
+                delta = -1 if dead_end else 1
+
+                if graph == 'G':
+                    for parent in self.G.predecessors(node):
+                        self._update_live_children('G', parent, delta)
+                        to_check.append(('G', parent, None))
+                    continue
+
+                globally_ignored = node in self.actions_to_ignore_G2
+                for parent in self.G2.predecessors(node):
+                    if comp is None:
+                        self._update_live_children('G2', parent, delta)
+                        to_check.append(('G2', parent, None))
+                        # the compositions with their own ignored nodes under the parent
+                        for parent_comp in list(self._live_children_compositions.get(parent, ())):
+                            if node not in self.states_to_ignore.get(parent_comp, ()):
+                                self._update_live_children('G2', parent, delta, parent_comp)
+                                to_check.append(('G2', parent, parent_comp))
+                    else:
+                        # make sure the composition's count of the parent's children is kept from now on
+                        if parent in self._live_children_states[comp]:
+                            if not globally_ignored:
+                                self._update_live_children('G2', parent, delta, comp)
+                        else:
+                            self._count_live_children('G2', parent, comp)
+                        to_check.append(('G2', parent, comp))
+                # the composition type is the root of each composition's decorations
+                if comp is None:
+                    to_check.extend(('G', c, None) for c in self.comp_type_to_comp.get(node, ()))
+                elif self.comp_to_comp_type.get(comp) == node:
+                    to_check.append(('G', comp, None))
+
+            if changes:
+                self._on_ignored_changed(changes)
+
+    def _set_ignored(self, graph: str, node: any, ignored: bool, comp: Optional[str] = None) -> None:
+        """ Add or remove a node from its ignore set """
+        if graph == 'G':
+            ignore_set = self.actions_to_ignore
+        elif comp is None:
+            ignore_set = self.actions_to_ignore_G2
+        else:
+            ignore_set = self.states_to_ignore[comp]
+        if ignored:
+            ignore_set.add(node)
+        else:
+            ignore_set.discard(node)
+            if comp is not None and len(ignore_set) == 0:
+                del self.states_to_ignore[comp]
+
+    def _on_ignored_changed(self, changes: Sequence[tuple]) -> None:
+        """ Called by ignore and unignore with the (graph, node, composition) whose ignored status changed.
+        Drops the cached next states that listed those nodes """
+        with self._successor_cache_lock:
+            self._successor_cache_generation += 1
+            for graph, node, comp in changes:
+                if graph == 'G':
+                    for parent in self.G.predecessors(node):
+                        self._invalidate_successors(parent)
+                    continue
+                for parent in self.G2.predecessors(node):
+                    self._invalidate_successors(parent, comp)
+                    # the children of a composition type are listed by the states of its compositions
+                    compositions = self.comp_type_to_comp.get(parent, ()) if comp is None else \
+                        ([comp] if self.comp_to_comp_type.get(comp) == parent else [])
+                    for c in compositions:
+                        self._invalidate_successors(c, c)
+
+
+class CSRCrystalBuilder(CrystalBuilder):
+    """
+    A CrystalBuilder that compiles the action graphs into integer-indexed ActionGraphs (CSR arrays), and keeps the
+    ignore sets as boolean masks over their nodes. Finding the next actions of a state is then an array slice plus a
+    mask, rather than a walk over the networkx adjacency with set lookups for every neighbor.
+
+    The ignore sets are still the reference, and the masks are rebuilt whenever remove_dead_ends is called, and updated
+    by ignore and unignore, so they should be updated the same way as for the CrystalBuilder.
+    """
+
+    def __init__(self,
+                 G: Optional[Union[nx.DiGraph, ActionGraph, str]] = None,
+                 G2: Optional[Union[nx.DiGraph, ActionGraph, str]] = None,
+                 action_graphs_dir: Optional[str] = None,
+                 **kwargs,
+                 ) -> None:
+        """ See CrystalBuilder. G and G2 can also be ActionGraphs """
+        if action_graphs_dir is not None:
+            G, G2 = load_action_graphs(action_graphs_dir)
+        if G is None or isinstance(G, str):
+            G = read_action_graph(G)
+        if G2 is None or isinstance(G2, str):
+            G2 = read_action_graph2(G2)
+        G = G if isinstance(G, ActionGraph) else ActionGraph.from_networkx(G)
+        G2 = G2 if isinstance(G2, ActionGraph) else ActionGraph.from_networkx(G2)
+        super().__init__(G, G2, **kwargs)
+
+        # For each composition node in G, the id of its composition type (the root of its decorations) in G2
+        self._comp_type_ids = G.comp_type_ids
+        if self._comp_type_ids is None:
+            self._comp_type_ids = np.full(len(G), -1, dtype=np.int64)
+            for comp, comp_type in self.comp_to_comp_type.items():
+                self._comp_type_ids[G.index(comp)] = G2.ids.get(comp_type, -1)
+
+    def _on_ignore_sets_changed(self) -> None:
+        super()._on_ignore_sets_changed()
+        self._ignore_mask = self.G.mask(self.actions_to_ignore)
+        self._ignore_mask2 = self.G2.mask(self.actions_to_ignore_G2)
+        self._states_to_ignore_ids = {comp: np.flatnonzero(self.G2.mask(action_nodes))
+                                      for comp, action_nodes in self.states_to_ignore.items()}
+
+    def _set_ignored(self, graph: str, node: any, ignored: bool, comp: Optional[str] = None) -> None:
+        super()._set_ignored(graph, node, ignored, comp)
+        if graph == 'G':
+            self._ignore_mask[self.G.index(node)] = ignored
+        elif comp is None:
+            self._ignore_mask2[self.G2.index(node)] = ignored
+        elif comp in self.states_to_ignore:
+            self._states_to_ignore_ids[comp] = np.fromiter(
+                (self.G2.index(action_node) for action_node in self.states_to_ignore[comp]), dtype=np.int64)
+        else:
+            self._states_to_ignore_ids.pop(comp, None)
+
+    def find_next_action_descriptors(self, crystal_state: CrystalState) -> Sequence[Union[tuple, CrystalState]]:
+        n = crystal_state.action_node
+        node_id = self.G.ids.get(n)
+        if node_id is not None:
+            if not self.G.terminal[node_id]:
+                children = self.G.successor_ids(node_id)
+                children = children[~self._ignore_mask[children]]
+                labels = self.G.labels
+                # the nodes at the end of the first graph are compositions
+                return [(labels[child], labels[child] if is_composition else None, False)
+                        for child, is_composition in zip(children.tolist(), self.G.terminal[children].tolist())]
+            node_id = self._comp_type_ids[node_id]
+        else:
+            node_id = self.G2.ids.get(n, -1)
+
+        if node_id < 0 or self.G2.terminal[node_id]:
+            # states that aren't in the action graphs, or that have no decorations, are handled by the CrystalBuilder
+            return super().find_next_action_descriptors(crystal_state)
+
+        children = self.G2.successor_ids(node_id)
+        keep = ~self._ignore_mask2[children]
+        states_to_ignore = self._states_to_ignore_ids.get(crystal_state.composition)
+        if states_to_ignore is not None:
+            keep &= ~np.isin(children, states_to_ignore)
+        children = children[keep]
+        labels = self.G2.labels
+        composition = crystal_state.composition
+        return [(labels[child], composition, terminal)
+                for child, terminal in zip(children.tolist(), self.G2.terminal[children].tolist())]
@@ -1,12 +1,14 @@
 
 import logging
-from collections import Counter
-from typing import Dict, List, Optional, Tuple
+from collections import Counter, OrderedDict
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple, Union
 import numpy as np
 import pandas as pd
 import tensorflow as tf
 import tensorflow_addons as tfa
 from tqdm import tqdm
+import threading
 import time
 from pymatgen.core import Composition, Structure
 from pymatgen.analysis.phase_diagram import PhaseDiagram, PDEntry
@@ -14,6 +16,8 @@ from pymatgen.analysis.structure_prediction.volume_predictor import DLSVolumePre
 from nfp.preprocessing.crystal_preprocessor import PymatgenPreprocessor
 
 from rlmolecule.crystal.crystal_state import CrystalState
+from rlmolecule.crystal.energy_predictor import EnergyPredictor
+from rlmolecule.crystal.pipeline import Pipeline, PipelineFailure, PipelineStage
 from rlmolecule.crystal import reward_utils
 from rlmolecule.crystal import ehull
 from rlmolecule.tree_search.metrics import collect_metrics
@@ -21,10 +25,17 @@ from rlmolecule.tree_search.metrics import collect_metrics
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# the CrystalStateReward of a worker process, see CrystalStateReward.get_rewards
+_worker_rewarder = None
 
-@tf.function(experimental_relax_shapes=True)
-def predict(model: 'tf.keras.Model', inputs):
-    return model.predict_step(inputs)
+
+def _init_worker(rewarder: 'CrystalStateReward') -> None:
+    global _worker_rewarder
+    _worker_rewarder = rewarder
+
+
+def _run_worker_stage(stage_name: str, records: List[dict]) -> List[dict]:
+    return dict(_worker_rewarder.reward_stages())[stage_name](records)
 
 
 class StructureRewardBattInterface:
@@ -32,21 +43,26 @@ class StructureRewardBattInterface:
     """
 
     def __init__(self,
-                 competing_phases: List[PDEntry],
+                 competing_phases: Union[List[PDEntry], ehull.CompetingPhaseIndex],
                  reward_weights: dict = None,
                  reward_cutoffs: dict = None,
                  cutoff_penalty: float = 2,
                  sub_rewards: Optional[List[str]] = None,
+                 phase_diagram_cache_size: int = 1024,
                  **kwargs) -> None:
         """ A class to estimate the suitability of a crystal structure as a solid state battery interface.
 
-        :param competing_phases: list of competing phases used to 
+        :param competing_phases: list (or index) of competing phases used to 
             construct the convex hull for the elements of the given composition
         :param reward_weights: Weights specifying how the individual rewards will be combined.
         For example: `{"decomp_energy": 0.5, "cond_ion_frac": 0.1, [...]}`
         :param sub_rewards: Use only the specified sub rewards e.g., ['decomp_energy']
+        :param phase_diagram_cache_size: Number of chemical systems whose phase diagram is kept. See PhaseDiagramCache
         """
+        if not isinstance(competing_phases, ehull.CompetingPhaseIndex):
+            competing_phases = ehull.CompetingPhaseIndex(competing_phases)
         self.competing_phases = competing_phases
+        self.phase_diagram_cache = ehull.PhaseDiagramCache(competing_phases, max_size=phase_diagram_cache_size)
         self.reward_weights = reward_weights
         self.reward_cutoffs = reward_cutoffs
         self.sub_rewards = sub_rewards
@@ -113,6 +129,7 @@ class StructureRewardBattInterface:
                        structure: Structure,
                        predicted_energy: float = None,
                        state: CrystalState = None,
+                       hull_stability: Optional[Tuple[float, Optional[Tuple[float, float]]]] = None,
                        ):
         """
         The following sub-rewards are combined:
@@ -124,6 +141,9 @@ class StructureRewardBattInterface:
         5. Oxidation potential
         6. Electrochemical stability window:
             difference between 4. and 5.
+
+        :param hull_stability: The decomposition energy and stability window of the structure, if already computed
+            by ehull.convex_hull_stabilities
         
         Returns:
             float: reward
@@ -135,11 +155,14 @@ class StructureRewardBattInterface:
             decomp_energy = self.default_decomp_energy
         else:
             info.update({'predicted_energy': predicted_energy})
-            decomp_energy, stability_window = ehull.convex_hull_stability(
-                    structure.composition,
-                    predicted_energy,
-                    self.competing_phases,
-            )
+            if hull_stability is None:
+                hull_stability = ehull.convex_hull_stability(
+                        structure.composition,
+                        predicted_energy,
+                        self.competing_phases,
+                        phase_diagram_cache=self.phase_diagram_cache,
+                )
+            decomp_energy, stability_window = hull_stability
             if decomp_energy is None:
                 # subtract 1 to the default energy to distinguish between
                 # failed calculation here, and failing to decorate the structure 
@@ -180,18 +203,6 @@ class StructureRewardBattInterface:
 
         return combined_reward, info
 
-    # This actually takes longer than just computing the convex hull each time
-#    def precompute_convex_hulls(self, compositions):
-#        self.phase_diagrams = {}
-#        for comp in tqdm(compositions):
-#            comp = Composition(comp)
-#            elements = set(comp.elements)
-#            curr_entries = [e for e in self.competing_phases
-#                            if len(set(e.composition.elements) - elements) == 0]
-#
-#            phase_diagram = PhaseDiagram(curr_entries, elements=elements)
-#            self.phase_diagrams[comp] = phase_diagram
-
     def combine_rewards(self, raw_scores, return_weighted=False) -> float:
         """ Take the weighted average of the normalized sub-rewards
         For example, decomposition energy: 1.2, conducting ion frac: 0.1.
@@ -262,23 +273,31 @@ class StructureRewardBattInterface:
 
 
 class CrystalStateReward(StructureRewardBattInterface):
-    """ Compute the reward for terminal states in the action space
+    """ Compute the reward for terminal states in the action space.
+
+    The worker processes started by get_rewards are stopped by `close`, when the rewarder is garbage collected,
+    or when it's used as a context manager:
+
+        with CrystalStateReward(...) as rewarder:
+            rewards = rewarder.get_rewards(states, use_processes=True)
     """
 
     def __init__(self,
-                 competing_phases: List[PDEntry],
+                 competing_phases: Union[List[PDEntry], ehull.CompetingPhaseIndex],
                  prototypes: Dict[str, Structure],
                  energy_model: 'tf.keras.Model',
                  preprocessor: PymatgenPreprocessor,
                  #dist_model: 'tf.keras.Model',
                  vol_pred_site_bias: Optional['pd.Series'] = None,
                  default_reward: float = 0,
+                 structure_cache_size: int = 1024,
+                 energy_bucket_sizes: Optional[List[int]] = None,
                  **kwargs) -> None:
         """ A class to estimate the suitability of a crystal structure as a solid state battery interface.
         Starting from a terminal state, this class will build the structure, predict the total energy, 
         calculate the individual rewards, and combine them together.
 
-        :param competing_phases: list of competing phases used to 
+        :param competing_phases: list (or index) of competing phases used to 
             construct the convex hull for the elements of the given composition
         :param prototypes: Dictionary mapping from prototype ID to structure. Used for decorating new structures
         :param energy_model: A tensorflow model to estimate the total energy of a structure
@@ -289,47 +308,265 @@ class CrystalStateReward(StructureRewardBattInterface):
             before passing it to the GNN. Uses the linear model + pymatgen's DLS predictor
 
         :param default_reward: Reward given to structures that failed to decorate
+        :param structure_cache_size: Number of recently decorated structures to keep, keyed by state repr,
+            so that states evaluated again (e.g., by different games) aren't decorated again. 0 disables the cache
+        :param energy_bucket_sizes: Sizes to which the energy model inputs are padded. See EnergyPredictor
         """
         self.prototypes = prototypes
         self.energy_model = energy_model
         self.preprocessor = preprocessor
+        # the energy model can be left out to only decorate structures
+        self.energy_predictor = None
+        if energy_model is not None:
+            self.energy_predictor = EnergyPredictor(energy_model,
+                                                    output_signature=preprocessor.output_signature,
+                                                    padding_values=preprocessor.padding_values,
+                                                    bucket_sizes=energy_bucket_sizes)
         #self.dist_model = dist_model
         self.vol_pred_site_bias = vol_pred_site_bias
         self.dls_vol_predictor = DLSVolumePredictor()
         self.default_reward = default_reward
+        self.structure_cache_size = structure_cache_size
+        self._structure_cache: OrderedDict = OrderedDict()
+        self._structure_cache_lock = threading.Lock()
+        # the pipelines of get_rewards, by their settings, so that their worker processes are reused
+        self._pipelines: Dict[tuple, Pipeline] = {}
+        self._pipelines_lock = threading.Lock()
         
         super(CrystalStateReward, self).__init__(competing_phases, **kwargs)
 
+    def __getstate__(self) -> dict:
+        # the energy model isn't copied to worker processes, and each process keeps its own structure cache
+        state = self.__dict__.copy()
+        for name in ('energy_model', 'energy_predictor', '_structure_cache', '_structure_cache_lock',
+                     '_pipelines', '_pipelines_lock'):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.energy_model = None
+        self.energy_predictor = None
+        self._structure_cache = OrderedDict()
+        self._structure_cache_lock = threading.Lock()
+        self._pipelines = {}
+        self._pipelines_lock = threading.Lock()
+
     @collect_metrics
     def get_reward(self, state: CrystalState) -> Tuple[float, dict]:
         """ Get the reward for the given crystal state. 
         This function first generates the structure by decorating the state's selected prototype.
         Then it predicts the total energy using the energy model 
         """
-        if not state.terminal:
-            return self.default_reward, {'terminal': False,
-                                         'state_repr': repr(state)}
-        info = {}
-        structure = self.generate_structure(state)
-        if structure is None:
-            return self.default_reward, {'terminal': True,
-                                         'state_repr': repr(state)}
-
-        info.update({'terminal': True,
-                     'num_sites': len(structure.sites),
-                     'volume': structure.volume,
-                     'state_repr': repr(state),
-                     })
-
-        # Predict the total energy of this decorated structure
-        predicted_energy = self.predict_energy(structure, state)
-        reward, reward_info = self.compute_reward(structure,
-                                                  predicted_energy,
-                                                  state)
-        info.update(reward_info)
-        return reward, info
+        records = [{'state': state}]
+        for _, stage_function in self.reward_stages():
+            records = stage_function(records)
+        self._cache_structures(records)
+        return records[0]['reward'], records[0]['info']
+
+    def get_rewards(self,
+                    states: List[CrystalState],
+                    num_workers: Optional[Dict[str, int]] = None,
+                    use_processes: bool = False,
+                    batch_size: int = 64,
+                    queue_size: int = 64,
+                    ) -> List[Tuple[float, dict]]:
+        """ Get the rewards of several crystal states. The steps of get_reward (decoration, volume scaling,
+        preprocessing, energy prediction and scoring) run concurrently as the stages of a Pipeline,
+        so that different states can be at different steps, and the energies are predicted and scored in batches.
+
+        :param states: The states to score
+        :param num_workers: Number of workers of each stage, by stage name (see `reward_stages`). Defaults to 1
+        :param use_processes: Run the stages other than the energy prediction in worker processes rather than threads.
+            Each process gets a copy of this object (without the energy model). The processes are kept for the
+            following calls with the same settings, along with their caches, until `close` is called
+        :param batch_size: Maximum number of structures whose energy is predicted together,
+            and whose decomposition energy is computed together (see ehull.convex_hull_stabilities)
+        :param queue_size: Maximum number of states waiting between two stages
+        :return: The reward and info of each state, as returned by get_reward. States whose reward couldn't be
+            computed get the default reward, and the name of the stage that failed in their info
+        """
+        if len(states) <= 1:
+            # not worth starting the pipeline's workers
+            return [self.get_reward(state) for state in states]
+
+        num_workers = num_workers if num_workers is not None else {}
+        pipeline = self._get_pipeline(num_workers, use_processes, batch_size, queue_size)
+        records = pipeline.run({'state': state} for state in states)
+        for i, (state, record) in enumerate(zip(states, records)):
+            if isinstance(record, PipelineFailure):
+                records[i] = {'state': state, 'structure': None, 'reward': self.default_reward,
+                              'info': {'terminal': state.terminal, 'state_repr': repr(state),
+                                       'failed_stage': record.stage}}
+        self._cache_structures(records)
+        return [(record['reward'], record['info']) for record in records]
+
+    def _get_pipeline(self,
+                      num_workers: Dict[str, int],
+                      use_processes: bool,
+                      batch_size: int,
+                      queue_size: int,
+                      ) -> Pipeline:
+        key = (tuple(sorted(num_workers.items())), use_processes, batch_size, queue_size)
+        with self._pipelines_lock:
+            pipeline = self._pipelines.get(key)
+            if pipeline is None:
+                stages = []
+                for name, stage_function in self.reward_stages():
+                    # the energy model stays in this process
+                    processes = use_processes and name != 'predict'
+                    stages.append(PipelineStage(name,
+                                                partial(_run_worker_stage, name) if processes else stage_function,
+                                                num_workers=num_workers.get(name, 1),
+                                                processes=processes,
+                                                batch_size=batch_size if name in ('predict', 'score') else 1))
+                pipeline = Pipeline(stages, queue_size=queue_size, initializer=_init_worker, initargs=(self,))
+                self._pipelines[key] = pipeline
+            return pipeline
+
+    def __enter__(self) -> 'CrystalStateReward':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        if getattr(self, '_pipelines', None):
+            self.close(wait=False)
+
+    def close(self, wait: bool = True) -> None:
+        """ Stop the worker processes of get_rewards
+
+        :param wait: Whether to wait for the worker processes to exit
+        """
+        with self._pipelines_lock:
+            pipelines, self._pipelines = list(self._pipelines.values()), {}
+        for pipeline in pipelines:
+            pipeline.close(wait=wait)
+
+    def reward_stages(self) -> List[Tuple[str, Callable[[List[dict]], List[dict]]]]:
+        """ The steps to compute the reward of a state. Each step updates a list of records (dictionaries starting
+        with the 'state'), and returns them
+        """
+        return [('decorate', self._decorate_records),
+                ('scale_volume', self._scale_records),
+                ('preprocess', self._preprocess_records),
+                ('predict', self._predict_records),
+                ('score', self._score_records)]
+
+    def _decorate_records(self, records: List[dict]) -> List[dict]:
+        for record in records:
+            state = record['state']
+            record['structure'] = None
+            if not state.terminal:
+                continue
+            structure = self._get_cached_structure(state)
+            record['scaled'] = structure is not None
+            record['structure'] = structure if structure is not None else self.decorate_structure(state)
+        return records
+
+    def _scale_records(self, records: List[dict]) -> List[dict]:
+        for record in records:
+            if record['structure'] is not None and not record['scaled'] and self.vol_pred_site_bias is not None:
+                # predict the volume of the decorated structure before
+                # passing it to the GNN. Use a linear model + pymatgen's DLS predictor
+                record['structure'] = self.scale_by_pred_vol(record['structure'])
+        return records
+
+    def _preprocess_records(self, records: List[dict]) -> List[dict]:
+        for record in records:
+            structure = record['structure']
+            record['model_inputs'] = self.get_model_inputs(structure) \
+                if structure is not None and self.energy_predictor is not None else None
+        return records
+
+    @collect_metrics
+    def _predict_records(self, records: List[dict]) -> List[dict]:
+        model_inputs = [record['model_inputs'] for record in records]
+        if self.energy_predictor is None or all(inputs is None for inputs in model_inputs):
+            predicted_energies = [None] * len(records)
+        else:
+            predicted_energies = self.energy_predictor.predict_energies(model_inputs)
+        for record, predicted_energy in zip(records, predicted_energies):
+            record['predicted_energy'] = predicted_energy
+        return records
+
+    def _score_records(self, records: List[dict]) -> List[dict]:
+        # compute the decomposition energies of the batch together. The energy of a single structure
+        # (e.g., from get_reward) is left to pymatgen, in compute_reward
+        hull_records = [record for record in records
+                        if record['structure'] is not None and record['predicted_energy'] is not None]
+        if len(hull_records) <= 1:
+            hull_records = []
+        hull_stabilities = ehull.convex_hull_stabilities([record['structure'].composition for record in hull_records],
+                                                         [record['predicted_energy'] for record in hull_records],
+                                                         self.competing_phases,
+                                                         phase_diagram_cache=self.phase_diagram_cache)
+        for record, hull_stability in zip(hull_records, hull_stabilities):
+            record['hull_stability'] = hull_stability
+
+        for record in records:
+            state = record['state']
+            structure = record['structure']
+            if structure is None:
+                record['reward'] = self.default_reward
+                record['info'] = {'terminal': state.terminal, 'state_repr': repr(state)}
+                continue
+
+            info = {'terminal': True,
+                    'num_sites': len(structure.sites),
+                    'volume': structure.volume,
+                    'state_repr': repr(state),
+                    }
+            reward, reward_info = self.compute_reward(structure,
+                                                      record['predicted_energy'],
+                                                      state,
+                                                      hull_stability=record.get('hull_stability'))
+            info.update(reward_info)
+            record['reward'] = reward
+            record['info'] = info
+        return records
 
     def generate_structure(self, state: CrystalState):
+        """ Decorate the state's prototype structure. Recently decorated structures are cached, so the returned
+        structure should not be modified
+        """
+        structure = self._get_cached_structure(state)
+        if structure is not None:
+            return structure
+
+        structure = self._generate_structure(state)
+        self._cache_structures([{'state': state, 'structure': structure}])
+        return structure
+
+    def _get_cached_structure(self, state: CrystalState) -> Optional[Structure]:
+        state_repr = repr(state)
+        with self._structure_cache_lock:
+            structure = self._structure_cache.get(state_repr)
+            if structure is not None:
+                self._structure_cache.move_to_end(state_repr)
+            return structure
+
+    def _cache_structures(self, records: List[dict]) -> None:
+        if self.structure_cache_size <= 0:
+            return
+        with self._structure_cache_lock:
+            for record in records:
+                if record['structure'] is not None:
+                    self._structure_cache[repr(record['state'])] = record['structure']
+            while len(self._structure_cache) > self.structure_cache_size:
+                self._structure_cache.popitem(last=False)
+
+    def _generate_structure(self, state: CrystalState):
+        structure = self.decorate_structure(state)
+        if structure is not None and self.vol_pred_site_bias is not None:
+            # predict the volume of the decorated structure before
+            # passing it to the GNN. Use a linear model + pymatgen's DLS predictor
+            structure = self.scale_by_pred_vol(structure)
+        return structure
+
+    def decorate_structure(self, state: CrystalState) -> Optional[Structure]:
+        """ Decorate the state's prototype structure, without scaling its volume """
         # skip this structure if it is too large for the model.
         # I removed these structures from the action space (see builder.py "action_graph2_file"),
         # so shouldn't be a problem anymore
@@ -342,11 +579,6 @@ class CrystalStateReward(StructureRewardBattInterface):
         except AssertionError as e:
             print(f"AssertionError: {e}")
             return
-
-        if self.vol_pred_site_bias is not None:
-            # predict the volume of the decorated structure before
-            # passing it to the GNN. Use a linear model + pymatgen's DLS predictor
-            structure = self.scale_by_pred_vol(structure)
         return structure
 
     def scale_by_pred_vol(self, structure: Structure) -> Structure:
@@ -382,25 +614,14 @@ class CrystalStateReward(StructureRewardBattInterface):
     def predict_energy(self, structure: Structure, state=None) -> float:
         """ Predict the total energy of the structure using a GNN model (trained on unrelaxed structures)
         """
-        model_inputs = self.get_model_inputs(structure)
-        if model_inputs is None:
-            return None, None
-        # predicted_energy = predict(self.energy_model, model_inputs)
-        dataset = tf.data.Dataset.from_generator(
-            lambda: (s for s in [model_inputs]),
-            #lambda: (self.preprocessor.construct_feature_matrices(s, train=False) for s in [structure]),
-            output_signature=(self.preprocessor.output_signature),
-            )
-        dataset = dataset \
-            .padded_batch(
-                batch_size=1,
-                padding_values=(self.preprocessor.padding_values),
-            )
-        predicted_energy = self.energy_model.predict(dataset)
-        #print(f"{predicted_energy = }, {state = }")
-        predicted_energy = predicted_energy[0][0].astype(float)
-
-        return predicted_energy
+        return self.predict_energies([structure])[0]
+
+    @collect_metrics
+    def predict_energies(self, structures: List[Structure]) -> List[Optional[float]]:
+        """ Predict the total energy of several structures with a single call to the energy model.
+        The energy is None for structures that can't be processed by the model
+        """
+        return self.energy_predictor.predict_energies([self.get_model_inputs(structure) for structure in structures])
 
 #    @property
 #    def reward(self) -> float:
@@ -1,11 +1,12 @@
-import itertools
 import re
 from copy import deepcopy
-from typing import Iterable, Optional, Sequence, Tuple, Union
+from typing import Dict, Iterable, Optional, Sequence, Tuple, Union
 
 import numpy as np
-from pymatgen.core import Composition, Structure
+from pymatgen.core import Structure, get_el_sp
 
+from rlmolecule.crystal.decoration_index import DecorationIndex, PrototypeInfo, decoration_index
+from rlmolecule.crystal.utils import StringTable
 from rlmolecule.sql import hash_to_integer
 from rlmolecule.tree_search.graph_search_state import GraphSearchState
 from rlmolecule.tree_search.metrics import collect_metrics
@@ -21,6 +22,8 @@ class CrystalState(GraphSearchState):
     Crystals are generated only at the final state
     """
 
+    __slots__ = ('_action_node', '_composition', '_terminal', '_ele_replacements')
+
     def __init__(
             self,
             action_node: any,
@@ -45,9 +48,11 @@ class CrystalState(GraphSearchState):
         """
         Uses the string representation of the current state
         """
-        comp_str = self._composition + '|' if self._composition is not None else ""
-        comp_str = "" if self._composition == self._action_node else comp_str
-        return comp_str + str(self._action_node)
+        composition = self.composition
+        action_node = self.action_node
+        comp_str = composition + '|' if composition is not None else ""
+        comp_str = "" if composition == action_node else comp_str
+        return comp_str + str(action_node)
 
     # noinspection PyUnresolvedReferences
     def equals(self, other: any) -> bool:
@@ -76,6 +81,24 @@ class CrystalState(GraphSearchState):
 
         return result
 
+    def get_next_action_descriptors(self, builder) -> Sequence[tuple]:
+        """
+        Lightweight (action_node, composition, terminal) descriptors of the next states, see
+        CrystalBuilder.find_next_action_descriptors
+
+        :param builder: A CrystalBuilder object
+        """
+        if self._terminal:
+            return []
+        return builder.find_next_action_descriptors(self)
+
+    def materialize_action(self, descriptor: tuple, builder) -> 'CrystalState':
+        """
+        :param descriptor: One of the descriptors returned by get_next_action_descriptors
+        :param builder: A CrystalBuilder object
+        """
+        return builder.materialize(descriptor)
+
     # TODO combine this function and decorate_prototype_structure
     def set_proto_ele_replacements(self, icsd_prototype: Structure) -> None:
         """
@@ -83,38 +106,17 @@ class CrystalState(GraphSearchState):
         The decoration index is used to figure out which combination of
         elements in this composition should replace the elements in the icsd prototype
         """
-        decoration_idx = int(self.action_node.split("|")[-1]) - 1
-         
-        comp = Composition(self.composition)
-
-        prototype_comp = Composition(icsd_prototype.formula).reduced_composition
-        ele_to_stoich = prototype_comp.to_data_dict['unit_cell_composition']
-        prototype_stoic = tuple([int(s) for s in ele_to_stoich.values()])
-
-        # create permutations of order of elements within a composition
-        # e.g., for K1Br1: [('K1', 'Br1'), ('Br1', 'K1')]
-        comp_permutations = itertools.permutations(comp.formula.split(' '))
-        # only keep the permutations that match the stoichiometry of the prototype structure
-        valid_comp_permutations = []
-        for comp_permu in comp_permutations:
-            comp_stoich = CrystalState.get_stoich_from_comp(''.join(comp_permu))
-            if comp_stoich == prototype_stoic:
-                valid_comp_permutations.append(''.join(comp_permu))
-
-        # TODO find a better way than matching the decoration_idx here
-        assert decoration_idx < len(valid_comp_permutations), \
-            f"decoration_idx {decoration_idx} must be < num valid comp permutations {len(valid_comp_permutations)} -- " + \
-            f"{self.action_node = } {prototype_stoic = }, {comp_permu = }, " + \
-            f"{self.composition = }, {prototype_comp = }"
-
-        # now build the decorated structure for the specific index passed in
-        original_ele = ''.join(i for i in prototype_comp.formula if not i.isdigit()).split(' ')
-        replacement_ele = CrystalState.get_eles_from_comp(valid_comp_permutations[decoration_idx])
+        self._ele_replacements = decoration_index.get_ele_replacements(
+            self.composition, DecorationIndex.get_prototype_info(icsd_prototype), self.get_decoration_idx())
 
-        # dictionary containing original elements as keys and new elements as values
-        replacement = {replacement_ele[i]: original_ele[i] for i in range(len(original_ele))}
+    def set_prototype_info(self, prototype_info: PrototypeInfo) -> None:
+        """
+        Like set_proto_ele_replacements, but the element replacements are only computed the first time they're used
+        """
+        self._ele_replacements = prototype_info
 
-        self._ele_replacements = replacement
+    def get_decoration_idx(self) -> int:
+        return int(self.action_node.split("|")[-1]) - 1
 
     @staticmethod
     def split_comp_to_eles_and_type(comp: str) -> Tuple[Iterable[str], str]:
@@ -157,40 +159,27 @@ class CrystalState(GraphSearchState):
         The decoration index is used to figure out which combination of
         elements in this composition should replace the elements in the icsd prototype
         """
-        comp = Composition(composition)
-
-        prototype_comp = Composition(icsd_prototype.formula).reduced_composition
-        ele_to_stoich = prototype_comp.to_data_dict['unit_cell_composition']
-        prototype_stoic = tuple([int(s) for s in ele_to_stoich.values()])
-
-        # create permutations of order of elements within a composition
-        # e.g., for K1Br1: [('K1', 'Br1'), ('Br1', 'K1')]
-        comp_permutations = itertools.permutations(comp.formula.split(' '))
-        # only keep the permutations that match the stoichiometry of the prototype structure
-        valid_comp_permutations = []
-        for comp_permu in comp_permutations:
-            comp_stoich = CrystalState.get_stoich_from_comp(''.join(comp_permu))
-            if comp_stoich == prototype_stoic:
-                valid_comp_permutations.append(''.join(comp_permu))
-
-        # TODO find a better way than matching the decoration_idx here
-        assert decoration_idx < len(valid_comp_permutations), \
-            f"decoration_idx {decoration_idx} must be < num valid comp permutations {len(valid_comp_permutations)} -- " + \
-            f"prototype_stoic: {prototype_stoic}, comp_permu: {comp_permu}, " + \
-            f"composition: {composition}, prototype_comp: {prototype_comp} "
-
-        # now build the decorated structure for the specific index passed in
-        original_ele = ''.join(i for i in prototype_comp.formula if not i.isdigit()).split(' ')
-        replacement_ele = CrystalState.get_eles_from_comp(valid_comp_permutations[decoration_idx])
+        prototype_info = DecorationIndex.get_prototype_info(icsd_prototype)
+        replacement_ele = decoration_index.get_replacement_elements(composition, prototype_info, decoration_idx)
 
         # dictionary containing original elements as keys and new elements as values
-        replacement = {original_ele[i]: replacement_ele[i] for i in range(len(original_ele))}
-
-        # 'replace_species' function from pymatgen to replace original elements with new elements
-        strc_subs = deepcopy(icsd_prototype)
-        strc_subs.replace_species(replacement)
-
-        return strc_subs, valid_comp_permutations[decoration_idx]
+        replacement = dict(zip(prototype_info.elements, replacement_ele))
+        stoich = ''.join(f"{ele}{s}" for ele, s in zip(replacement_ele, prototype_info.stoich))
+
+        if icsd_prototype.is_ordered:
+            # build the decorated structure directly from the prototype's lattice and coordinates,
+            # which is much faster than copying the prototype and replacing its species
+            species_mapping = {get_el_sp(original): get_el_sp(new) for original, new in replacement.items()}
+            strc_subs = Structure(icsd_prototype.lattice,
+                                  [species_mapping.get(specie, specie) for specie in icsd_prototype.species],
+                                  icsd_prototype.frac_coords,
+                                  site_properties=icsd_prototype.site_properties or None)
+        else:
+            # 'replace_species' function from pymatgen to replace original elements with new elements
+            strc_subs = deepcopy(icsd_prototype)
+            strc_subs.replace_species(replacement)
+
+        return strc_subs, stoich
 
     # @property
     # def elements(self) -> str:
@@ -210,6 +199,10 @@ class CrystalState(GraphSearchState):
 
     @property
     def ele_replacements(self) -> dict:
+        if isinstance(self._ele_replacements, PrototypeInfo):
+            # set lazily by set_prototype_info
+            self._ele_replacements = decoration_index.get_ele_replacements(
+                self.composition, self._ele_replacements, self.get_decoration_idx())
         return self._ele_replacements
 
     def get_crystal_sys(self) -> str:
@@ -231,3 +224,87 @@ class CrystalState(GraphSearchState):
     @property
     def terminal(self) -> bool:
         return self._terminal
+
+
+class CompactCrystalState(CrystalState):
+    """
+    A CrystalState that stores integer ids into a shared StringTable in place of the action node and composition
+    strings, so that large search trees don't hold a python string for each of their states. Equality and the
+    in-memory hash compare those integers; the string forms are looked up on demand.
+
+    The persisted `hash()` is still computed from the string representation (once, see GraphSearchState), so it
+    matches that of the equivalent CrystalState, and pickled states store strings rather than ids.
+    """
+
+    __slots__ = ()
+
+    # shared by all compact states, so that ids can be compared directly
+    strings: StringTable = StringTable()
+    # (crystal system, prototype id) parsed from each G2 action node, keyed by node id
+    _node_parts: Dict[int, Tuple[Optional[str], Optional[int]]] = {}
+
+    def __init__(
+            self,
+            action_node: any,
+            composition: Optional[str] = None,
+            terminal: bool = False,
+    ) -> None:
+        super().__init__(action_node, composition, terminal)
+        # here, the action node and composition slots hold ids into the string table
+        self._action_node: int = self.strings.intern(action_node)
+        self._composition: Optional[int] = None if composition is None else self.strings.intern(composition)
+
+    def equals(self, other: any) -> bool:
+        return type(other) == type(self) and \
+               self._action_node == other._action_node and \
+               self._composition == other._composition and \
+               self._terminal == other._terminal
+
+    def __hash__(self) -> int:
+        return hash((self._action_node, self._composition, self._terminal))
+
+    def __getstate__(self):
+        return self.action_node, self.composition, self._terminal, self._ele_replacements
+
+    def __setstate__(self, state) -> None:
+        action_node, composition, terminal, ele_replacements = state
+        self.__init__(action_node, composition, terminal)
+        self._ele_replacements = ele_replacements
+
+    @property
+    def action_node_id(self) -> int:
+        return self._action_node
+
+    @property
+    def composition_id(self) -> Optional[int]:
+        return self._composition
+
+    @property
+    def prototype_id(self) -> Optional[int]:
+        """ id of the prototype structure string (e.g., POSCAR_sg14_icsd_083588) in the string table, if any """
+        return self._get_node_parts()[1]
+
+    @property
+    def composition(self) -> Optional[str]:
+        return None if self._composition is None else self.strings[self._composition]
+
+    @property
+    def action_node(self) -> Union[str, tuple]:
+        return self.strings[self._action_node]
+
+    def get_crystal_sys(self) -> Optional[str]:
+        return self._get_node_parts()[0]
+
+    def get_proto_strc(self) -> Optional[str]:
+        prototype_id = self._get_node_parts()[1]
+        return None if prototype_id is None else self.strings[prototype_id]
+
+    def _get_node_parts(self) -> Tuple[Optional[str], Optional[int]]:
+        parts = self._node_parts.get(self._action_node)
+        if parts is None:
+            parts = (CrystalState.get_crystal_sys(self), None)
+            proto_strc = CrystalState.get_proto_strc(self)
+            if proto_strc is not None:
+                parts = (parts[0], self.strings.intern(proto_strc))
+            self._node_parts[self._action_node] = parts
+        return parts
@@ -0,0 +1,110 @@
+import gzip
+import itertools
+import json
+import logging
+import re
+import threading
+from typing import Dict, List, NamedTuple, Tuple
+
+from pymatgen.core import Composition, Structure
+
+logger = logging.getLogger(__name__)
+
+
+class PrototypeInfo(NamedTuple):
+    """ The stoichiometry and elements of a prototype structure's reduced composition, in the order used to match them
+    with the elements of a composition when decorating the prototype """
+    stoich: Tuple[int, ...]
+    elements: Tuple[str, ...]
+
+
+class DecorationIndex:
+    """
+    Maps the decoration index of a (composition, prototype) pair to the elements that replace the prototype's elements.
+    The decorations of a prototype are the permutations of the composition's elements that match the prototype's
+    stoichiometry, in the order of `itertools.permutations` over the composition's (pymatgen) formula.
+
+    The valid permutations are only enumerated once per (composition, prototype stoichiometry), and can be saved
+    to and loaded from a file.
+    """
+
+    def __init__(self) -> None:
+        self.permutations: Dict[Tuple[str, Tuple[int, ...]], List[Tuple[str, ...]]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.permutations)
+
+    @staticmethod
+    def get_prototype_info(icsd_prototype: Structure) -> PrototypeInfo:
+        prototype_comp = Composition(icsd_prototype.formula).reduced_composition
+        ele_to_stoich = prototype_comp.to_data_dict['unit_cell_composition']
+        prototype_stoich = tuple([int(s) for s in ele_to_stoich.values()])
+        original_ele = ''.join(i for i in prototype_comp.formula if not i.isdigit()).split(' ')
+        return PrototypeInfo(prototype_stoich, tuple(original_ele))
+
+    def get_permutations(self, composition: str, prototype_stoich: Tuple[int, ...]) -> List[Tuple[str, ...]]:
+        """
+        :return: The orderings of the composition's elements whose stoichiometry matches the prototype's.
+            The decoration index (starting at 0) indexes this list
+        """
+        key = (composition, prototype_stoich)
+        permutations = self.permutations.get(key)
+        if permutations is None:
+            # e.g., for "Li1Sc1F4": ['Li1', 'Sc1', 'F4'] -> ('Li', 'Sc', 'F'), (1, 1, 4)
+            split = [re.match(r'(\D+)(\d+)', ele_stoich).groups()
+                     for ele_stoich in Composition(composition).formula.split(' ')]
+            elements = tuple(ele for ele, _ in split)
+            stoich = tuple(int(s) for _, s in split)
+            permutations = [tuple(elements[i] for i in order)
+                            for order in itertools.permutations(range(len(elements)))
+                            if tuple(stoich[i] for i in order) == prototype_stoich]
+            with self._lock:
+                self.permutations[key] = permutations
+        return permutations
+
+    def get_replacement_elements(self,
+                                 composition: str,
+                                 prototype_info: PrototypeInfo,
+                                 decoration_idx: int,
+                                 ) -> Tuple[str, ...]:
+        """
+        :return: The elements of the composition that replace each of the prototype's elements (in the order of
+            prototype_info.elements) for the given decoration
+        """
+        permutations = self.get_permutations(composition, prototype_info.stoich)
+        # TODO find a better way than matching the decoration_idx here
+        assert decoration_idx < len(permutations), \
+            f"decoration_idx {decoration_idx} must be < num valid comp permutations {len(permutations)} -- " + \
+            f"prototype_stoic: {prototype_info.stoich}, composition: {composition}, " + \
+            f"prototype elements: {prototype_info.elements}"
+        return permutations[decoration_idx]
+
+    def get_ele_replacements(self, composition: str, prototype_info: PrototypeInfo, decoration_idx: int) -> dict:
+        """ :return: dictionary mapping the composition's elements to the prototype elements they replace """
+        replacement_ele = self.get_replacement_elements(composition, prototype_info, decoration_idx)
+        return dict(zip(replacement_ele, prototype_info.elements))
+
+    def save(self, index_file: str) -> None:
+        """ Write the valid permutations computed so far to a gzipped json file """
+        permutations = {}
+        for (composition, stoich), elements in list(self.permutations.items()):
+            permutations.setdefault(composition, {})['_'.join(map(str, stoich))] = elements
+        with gzip.open(index_file, 'w') as out:
+            out.write(json.dumps(permutations).encode())
+        logger.info(f"wrote {len(self.permutations)} decoration permutations to {index_file}")
+
+    def load(self, index_file: str) -> None:
+        """ Add the permutations from a file written by `save` """
+        with gzip.open(index_file, 'r') as f:
+            permutations = json.loads(f.read().decode())
+        with self._lock:
+            for composition, stoich_permutations in permutations.items():
+                for stoich, elements in stoich_permutations.items():
+                    key = (composition, tuple(int(s) for s in stoich.split('_')))
+                    self.permutations[key] = [tuple(ele) for ele in elements]
+        logger.info(f"read {len(permutations)} compositions' decoration permutations from {index_file}")
+
+
+# shared by all crystal states, so that each permutation is only enumerated once per process
+decoration_index = DecorationIndex()
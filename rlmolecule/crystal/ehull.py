@@ -1,7 +1,14 @@
 from copy import deepcopy
 
-from collections import defaultdict
-from typing import List
+from collections import defaultdict, OrderedDict
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+import gzip
+import itertools
+import json
+import logging
+import math
+import os
+import threading
 import pandas as pd
 import numpy as np
 import re
@@ -12,6 +19,8 @@ from pymatgen.core.periodic_table import Element
 
 from rlmolecule.crystal.reward_utils import get_conducting_ion
 
+logger = logging.getLogger(__name__)
+
 # ---FERE reference chemical potentials------
 fere_chempot = {'Ag': -0.83, 'Al': -3.02, 'As': -5.06, 'Au': -2.23, 'Ba': -1.39, 'Be': -3.40, 'Bi': -4.39, 'Ca': -1.64,
                 'Cd': -0.56, 'Cl': -1.63, 'Co': -4.75, 'Cr': -7.22, 'Cu': -1.97, 'F': -1.70, 'Fe': -6.15, 'Ga': -2.37,
@@ -34,31 +43,237 @@ ferev2_chempot = {'Ag': -0.79, 'Al': -3.27, 'Al_anion': -3.55, 'As': -4.95, 'As_
 fere_entries = [PDEntry(e, energy) for e, energy in ferev2_chempot.items() if "ion" not in e]
 
 
+def get_chemsys(elements: Iterable[Element]) -> str:
+    """ :return: the chemical system of the elements, e.g., 'F-Li-Sc' """
+    return '-'.join(sorted(str(e) for e in elements))
+
+
+class CompetingPhaseIndex:
+    """
+    The competing phases, grouped by chemical system. The entries that have the same or a subset of the elements
+    of a composition are the union of the entries of its subsystems (31 for 5 elements), rather than a scan over
+    all of the competing phases.
+
+    The index can be saved to and loaded from a file, which is much faster than parsing the competing phases' formulas.
+    """
+
+    def __init__(self, competing_phases: Iterable[PDEntry] = ()) -> None:
+        self.entries_by_chemsys: Dict[str, List[PDEntry]] = defaultdict(list)
+        self.add(competing_phases)
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self.entries_by_chemsys.values())
+
+    def __iter__(self) -> Iterator[PDEntry]:
+        return itertools.chain.from_iterable(self.entries_by_chemsys.values())
+
+    def add(self, competing_phases: Iterable[PDEntry]) -> None:
+        for entry in competing_phases:
+            self.entries_by_chemsys[get_chemsys(entry.composition.elements)].append(entry)
+
+    def get_entries(self, elements: Iterable[Element]) -> List[PDEntry]:
+        """ :return: the competing phases that have the same or a subset of the elements """
+        elements = sorted(str(e) for e in elements)
+        entries = []
+        for num_elements in range(1, len(elements) + 1):
+            # the combinations of sorted elements are sorted, i.e., they match get_chemsys
+            for subsystem in itertools.combinations(elements, num_elements):
+                entries += self.entries_by_chemsys.get('-'.join(subsystem), [])
+        return entries
+
+    def save(self, index_file: str) -> None:
+        """ Write the competing phases to a gzipped json file, as the element amounts and energy of each entry """
+        competing_phases = {chemsys: [[{str(el): amt for el, amt in entry.composition.items()}, entry.energy]
+                                      for entry in entries]
+                            for chemsys, entries in self.entries_by_chemsys.items()}
+        # several workers may write the index at the same time, so the file is replaced once it's complete
+        tmp_file = f"{index_file}.{os.getpid()}.tmp"
+        with gzip.open(tmp_file, 'w') as out:
+            out.write(json.dumps(competing_phases).encode())
+        os.replace(tmp_file, index_file)
+        logger.info(f"wrote {len(self)} competing phases to {index_file}")
+
+    def load(self, index_file: str) -> None:
+        """ Add the competing phases from a file written by `save` """
+        with gzip.open(index_file, 'r') as f:
+            competing_phases = json.loads(f.read().decode())
+        for chemsys, entries in competing_phases.items():
+            self.entries_by_chemsys[chemsys] += [PDEntry(Composition(amounts), energy) for amounts, energy in entries]
+        logger.info(f"read {sum(len(entries) for entries in competing_phases.values())} "
+                    f"competing phases from {index_file}")
+
+
+class ChemsysHull:
+    """
+    The lower convex hull of a phase diagram as numpy arrays, to compute the energy above the hull of many
+    compositions of the chemical system at once. Each facet of the hull is stored as the plane through its vertices,
+    E = x . slope + intercept, where x are the atomic fractions of phase_diagram.elements[1:].
+    Since every facet's plane is below all of the phases, the hull energy at x is the maximum over the facets' planes.
+    """
+    #: facets whose linear system has a larger condition number are treated as degenerate
+    max_condition_number = 1e8
+
+    def __init__(self, phase_diagram: PhaseDiagram) -> None:
+        self.phase_diagram = phase_diagram
+        self.elements = list(phase_diagram.elements)
+        # the atomic fractions (without the first element) and energy per atom of the hull's vertices
+        self.vertices = np.asarray(phase_diagram.qhull_data)
+        facets = np.asarray(phase_diagram.facets, dtype=int).reshape(-1, len(self.elements))
+        facet_vertices = self.vertices[facets]
+        coords = facet_vertices[:, :, :-1]
+        ones = np.ones(coords.shape[:2] + (1,))
+        systems = np.concatenate([coords, ones], axis=2)
+        # Facets whose vertices are (nearly) collinear don't determine a plane. They have no area in composition space,
+        # so they are dropped, and the hull at their compositions is given by the planes of their neighbors.
+        well_conditioned = np.linalg.cond(systems) < self.max_condition_number
+        if not well_conditioned.all():
+            logger.debug(f"Dropped {np.sum(~well_conditioned)} degenerate facets of the {self.elements} hull")
+        # solve [x, 1] @ [slope, intercept] = E for the vertices of each facet
+        planes = np.linalg.solve(systems[well_conditioned], facet_vertices[well_conditioned, :, -1:])[:, :, 0]
+        self.slopes = planes[:, :-1]
+        self.intercepts = planes[:, -1]
+
+        # the competing phases, to recognize predictions that match one of them exactly
+        self._entry_energies = defaultdict(list)
+        for entry in phase_diagram.all_entries:
+            self._entry_energies[entry.composition.formula].append(entry.energy)
+
+    def get_fractions(self, compositions: Sequence[Composition]) -> np.ndarray:
+        """ :return: the atomic fraction of each of the hull's elements (columns) in the compositions (rows) """
+        fractions = np.array([[comp.get_atomic_fraction(el) for el in self.elements] for comp in compositions],
+                             dtype=float)
+        if len(compositions) > 0 and not np.allclose(fractions.sum(axis=1), 1):
+            raise ValueError(f"Compositions have elements outside of the hull's elements {self.elements}")
+        return fractions.reshape(len(compositions), len(self.elements))
+
+    def get_hull_energies(self, fractions: np.ndarray) -> np.ndarray:
+        """ :return: the energy per atom of the hull at the given atomic fractions (see get_fractions) """
+        return np.max(fractions[:, 1:] @ self.slopes.T + self.intercepts, axis=1)
+
+    def get_e_above_hull(self,
+                         compositions: Sequence[Composition],
+                         energies_per_atom: Sequence[float],
+                         allow_negative: bool = False,
+                         ) -> np.ndarray:
+        """ The energy above the hull (eV/atom) of each composition, as computed by
+        PhaseDiagram.get_decomp_and_e_above_hull(..., check_stable=False)
+
+        :param allow_negative: Whether to allow negative energies, i.e., below the hull.
+            If not, they are NaN (pymatgen's on_error='ignore')
+        """
+        e_above_hull = np.asarray(energies_per_atom, dtype=float) - \
+            self.get_hull_energies(self.get_fractions(compositions))
+        if not allow_negative:
+            e_above_hull[e_above_hull < -PhaseDiagram.numerical_tol] = np.nan
+        return e_above_hull
+
+    def is_competing_phase(self, entry: PDEntry) -> bool:
+        """ :return: whether one of the competing phases has the entry's composition and energy """
+        return any(math.isclose(energy, entry.energy, rel_tol=1e-5, abs_tol=1e-8)
+                   for energy in self._entry_energies.get(entry.composition.formula, []))
+
+
+class PhaseDiagramCache:
+    """
+    The phase diagrams (and their ChemsysHull) of the competing phases, keyed by chemical system.
+    Many compositions (and all of their decorations) share a chemical system, so each phase diagram is only built
+    the first time one of its compositions is scored, and the most recently used ones are kept in an LRU cache.
+    Building them all up front for every composition in the action space is slower than building them as needed.
+    """
+
+    def __init__(self,
+                 competing_phases: Union[List[PDEntry], CompetingPhaseIndex],
+                 max_size: int = 1024,
+                 ) -> None:
+        """
+        :param competing_phases: list (or index) of competing phases used to
+            construct the convex hull for the elements of a given composition
+        :param max_size: Number of phase diagrams to keep
+        """
+        if not isinstance(competing_phases, CompetingPhaseIndex):
+            competing_phases = CompetingPhaseIndex(competing_phases)
+        self.competing_phases = competing_phases
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._hulls: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._hulls)
+
+    def __getstate__(self) -> dict:
+        # phase diagrams aren't copied to worker processes, each process builds its own
+        state = self.__dict__.copy()
+        for name in ('_hulls', '_lock'):
+            state.pop(name)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.hits = self.misses = 0
+        self._hulls = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.
+
+    def stats(self) -> Dict[str, float]:
+        return {'size': len(self), 'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate}
+
+    def get_phase_diagram(self, elements: Iterable[Element]) -> PhaseDiagram:
+        """ :return: the phase diagram of the competing phases in the chemical system of the elements """
+        return self.get_hull(elements).phase_diagram
+
+    def get_hull(self, elements: Iterable[Element]) -> ChemsysHull:
+        """ :return: the convex hull of the competing phases in the chemical system of the elements """
+        elements = set(elements)
+        chemsys = get_chemsys(elements)
+        with self._lock:
+            hull = self._hulls.get(chemsys)
+            if hull is not None:
+                self._hulls.move_to_end(chemsys)
+                self.hits += 1
+                return hull
+            self.misses += 1
+
+        hull = ChemsysHull(PhaseDiagram(self.competing_phases.get_entries(elements), elements=elements))
+
+        with self._lock:
+            self._hulls[chemsys] = hull
+            if len(self._hulls) > self.max_size:
+                self._hulls.popitem(last=False)
+        return hull
+
+
 def convex_hull_stability(comp: Composition,
                           predicted_energy: float,
-                          competing_phases: List[PDEntry],
+                          competing_phases: Union[List[PDEntry], CompetingPhaseIndex],
+                          phase_diagram_cache: Optional[PhaseDiagramCache] = None,
                           ):
     """ compute the decomposition energy for a given composition 
     :param comp: composition such as Li1Sc1F4
     :param predicted_energy: predicted eV/atom for the structure corresponding to this composition
-    :param competing_phases: list of competing phases used to 
+    :param competing_phases: list (or index) of competing phases used to 
         construct the convex hull for the elements of the given composition
+    :param phase_diagram_cache: If given, the convex hull of the composition's chemical system is taken from
+        this cache rather than built from the competing phases
     """
     # first make sure the composition is in the reduced form
     comp = comp.reduced_composition
     # convert the predicted energyperatom to total energy
     energy = predicted_energy * comp.num_atoms
     entry = PDEntry(comp, energy)
-    elements = set(comp.elements)
 
-    # get the entries that have the same or a subset of elements.
-    # Since we're including DFT relaxed energies in the competing phases,
-    # also don't include entries that match the composition and predicted energy exactly
-    # since we are trying to compute the decomposition energy for that structure
-    curr_entries = [e for e in competing_phases
-                    if len(set(e.composition.elements) - elements) == 0
-                    and e != entry]
-    phase_diagram = PhaseDiagram(curr_entries, elements=elements)
+    phase_diagram = None
+    if phase_diagram_cache is not None:
+        hull = phase_diagram_cache.get_hull(comp.elements)
+        if not hull.is_competing_phase(entry):
+            phase_diagram = hull.phase_diagram
+    if phase_diagram is None:
+        phase_diagram = PhaseDiagram(get_competing_entries(entry, competing_phases), elements=set(comp.elements))
 
     decomp, decomp_energy = phase_diagram.get_decomp_and_e_above_hull(
         entry,
@@ -71,6 +286,74 @@ def convex_hull_stability(comp: Composition,
     if decomp_energy > 0:
         return decomp_energy, None
 
+    return decomp_energy, get_electrochem_stability_window(entry, phase_diagram)
+
+
+def convex_hull_stabilities(compositions: Sequence[Composition],
+                            predicted_energies: Sequence[float],
+                            competing_phases: Union[List[PDEntry], CompetingPhaseIndex],
+                            phase_diagram_cache: Optional[PhaseDiagramCache] = None,
+                            ) -> List[Tuple[float, Optional[Tuple[float, float]]]]:
+    """ convex_hull_stability for many compositions. The decomposition energies of the compositions of each
+    chemical system are computed together from the hull's facets (see ChemsysHull),
+    and pymatgen is only used for the stability window of the stable ones.
+
+    :param compositions: compositions such as Li1Sc1F4
+    :param predicted_energies: predicted eV/atom for the structure corresponding to each composition
+    :param competing_phases: list (or index) of competing phases used to
+        construct the convex hull for the elements of the given compositions
+    :param phase_diagram_cache: If given, the convex hulls are taken from this cache
+    :return: the decomposition energy and electrochemical stability window (or None) of each composition
+    """
+    if phase_diagram_cache is None:
+        phase_diagram_cache = PhaseDiagramCache(competing_phases)
+    compositions = [comp.reduced_composition for comp in compositions]
+    chemsys_indices = defaultdict(list)
+    for i, comp in enumerate(compositions):
+        chemsys_indices[get_chemsys(comp.elements)].append(i)
+
+    results = [None] * len(compositions)
+    for indices in chemsys_indices.values():
+        hull = phase_diagram_cache.get_hull(compositions[indices[0]].elements)
+        decomp_energies = hull.get_e_above_hull([compositions[i] for i in indices],
+                                                [predicted_energies[i] for i in indices],
+                                                allow_negative=True)
+        for i, decomp_energy in zip(indices, decomp_energies.tolist()):
+            comp = compositions[i]
+            entry = PDEntry(comp, predicted_energies[i] * comp.num_atoms)
+            if hull.is_competing_phase(entry):
+                # the hull would need to be built without the matching competing phase
+                results[i] = convex_hull_stability(comp, predicted_energies[i], competing_phases)
+            elif decomp_energy > 0:
+                results[i] = (decomp_energy, None)
+            else:
+                results[i] = (decomp_energy, get_electrochem_stability_window(entry, hull.phase_diagram))
+    return results
+
+
+def get_competing_entries(entry: PDEntry,
+                          competing_phases: Union[List[PDEntry], CompetingPhaseIndex],
+                          ) -> List[PDEntry]:
+    """ get the entries that have the same or a subset of elements.
+    Since we're including DFT relaxed energies in the competing phases,
+    also don't include entries that match the composition and predicted energy exactly
+    since we are trying to compute the decomposition energy for that structure
+    """
+    elements = set(entry.composition.elements)
+    if isinstance(competing_phases, CompetingPhaseIndex):
+        return [e for e in competing_phases.get_entries(elements) if e != entry]
+    return [e for e in competing_phases
+            if len(set(e.composition.elements) - elements) == 0
+            and e != entry]
+
+
+def get_electrochem_stability_window(entry: PDEntry,
+                                     phase_diagram: PhaseDiagram,
+                                     ) -> Optional[Tuple[float, float]]:
+    """ compute the electrochemical stability window of a stable entry, i.e., below the hull of the phase diagram
+    :return: the oxidation and reduction potentials, or None if the composition has no conducting ion
+    """
+    comp = entry.composition
     # since the decomposition energy is negative,
     # add the current entry to the hull to get the electrochem_stability_window
     phase_diagram_w_comp = PhaseDiagram(phase_diagram.entries + [entry],
@@ -81,7 +364,7 @@ def convex_hull_stability(comp: Composition,
     try:
         cond_ion = Element(get_conducting_ion(comp))
     except ValueError:
-        return decomp_energy, None
+        return None
 
     stability_ranges = phase_diagram_w_comp.get_chempot_range_stability_phase(
         comp, cond_ion)
@@ -98,5 +381,4 @@ def convex_hull_stability(comp: Composition,
     reduction_potential = min(0, max(-5, high))
     electrochem_stability_window = (oxidation_potential, reduction_potential)
 
-    return decomp_energy, electrochem_stability_window
-
+    return electrochem_stability_window
@@ -0,0 +1,101 @@
+import logging
+import math
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def bucket_size(size: int, bucket_sizes: Sequence[int] = ()) -> int:
+    """ :return: the smallest of the (sorted) bucket sizes that fits the given size, or the next power of 2 """
+    for bucket in bucket_sizes:
+        if size <= bucket:
+            return bucket
+    return 2 ** math.ceil(math.log2(max(size, 1)))
+
+
+def pad_inputs(list_of_inputs: List[Dict[str, np.ndarray]],
+               bucket_sizes: Sequence[int] = (),
+               padding_values: Optional[Dict[str, any]] = None) -> Dict[str, np.ndarray]:
+    """ Stack the inputs of several structures into a batch, padding them to the same bucket size (see
+    `bucket_size`) with the given padding value of each input (0 by default) """
+    padding_values = padding_values or {}
+    batch = {}
+    for key in list_of_inputs[0].keys():
+        arrays = [np.asarray(inputs[key]) for inputs in list_of_inputs]
+        size = bucket_size(max(len(array) for array in arrays), bucket_sizes)
+        padded = np.full((len(arrays), size) + arrays[0].shape[1:], padding_values.get(key, 0), dtype=arrays[0].dtype)
+        for i, array in enumerate(arrays):
+            padded[i, :len(array)] = array
+        batch[key] = padded
+    return batch
+
+
+class EnergyPredictor:
+    """
+    Batched inference with a GNN energy model. The model's predict_step is traced once by tf.function, and inputs
+    are padded with numpy rather than going through a tf.data pipeline and model.predict, which have a large fixed cost
+    on every call. Each input is padded up to one of a few bucket sizes, so that the traced function only sees a small
+    set of shapes.
+    """
+
+    def __init__(self,
+                 energy_model: 'tf.keras.Model',
+                 output_signature: Optional[Dict[str, 'tf.TensorSpec']] = None,
+                 padding_values: Optional[Dict[str, any]] = None,
+                 bucket_sizes: Optional[Sequence[int]] = None,
+                 max_batch_size: int = 64,
+                 ) -> None:
+        """
+        :param energy_model: A tensorflow model to estimate the total energy of a (batched) structure
+        :param output_signature: The signature of the inputs of a single structure, e.g., the preprocessor's
+            output_signature. If given, the model is traced a single time, for batches of any size.
+            Otherwise, the traced function relaxes its shapes as new ones are seen
+        :param padding_values: Value used to pad each input, e.g., the preprocessor's padding_values. Defaults to 0
+        :param bucket_sizes: The sizes to which the first dimension of each input is padded (the smallest one that
+            fits). Inputs larger than the last bucket, or all inputs if not given, are padded to the next power of 2
+        :param max_batch_size: Maximum number of structures to predict with a single call to the model
+        """
+        import tensorflow as tf
+
+        self.energy_model = energy_model
+        self.padding_values = {key: np.asarray(value.numpy() if hasattr(value, 'numpy') else value)
+                               for key, value in (padding_values or {}).items()}
+        self.bucket_sizes = sorted(bucket_sizes) if bucket_sizes is not None else []
+        self.max_batch_size = max_batch_size
+
+        if output_signature is not None:
+            input_signature = {key: tf.TensorSpec([None] + spec.shape.as_list(), spec.dtype, name=key)
+                               for key, spec in output_signature.items()}
+            self._predict = tf.function(energy_model.predict_step, input_signature=[input_signature])
+        else:
+            self._predict = tf.function(experimental_relax_shapes=True)(energy_model.predict_step)
+
+    def bucket_size(self, size: int) -> int:
+        """ :return: the size to which an input of the given size is padded """
+        return bucket_size(size, self.bucket_sizes)
+
+    def pad_inputs(self, list_of_inputs: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+        """ Stack the inputs of several structures into a batch, padding them to the same bucket size """
+        return pad_inputs(list_of_inputs, self.bucket_sizes, self.padding_values)
+
+    def predict_energies(self, list_of_inputs: List[Optional[Dict[str, np.ndarray]]]) -> List[Optional[float]]:
+        """ Predict the total energy of several structures
+
+        :param list_of_inputs: The model inputs of each structure (see CrystalStateReward.get_model_inputs).
+            None can be given for structures that couldn't be processed
+        :return: The predicted energy of each structure, or None for those without inputs
+        """
+        energies: List[Optional[float]] = [None] * len(list_of_inputs)
+        indices = [i for i, inputs in enumerate(list_of_inputs) if inputs is not None]
+        for start in range(0, len(indices), self.max_batch_size):
+            batch_indices = indices[start:start + self.max_batch_size]
+            batch = self.pad_inputs([list_of_inputs[i] for i in batch_indices])
+            predicted_energies = np.asarray(self._predict(batch)).reshape(len(batch_indices), -1)[:, 0]
+            for i, energy in zip(batch_indices, predicted_energies.tolist()):
+                energies[i] = energy
+        return energies
+
+    def predict_energy(self, inputs: Optional[Dict[str, np.ndarray]]) -> Optional[float]:
+        return self.predict_energies([inputs])[0]
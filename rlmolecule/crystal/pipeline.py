@@ -0,0 +1,220 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Callable, Iterable, List, NamedTuple, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# marks the end of a stage's input
+_DONE = object()
+
+
+class PipelineStage(NamedTuple):
+    """ A step of a Pipeline. The function processes a batch (list) of items, and returns the processed items, in order.
+    With processes=True, batches are processed by a pool of num_workers processes, so the function (and the items)
+    must be picklable. Otherwise, num_workers threads process the batches.
+    """
+    name: str
+    function: Callable[[List[any]], List[any]]
+    num_workers: int = 1
+    processes: bool = False
+    batch_size: int = 1
+
+
+class PipelineFailure:
+    """ The result of an item whose processing raised an exception. It's passed through the remaining stages unchanged,
+    and returned by Pipeline.run in place of the item's result """
+    __slots__ = ('stage', 'error')
+
+    def __init__(self, stage: str, error: Exception) -> None:
+        self.stage = stage
+        self.error = error
+
+    def __repr__(self) -> str:
+        return f"PipelineFailure({self.stage!r}, {self.error!r})"
+
+
+class Pipeline:
+    """
+    Runs a sequence of stages over a stream of items. The stages run concurrently, each with its own workers,
+    and are connected by bounded queues, so that slow stages only hold up the stages feeding them once their queue is
+    full. Items are batched by the workers of stages with batch_size > 1 (up to the number of items waiting).
+
+    Items whose processing raises an exception are returned as a PipelineFailure, without holding up the other items.
+    When a batch fails, its items are processed again one at a time, so that only the items that fail on their own
+    are returned as failures.
+
+    The worker processes of process stages are started by the first run and reused by the following ones, so that
+    whatever they cache is kept between runs. They are stopped by `close` (or once the pipeline is garbage collected),
+    or when used as a context manager:
+
+        with Pipeline(stages) as pipeline:
+            for chunk in chunks:
+                results = pipeline.run(chunk)
+    """
+
+    def __init__(self,
+                 stages: Sequence[PipelineStage],
+                 queue_size: int = 64,
+                 initializer: Optional[Callable] = None,
+                 initargs: tuple = (),
+                 ) -> None:
+        """
+        :param stages: The stages, in order
+        :param queue_size: Maximum number of items waiting between two stages
+        :param initializer: Called with initargs when each worker process starts, e.g., to set up the objects
+            the functions of the process stages use. Worker processes live as long as the pipeline, so they keep
+            the initargs they were started with
+        """
+        assert len(stages) > 0, "A pipeline needs at least one stage"
+        self.stages = list(stages)
+        self.queue_size = queue_size
+        self.initializer = initializer
+        self.initargs = initargs
+        self._executors: Optional[List[Optional[Executor]]] = None
+        self._executors_lock = threading.Lock()
+
+    def __enter__(self) -> 'Pipeline':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        if getattr(self, '_executors', None) is not None:
+            self.close(wait=False)
+
+    def close(self, wait: bool = True) -> None:
+        """ Stop the worker processes. They are started again if the pipeline is run afterwards
+
+        :param wait: Whether to wait for the worker processes to exit
+        """
+        with self._executors_lock:
+            executors, self._executors = self._executors, None
+        for executor in executors or []:
+            if executor is not None:
+                executor.shutdown(wait=wait)
+
+    def _get_executors(self) -> List[Optional[Executor]]:
+        with self._executors_lock:
+            if self._executors is None:
+                self._executors = [ProcessPoolExecutor(max_workers=stage.num_workers,
+                                                       initializer=self.initializer,
+                                                       initargs=self.initargs) if stage.processes else None
+                                   for stage in self.stages]
+            return self._executors
+
+    def run(self, items: Iterable[any]) -> List[any]:
+        """ Process the items through every stage
+
+        :return: The processed items, in the order they were given, with a PipelineFailure for each item that failed
+        """
+        items = list(items)
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        executors = self._get_executors()
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0], self.stages[0].num_workers),
+                                    daemon=True)]
+        for i, (stage, executor) in enumerate(zip(self.stages, executors)):
+            next_workers = self.stages[i + 1].num_workers if i + 1 < len(self.stages) else 0
+            # the last worker of a stage to finish tells the next stage's workers that there is nothing left
+            remaining = [stage.num_workers]
+            lock = threading.Lock()
+            threads += [threading.Thread(target=self._work,
+                                         args=(stage, executor, queues[i], queues[i + 1], remaining, lock,
+                                               next_workers),
+                                         daemon=True)
+                        for _ in range(stage.num_workers)]
+
+        for thread in threads:
+            thread.start()
+        results = [None] * len(items)
+        for _ in range(len(items)):
+            index, result = queues[-1].get()
+            results[index] = result
+        for thread in threads:
+            thread.join()
+
+        num_failures = sum(isinstance(result, PipelineFailure) for result in results)
+        if num_failures:
+            logger.error(f"{num_failures} of {len(items)} items failed")
+        return results
+
+    @staticmethod
+    def _process(stage: PipelineStage, executor: Optional[Executor], inputs: List[any]) -> List[any]:
+        if executor is not None:
+            outputs = executor.submit(stage.function, inputs).result()
+        else:
+            outputs = stage.function(inputs)
+        assert len(outputs) == len(inputs), \
+            f"Stage {stage.name} returned {len(outputs)} items for a batch of {len(inputs)}"
+        return outputs
+
+    @staticmethod
+    def _process_one(stage: PipelineStage, executor: Optional[Executor], item: any) -> any:
+        try:
+            return Pipeline._process(stage, executor, [item])[0]
+        except Exception as e:
+            logger.exception(f"Stage {stage.name} failed")
+            return PipelineFailure(stage.name, e)
+
+    @staticmethod
+    def _feed(items: List[any], out_queue: queue.Queue, num_workers: int) -> None:
+        for index, item in enumerate(items):
+            out_queue.put((index, item))
+        for _ in range(num_workers):
+            out_queue.put(_DONE)
+
+    @staticmethod
+    def _work(stage: PipelineStage,
+              executor: Optional[Executor],
+              in_queue: queue.Queue,
+              out_queue: queue.Queue,
+              remaining: List[int],
+              lock: threading.Lock,
+              next_workers: int,
+              ) -> None:
+        done = False
+        while not done:
+            entry = in_queue.get()
+            if entry is _DONE:
+                break
+            batch = [entry]
+            while len(batch) < stage.batch_size:
+                try:
+                    entry = in_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is _DONE:
+                    done = True
+                    break
+                batch.append(entry)
+
+            # failed items skip the remaining stages
+            for index, item in batch:
+                if isinstance(item, PipelineFailure):
+                    out_queue.put((index, item))
+            batch = [(index, item) for index, item in batch if not isinstance(item, PipelineFailure)]
+            if not batch:
+                continue
+            indices = [index for index, _ in batch]
+            inputs = [item for _, item in batch]
+            try:
+                outputs = Pipeline._process(stage, executor, inputs)
+            except Exception as e:
+                if len(inputs) == 1:
+                    logger.exception(f"Stage {stage.name} failed")
+                    outputs = [PipelineFailure(stage.name, e)]
+                else:
+                    # find the items that fail on their own
+                    logger.warning(f"Stage {stage.name} failed on a batch of {len(inputs)} items ({e!r}), "
+                                   f"processing them one at a time")
+                    outputs = [Pipeline._process_one(stage, executor, item) for item in inputs]
+            for index, output in zip(indices, outputs):
+                out_queue.put((index, output))
+
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                for _ in range(next_workers):
+                    out_queue.put(_DONE)
@@ -0,0 +1,112 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Iterable, Iterator, Mapping, Optional, Tuple, Union
+
+import numpy as np
+from pymatgen.core import Lattice, Structure
+
+from rlmolecule.crystal.utils import PackedStringTable
+
+logger = logging.getLogger(__name__)
+
+
+class StructureStore(Mapping):
+    """
+    A read-only mapping from structure ids to pymatgen structures (e.g., the ICSD prototypes keyed by action node, or
+    decorated structures keyed by state repr), backed by a directory of columnar .npy files:
+    the lattice matrix of each structure, and the fractional coordinates and atomic number of every site, with the sites
+    of structure i in site_offsets[i]:site_offsets[i + 1].
+
+    The files are memory-mapped, so opening a store is nearly free and its pages are shared between processes.
+    Structures are only built when first accessed, and the most recently used ones are kept in an LRU cache.
+    Only the elements of each site are stored, so oxidation states and site properties are dropped.
+    """
+
+    def __init__(self, directory: str, cache_size: int = 1024, mmap_mode: Optional[str] = 'r') -> None:
+        """
+        :param directory: A directory written by `StructureStore.write`
+        :param cache_size: Number of structures to keep in the LRU cache
+        :param mmap_mode: Passed to np.load. Use None to read the arrays into memory
+        """
+        self.directory = directory
+        self.mmap_mode = mmap_mode
+        self.keys_table = PackedStringTable.load(os.path.join(directory, 'keys'), mmap_mode=mmap_mode)
+        self.lattices = np.load(os.path.join(directory, 'lattices.npy'), mmap_mode=mmap_mode)
+        self.site_offsets = np.load(os.path.join(directory, 'site_offsets.npy'), mmap_mode=mmap_mode)
+        self.frac_coords = np.load(os.path.join(directory, 'frac_coords.npy'), mmap_mode=mmap_mode)
+        self.atomic_numbers = np.load(os.path.join(directory, 'atomic_numbers.npy'), mmap_mode=mmap_mode)
+
+        self.cache_size = cache_size
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __reduce__(self) -> tuple:
+        # reopen the files rather than copying their arrays, e.g., when sent to a worker process
+        return self.__class__, (self.directory, self.cache_size, self.mmap_mode)
+
+    def __len__(self) -> int:
+        return len(self.keys_table)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys_table)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.keys_table
+
+    def __getitem__(self, key: str) -> Structure:
+        with self._lock:
+            structure = self._cache.get(key)
+            if structure is not None:
+                self._cache.move_to_end(key)
+                return structure
+
+        lattice, atomic_numbers, frac_coords = self.get_arrays(key)
+        structure = Structure(Lattice(lattice), atomic_numbers.tolist(), frac_coords)
+
+        with self._lock:
+            self._cache[key] = structure
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return structure
+
+    def get_arrays(self, key: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ :return: the lattice matrix, the atomic number of each site, and the fractional coordinates of the sites of
+        the given structure, as (read-only) views of the store's arrays
+        """
+        structure_id = self.keys_table.get(key)
+        if structure_id is None:
+            raise KeyError(key)
+        sites = slice(self.site_offsets[structure_id], self.site_offsets[structure_id + 1])
+        return self.lattices[structure_id], self.atomic_numbers[sites], self.frac_coords[sites]
+
+    @staticmethod
+    def write(directory: str, structures: Union[Mapping[str, Structure], Iterable[Tuple[str, Structure]]]) -> None:
+        """ Write structures to a new store in the given directory
+
+        :param directory: Output directory, created if needed
+        :param structures: Mapping (or iterable of pairs) from structure id to an ordered pymatgen structure
+        """
+        if isinstance(structures, Mapping):
+            structures = structures.items()
+
+        keys, lattices, site_offsets, frac_coords, atomic_numbers = [], [], [0], [], []
+        for key, structure in structures:
+            if not structure.is_ordered:
+                raise ValueError(f"Structure {key} is disordered. Only ordered structures can be stored")
+            keys.append(key)
+            lattices.append(structure.lattice.matrix)
+            site_offsets.append(site_offsets[-1] + len(structure))
+            frac_coords.append(structure.frac_coords)
+            atomic_numbers.append([site.specie.Z for site in structure])
+
+        os.makedirs(directory, exist_ok=True)
+        PackedStringTable.from_keys(keys).save(os.path.join(directory, 'keys'))
+        np.save(os.path.join(directory, 'lattices.npy'), np.asarray(lattices, dtype=np.float64).reshape(-1, 3, 3))
+        np.save(os.path.join(directory, 'site_offsets.npy'), np.asarray(site_offsets, dtype=np.int64))
+        np.save(os.path.join(directory, 'frac_coords.npy'),
+                np.concatenate(frac_coords).astype(np.float64) if frac_coords else np.zeros((0, 3)))
+        np.save(os.path.join(directory, 'atomic_numbers.npy'),
+                np.concatenate(atomic_numbers).astype(np.uint8) if atomic_numbers else np.zeros(0, dtype=np.uint8))
+        logger.info(f"wrote {len(keys)} structures ({site_offsets[-1]} sites) to {directory}")
@@ -1,8 +1,44 @@
 import gzip
 import json
+import threading
+from typing import Hashable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
 from pymatgen.core import Structure
 
 
+class StringTable:
+    """ Interns strings (or other hashable action nodes, e.g., tuples of elements) as consecutive integer ids,
+    so that they can be stored and compared as small integers.
+    """
+
+    def __init__(self) -> None:
+        self.ids: dict = {}
+        self.keys: List[Hashable] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.ids
+
+    def __getitem__(self, key_id: int) -> Hashable:
+        return self.keys[key_id]
+
+    def intern(self, key: Hashable) -> int:
+        """ :return: the id of the given key, adding it to the table if it's new """
+        key_id = self.ids.get(key)
+        if key_id is None:
+            with self._lock:
+                key_id = self.ids.get(key)
+                if key_id is None:
+                    key_id = len(self.keys)
+                    self.keys.append(key)
+                    self.ids[key] = key_id
+        return key_id
+
+
 def read_structures_file(structures_file):
     print(f"reading {structures_file}")
     with gzip.open(structures_file, 'r') as f:
@@ -32,3 +68,87 @@ def write_structures_file(structures_file, structures_dict, round_float=None):
     with gzip.open(structures_file, 'w') as out:
         out.write(json.dumps(structures_dict).encode())
 
+
+
+class PackedStringTable:
+    """ An immutable table of strings (or tuples of strings, e.g., the element combinations in the first action graph)
+    stored in a single fixed-width numpy bytes array, along with the sort order of that array. Both arrays can be saved
+    with np.save and memory-mapped with np.load(mmap_mode='r'), so that the table is shared between processes rather
+    than built as python objects by each of them.
+
+    It behaves like a list of its keys for indexing and iteration, and like a dict from keys to their ids for `get`
+    and `in`. Keys are only decoded (or looked up with a binary search) the first time they're used.
+    """
+
+    def __init__(self, packed: np.ndarray, order: Optional[np.ndarray] = None) -> None:
+        """
+        :param packed: The encoded keys (see pack_strings), in id order
+        :param order: The ids sorted by their encoded key. Computed if not given
+        """
+        self.packed = packed
+        self.order = order if order is not None else np.argsort(packed, kind='stable').astype(np.int64)
+        self._keys: List[Optional[Hashable]] = [None] * len(packed)
+        self._ids: dict = {}
+
+    @classmethod
+    def from_keys(cls, keys: Sequence[Hashable]) -> 'PackedStringTable':
+        return cls(pack_strings(keys))
+
+    def __len__(self) -> int:
+        return len(self.packed)
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return (self[i] for i in range(len(self.packed)))
+
+    def __getitem__(self, key_id: int) -> Hashable:
+        key = self._keys[key_id]
+        if key is None:
+            key = decode_string(self.packed[key_id])
+            self._keys[key_id] = key
+        return key
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key) is not None
+
+    def get(self, key: Hashable, default: Optional[int] = None) -> Optional[int]:
+        """ :return: the id of the given key, or default if it's not in the table """
+        key_id = self._ids.get(key)
+        if key_id is None:
+            if not isinstance(key, (str, tuple)):
+                return default
+            encoded = encode_string(key)
+            position = int(np.searchsorted(self.packed, encoded, sorter=self.order))
+            if position == len(self.packed) or self.packed[self.order[position]] != encoded:
+                return default
+            key_id = int(self.order[position])
+            self._ids[key] = key_id
+        return key_id
+
+    def save(self, prefix: str) -> None:
+        np.save(f"{prefix}.npy", self.packed)
+        np.save(f"{prefix}_order.npy", self.order)
+
+    @classmethod
+    def load(cls, prefix: str, mmap_mode: Optional[str] = 'r') -> 'PackedStringTable':
+        return cls(np.load(f"{prefix}.npy", mmap_mode=mmap_mode), np.load(f"{prefix}_order.npy", mmap_mode=mmap_mode))
+
+
+def encode_string(key: Union[str, Tuple[str, ...]]) -> bytes:
+    """ Encode a string, or a tuple of strings, as bytes. Tuples are joined by tabs, with a leading tab to tell them
+    apart from strings (the action graph edgelists are tab-delimited, so their nodes can't contain tabs)
+    """
+    if isinstance(key, tuple):
+        return ('\t' + '\t'.join(key)).encode()
+    return key.encode()
+
+
+def decode_string(encoded: bytes) -> Union[str, Tuple[str, ...]]:
+    key = encoded.decode()
+    if key.startswith('\t'):
+        return tuple(key[1:].split('\t'))
+    return key
+
+
+def pack_strings(keys: Sequence[Union[str, Tuple[str, ...]]]) -> np.ndarray:
+    """ :return: the encoded keys as a fixed-width bytes array """
+    return np.array([encode_string(key) for key in keys], dtype=bytes)
@@ -0,0 +1,382 @@
+import logging
+import threading
+from typing import Dict, List, Optional, Sequence, Set, Type
+
+import numpy as np
+
+from rlmolecule.mcts.mcts_vertex import MCTSVertex
+from rlmolecule.tree_search.cycle_check import CycleChecker
+from rlmolecule.tree_search.dfs import GraphCycleError
+from rlmolecule.tree_search.graph_search_state import GraphSearchState
+
+logger = logging.getLogger(__name__)
+
+
+def _grow(array: np.ndarray, size: int, fill_value=0) -> np.ndarray:
+    grown = np.full(size, fill_value, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class ArrayTree:
+    """
+    A struct-of-arrays store for an MCTS graph. Vertices are integer ids: their states are kept in an id-indexed
+    list, and their visit counts, value sums and child index ranges live in growable numpy arrays. Children are stored
+    as contiguous ranges of an edge array, which also holds the prior of each (parent, child) edge, so transpositions
+    with several parents keep a separate prior per parent.
+
+    No object is kept per vertex besides its state: ArrayMCTSVertex handles, which the rest of the library uses to
+    interact with vertices, are created on demand by `vertex` and hold nothing but the tree and the id, and
+    canonicalizers keep vertex ids (see GraphSearchCanonicalizer.use_vertex_ids). Each vertex costs ~41 bytes in the
+    arrays and the state list, 8 bytes per outgoing edge, and 8 bytes per field (see `add_field`).
+
+    Released vertices (see `release`) drop their state and fields, and their ids are reused by new vertices. Edge
+    ranges that are no longer used are reclaimed once they make up most of the edge arrays.
+
+    Methods that modify the tree are guarded by a lock, since the arrays may be replaced as they grow and vertices can
+    be added from evaluation threads during parallel sampling.
+    """
+
+    def __init__(self, initial_capacity: int = 1024) -> None:
+        """
+        :param initial_capacity: initial number of vertices and edges to allocate. Arrays double in size when full.
+        """
+        self._initial_capacity = max(int(initial_capacity), 1)
+        self.lock = threading.RLock()
+        #: the handle class returned by `vertex`, set by the search that uses this tree
+        self.vertex_class: Type['ArrayMCTSVertex'] = ArrayMCTSVertex
+        self._field_names: List[str] = []
+        self.reset()
+
+    def reset(self) -> None:
+        capacity = self._initial_capacity
+        self.visit_count = np.zeros(capacity, dtype=np.int32)
+        self.value_sum = np.zeros(capacity, dtype=np.float64)
+        self.child_start = np.full(capacity, -1, dtype=np.int64)  # -1 marks an unexpanded vertex
+        self.child_count = np.zeros(capacity, dtype=np.int32)
+        self.has_priors = np.zeros(capacity, dtype=bool)
+        self.solved_value = np.full(capacity, np.nan, dtype=np.float64)  # nan marks a vertex that isn't solved
+        self.edge_child = np.zeros(capacity, dtype=np.int32)
+        self.edge_prior = np.zeros(capacity, dtype=np.float32)
+        self.num_vertices = 0  # including released vertices, whose ids are in _free_ids
+        self.num_edges = 0
+        self.states: List[Optional[GraphSearchState]] = []
+        self.fields: Dict[str, List[any]] = {name: [] for name in self._field_names}
+        self._free_ids: List[int] = []
+        self._num_unused_edges = 0
+        self._pinned: Set[int] = set()
+        self._released_pinned: Set[int] = set()
+
+    def __len__(self) -> int:
+        return self.num_vertices - len(self._free_ids)
+
+    @property
+    def nbytes(self) -> int:
+        """ Memory used by the statistics arrays (excluding the states and fields)"""
+        return sum(array.nbytes for array in (self.visit_count, self.value_sum, self.child_start, self.child_count,
+                                              self.has_priors, self.solved_value, self.edge_child,
+                                              self.edge_prior))
+
+    def set_vertex_class(self, vertex_class: Type['ArrayMCTSVertex']) -> None:
+        """ Set the handle class returned by `vertex`, and add the fields it keeps in the tree """
+        self.vertex_class = vertex_class
+        for name in vertex_class.tree_fields:
+            self.add_field(name)
+
+    def add_field(self, name: str) -> None:
+        """ Add a per-vertex field holding any python object (None by default), e.g., the policy inputs of AlphaZero
+        vertices. Fields are lists indexed by vertex id.
+        """
+        with self.lock:
+            if name not in self.fields:
+                self._field_names.append(name)
+                self.fields[name] = [None] * self.num_vertices
+
+    def vertex(self, vertex_id: int) -> 'ArrayMCTSVertex':
+        """ :return: a handle for the given vertex id """
+        return self.vertex_class(self, vertex_id)
+
+    def add_vertex(self, state: GraphSearchState) -> int:
+        """ Allocate storage for a new vertex.
+
+        :param state: the state of the new vertex
+        :return: the integer id of the new vertex
+        """
+        with self.lock:
+            if self._free_ids:
+                vertex_id = self._free_ids.pop()
+                self.states[vertex_id] = state
+                return vertex_id
+
+            vertex_id = self.num_vertices
+            if vertex_id == len(self.visit_count):
+                size = 2 * vertex_id
+                self.visit_count = _grow(self.visit_count, size)
+                self.value_sum = _grow(self.value_sum, size)
+                self.child_start = _grow(self.child_start, size, -1)
+                self.child_count = _grow(self.child_count, size)
+                self.has_priors = _grow(self.has_priors, size, False)
+                self.solved_value = _grow(self.solved_value, size, np.nan)
+
+            self.states.append(state)
+            for field in self.fields.values():
+                field.append(None)
+            self.num_vertices += 1
+            return vertex_id
+
+    def release(self, vertex_id: int) -> None:
+        """ Free a vertex that was dropped from the search graph: its state and fields are dropped, its statistics and
+        children are cleared, and its id is reused by the next new vertex. Pinned vertices are only released once they
+        are unpinned.
+        """
+        with self.lock:
+            if vertex_id in self._pinned:
+                self._released_pinned.add(vertex_id)
+                return
+            self.states[vertex_id] = None
+            for field in self.fields.values():
+                field[vertex_id] = None
+            self._set_unexpanded(vertex_id)
+            self.visit_count[vertex_id] = 0
+            self.value_sum[vertex_id] = 0.
+            self.solved_value[vertex_id] = np.nan
+            self._free_ids.append(vertex_id)
+
+    def pin(self, vertex_ids: Sequence[int]) -> None:
+        """ Keep the given vertices valid until `unpin` is called, even if they are released in the meantime (e.g., the
+        vertices on the path of a game, which are dropped from the search graph as the game advances) """
+        with self.lock:
+            self._pinned.update(vertex_ids)
+
+    def unpin(self) -> None:
+        """ Unpin every vertex, and release the pinned vertices whose release was deferred """
+        with self.lock:
+            released, self._released_pinned = self._released_pinned, set()
+            self._pinned = set()
+            for vertex_id in released:
+                self.release(vertex_id)
+
+    def set_children(self, vertex_id: int, child_ids: Optional[Sequence[int]]) -> None:
+        """ Store the children of the given vertex as a contiguous range of the edge arrays. Passing None marks the
+        vertex as unexpanded. Replaced edge ranges are reclaimed once they make up most of the edge arrays.
+        """
+        with self.lock:
+            if child_ids is None:
+                self._set_unexpanded(vertex_id)
+                return
+
+            self.has_priors[vertex_id] = False
+
+            num_children = len(child_ids)
+            start = self.num_edges
+            old_start, old_count = self.child_start[vertex_id], self.child_count[vertex_id]
+            if 0 <= old_start and old_start + old_count == start and old_count <= num_children and \
+                    np.array_equal(self.edge_child[old_start:start], child_ids[:old_count]):
+                # the children were extended (e.g., by progressive widening), and the vertex's edge range is the last
+                # one in the edge arrays, so it can grow in place
+                start = int(old_start)
+            else:
+                self._set_unexpanded(vertex_id)
+                if self._num_unused_edges > max(self.num_edges // 2, self._initial_capacity):
+                    self._compact_edges()
+                    start = self.num_edges
+            end = start + num_children
+            if end > len(self.edge_child):
+                size = max(2 * len(self.edge_child), end)
+                self.edge_child = _grow(self.edge_child, size)
+                self.edge_prior = _grow(self.edge_prior, size)
+
+            self.edge_child[start:end] = child_ids
+            self.edge_prior[start:end] = 0.
+            self.child_start[vertex_id] = start
+            self.child_count[vertex_id] = num_children
+            self.num_edges = end
+
+    def _set_unexpanded(self, vertex_id: int) -> None:
+        self._num_unused_edges += int(self.child_count[vertex_id])
+        self.child_start[vertex_id] = -1
+        self.child_count[vertex_id] = 0
+        self.has_priors[vertex_id] = False
+
+    def _compact_edges(self) -> None:
+        """ Move the edge ranges of every expanded vertex to the front of the edge arrays, dropping unused ranges.
+        New arrays are allocated, so that threads reading the previous ones aren't affected. """
+        expanded = np.flatnonzero(self.child_start[:self.num_vertices] >= 0)
+        counts = self.child_count[expanded].astype(np.int64)
+        starts = np.cumsum(counts) - counts
+        num_edges = int(counts.sum())
+        old_edges = np.repeat(self.child_start[expanded] - starts, counts) + np.arange(num_edges)
+        size = max(len(self.edge_child) // 2, self._initial_capacity, num_edges)
+        self.edge_child = _grow(self.edge_child[old_edges], size)
+        self.edge_prior = _grow(self.edge_prior[old_edges], size)
+        self.child_start[expanded] = starts
+        self.num_edges = num_edges
+        self._num_unused_edges = 0
+
+    def is_expanded(self, vertex_id: int) -> bool:
+        return self.child_start[vertex_id] >= 0
+
+    def edge_range(self, vertex_id: int) -> slice:
+        """ :return: the slice of the edge arrays holding the children of the given vertex """
+        start = max(int(self.child_start[vertex_id]), 0)
+        return slice(start, start + int(self.child_count[vertex_id]))
+
+    def child_ids(self, vertex_id: int) -> np.ndarray:
+        with self.lock:
+            return self.edge_child[self.edge_range(vertex_id)]
+
+    def child_visit_counts(self, vertex_id: int) -> np.ndarray:
+        return self.visit_count[self.child_ids(vertex_id)]
+
+    def set_priors(self, vertex_id: int, priors: Sequence[float]) -> None:
+        """ Store priors for the children of the given vertex, in the same order as its children """
+        with self.lock:
+            edges = self.edge_range(vertex_id)
+            assert len(priors) == edges.stop - edges.start, "Number of priors must match the number of children"
+            self.edge_prior[edges] = priors
+            self.has_priors[vertex_id] = True
+
+    def clear_priors(self, vertex_id: int) -> None:
+        self.has_priors[vertex_id] = False
+
+    def priors(self, vertex_id: int) -> Optional[np.ndarray]:
+        with self.lock:
+            if not self.has_priors[vertex_id]:
+                return None
+            return self.edge_prior[self.edge_range(vertex_id)]
+
+    def clear_statistics(self) -> None:
+        """ Clear the visits, rewards and priors of every vertex, keeping the structure of the tree and the solved
+        values """
+        with self.lock:
+            self.visit_count[:] = 0
+            self.value_sum[:] = 0.
+            self.has_priors[:] = False
+
+    def update(self, vertex_ids: Sequence[int], reward: float, visits: int = 1) -> None:
+        """ Add visits and a reward to each of the given vertices. A search path never contains the same vertex twice
+        (the search graph is acyclic), so fancy indexing is safe here. Negative visits are used to revert a virtual
+        loss.
+        """
+        vertex_ids = np.asarray(vertex_ids, dtype=np.int64)
+        with self.lock:
+            self.visit_count[vertex_ids] += visits
+            self.value_sum[vertex_ids] += reward
+
+
+class ArrayMCTSVertex(MCTSVertex):
+    """
+    A handle for a vertex of an ArrayTree. Handles only hold the tree and the vertex id, and are created whenever a
+    vertex is returned to the rest of the library (see ArrayTree.vertex); two handles for the same id are equal. The
+    state and all other attributes are views into the tree. (The slots inherited from MCTSVertex are left unused.)
+    """
+    __slots__ = ('tree', 'id')
+    #: the fields this class keeps in the tree, see ArrayTree.add_field
+    tree_fields = ()
+
+    def __init__(self, tree: ArrayTree, vertex_id: int) -> None:
+        self.tree: ArrayTree = tree
+        self.id: int = vertex_id
+
+    def __eq__(self, other: any) -> bool:
+        return isinstance(other, ArrayMCTSVertex) and self.id == other.id and self.tree is other.tree
+
+    def __hash__(self) -> int:
+        return hash(self.id)
+
+    @property
+    def state(self) -> GraphSearchState:
+        return self.tree.states[self.id]
+
+    @property
+    def visit_count(self) -> int:
+        return int(self.tree.visit_count[self.id])
+
+    @visit_count.setter
+    def visit_count(self, value: int) -> None:
+        self.tree.visit_count[self.id] = value
+
+    @property
+    def value_sum(self) -> float:
+        return float(self.tree.value_sum[self.id])
+
+    @value_sum.setter
+    def value_sum(self, value: float) -> None:
+        self.tree.value_sum[self.id] = value
+
+    @property
+    def children(self) -> Optional[List['ArrayMCTSVertex']]:
+        tree = self.tree
+        if not tree.is_expanded(self.id):
+            return None
+        vertex_class = tree.vertex_class
+        return [vertex_class(tree, child_id) for child_id in tree.child_ids(self.id).tolist()]
+
+    @children.setter
+    def children(self, children: Optional[List['ArrayMCTSVertex']]) -> None:
+        self.tree.set_children(self.id, None if children is None else [child.id for child in children])
+
+    @property
+    def expanded(self) -> bool:
+        return self.tree.is_expanded(self.id)
+
+    @property
+    def solved_value(self) -> Optional[float]:
+        value = self.tree.solved_value[self.id]
+        return None if np.isnan(value) else float(value)
+
+    @solved_value.setter
+    def solved_value(self, value: Optional[float]) -> None:
+        self.tree.solved_value[self.id] = np.nan if value is None else value
+
+    def update(self, reward: float) -> None:
+        self.tree.update([self.id], reward)
+
+
+class ArrayCycleChecker(CycleChecker):
+    """
+    A CycleChecker for the vertices of an ArrayTree, which keeps the level of each vertex in an array indexed by
+    vertex id rather than in a dictionary keyed by vertex.
+    """
+
+    def __init__(self, tree: ArrayTree) -> None:
+        self.tree = tree
+        super().__init__()
+
+    def reset(self) -> None:
+        self._levels: np.ndarray = np.full(0, -1, dtype=np.int32)
+
+    def remove(self, vertex: ArrayMCTSVertex) -> None:
+        if vertex.id < len(self._levels):
+            self._levels[vertex.id] = -1
+
+    def add_edges(self, parent: ArrayMCTSVertex, children: Sequence[ArrayMCTSVertex]) -> None:
+        tree = self.tree
+        if len(self._levels) < tree.num_vertices:
+            self._levels = _grow(self._levels, max(2 * len(self._levels), tree.num_vertices), -1)
+        levels = self._levels
+
+        parent_id = parent.id
+        parent_level = max(int(levels[parent_id]), 0)
+        levels[parent_id] = parent_level
+
+        stack = []
+        for child in children:
+            child_id = child.id
+            if levels[child_id] <= parent_level:
+                if child_id == parent_id:
+                    raise GraphCycleError(parent)
+                levels[child_id] = parent_level + 1
+                if tree.child_count[child_id]:
+                    stack.append(child_id)
+
+        while stack:
+            vertex_id = stack.pop()
+            level = levels[vertex_id] + 1
+            for child_id in tree.child_ids(vertex_id).tolist():
+                if levels[child_id] < level:
+                    if child_id == parent_id:
+                        raise GraphCycleError(parent)
+                    levels[child_id] = level
+                    if tree.child_count[child_id]:
+                        stack.append(child_id)
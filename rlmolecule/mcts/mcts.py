@@ -1,14 +1,17 @@
 import logging
 import math
 import random
+from concurrent.futures import Executor, FIRST_COMPLETED, Future, wait
 from time import time
-from typing import Callable, List, Optional, Type
+from typing import Callable, Dict, List, Optional, Sequence, Type
 
 import numpy as np
 
+from rlmolecule.mcts.array_tree import ArrayCycleChecker, ArrayMCTSVertex, ArrayTree
 from rlmolecule.mcts.mcts_problem import MCTSProblem
 from rlmolecule.mcts.mcts_vertex import MCTSVertex
-from rlmolecule.tree_search.dfs import dfs
+from rlmolecule.tree_search.canonicalizer.graph_search_canonicalizer import GraphSearchCanonicalizer
+from rlmolecule.tree_search.cycle_check import CycleChecker
 from rlmolecule.tree_search.graph_search import GraphSearch
 from rlmolecule.tree_search.graph_search_state import GraphSearchState
 from rlmolecule.tree_search.reward import Reward
@@ -16,19 +19,81 @@ from rlmolecule.tree_search.reward import Reward
 logger = logging.getLogger(__name__)
 
 
+def dedupe(seq):
+    seen = set()
+    seen_add = seen.add
+    return [x for x in seq if not (x in seen or seen_add(x))]
+
+
 class MCTS(GraphSearch[MCTSVertex]):
     def __init__(self,
                  problem: MCTSProblem,
                  ucb_constant: float = math.sqrt(2),
                  vertex_class: Optional[Type[MCTSVertex]] = None,
                  state_builder: any = None,
+                 tree_store: Optional[ArrayTree] = None,
+                 virtual_loss: int = 1,
+                 num_parallel: int = 1,
+                 persist_graph: bool = False,
+                 canonicalizer: Optional[GraphSearchCanonicalizer] = None,
+                 acyclic: bool = False,
+                 widening_coefficient: Optional[float] = None,
+                 widening_exponent: float = 0.5,
+                 lazy_children: bool = False,
+                 solver: bool = False,
                  **kwargs) -> None:
-        super().__init__(MCTSVertex if vertex_class is None else vertex_class)
+        if vertex_class is None:
+            vertex_class = MCTSVertex if tree_store is None else ArrayMCTSVertex
+        super().__init__(vertex_class, canonicalizer=canonicalizer)
         self._problem: MCTSProblem = problem
         self.ucb_constant: float = ucb_constant
         #:param state_builder: In some cases, a state uses a complex state_builder to select the next actions.
         # If passed in here, it will be passed to the state's get_next_actions() function
         self.state_builder = state_builder
+        #:param tree_store: If given, vertices are integer ids into this ArrayTree, which holds their states and
+        # statistics, rather than vertex objects. Selection and backpropagation operate on the ids, and the vertices
+        # returned to the rest of the library are handles created on demand.
+        self.tree_store: Optional[ArrayTree] = tree_store
+        if tree_store is not None:
+            tree_store.set_vertex_class(vertex_class)
+            self.canonicalizer.use_vertex_ids(tree_store.vertex)
+        #:param virtual_loss: number of zero-reward visits temporarily added to each vertex of a search path while its
+        # evaluation is pending, when sampling with several simulations in flight.
+        self.virtual_loss: int = virtual_loss
+        #:param num_parallel: the default number of simulations in flight at once in `sample`. Without an executor,
+        # this is the number of leaves collected before they are evaluated together by `_evaluate_batch`.
+        self.num_parallel: int = num_parallel
+        #:param persist_graph: If True, `run` keeps the search graph and its statistics from previous games rather
+        # than resetting the canonicalizer. Visits, values and priors are cleared (keeping the graph structure and any
+        # cached policy inputs) whenever the problem's checkpoint changes.
+        self.persist_graph: bool = persist_graph
+        self._graph_checkpoint: Optional[str] = None
+        #:param acyclic: If True, the problem guarantees that its search space is a directed acyclic graph (e.g., a
+        # layered graph where each action moves one level deeper), and expansions are not checked for cycles.
+        self._cycle_checker: Optional[CycleChecker] = None
+        if not acyclic:
+            self._cycle_checker = CycleChecker() if tree_store is None else ArrayCycleChecker(tree_store)
+        #:param widening_coefficient: If given, expanded vertices only admit
+        # ceil(widening_coefficient * visit_count ** widening_exponent) of their successors, and admit more as their
+        # visit count grows (progressive widening). Successors are admitted in a random order, unless the search ranks
+        # them (AlphaZero admits them by descending prior). Successors that haven't been admitted yet are kept as
+        # action descriptors, without creating vertices for them.
+        self.widening_coefficient: Optional[float] = widening_coefficient
+        self.widening_exponent: float = widening_exponent
+        #:param lazy_children: If True, expanded vertices hold their successors as lightweight action descriptors (see
+        # GraphSearchState.get_next_action_descriptors), and a successor's state and vertex are only built once it is
+        # selected. AlphaZero builds all children when a vertex is evaluated, since its policy needs their inputs.
+        self.lazy_children: bool = lazy_children
+        self._pending_successors: Dict[MCTSVertex, List[any]] = {}
+        #:param solver: If True, a vertex is marked as solved once its reward is known exactly: terminal vertices once
+        # they are scored, and other vertices once all of their children are solved, with the best of their
+        # children's values (MCTS-Solver). Solved children are skipped by selection, and sampling stops once the
+        # starting vertex is solved, so that finite search spaces aren't sampled again once exhausted. Solved values
+        # are kept when the statistics are cleared, and with persist_graph, across games. They hold raw rewards, which
+        # are scaled by the problem's reward_class whenever they are read, so that they follow reward factories whose
+        # scaling changes between games (e.g., RankedRewardFactory).
+        self.solver: bool = solver
+        self.canonicalizer.set_release_callback(self._release_vertex)
 
     @property
     def problem(self) -> MCTSProblem:
@@ -41,7 +106,10 @@ class MCTS(GraphSearch[MCTSVertex]):
             timeout: Optional[float] = None,
             max_depth: int = 1000000,
             action_selection_function: Optional[Callable[[MCTSVertex], MCTSVertex]] = None,
-            reset_canonicalizer: bool = True,
+            reset_canonicalizer: Optional[bool] = None,
+            num_parallel: Optional[int] = None,
+            executor: Optional[Executor] = None,
+            adaptive_budget: bool = False,
     ) -> ([], float):
         """
         Run the MCTS search from the given starting state (or the root node if not provided). This function runs a
@@ -53,29 +121,62 @@ class MCTS(GraphSearch[MCTSVertex]):
         :param state: the starting state, or if not provided, the state returned from _get_root()
         :param action_selection_function: a function used to select among the possible next actions. Defaults to
             softmax sampling by visit counts.
-        :param reset_canonicalizer: whether to reset the graph canonicalizer in advance of the run
+        :param reset_canonicalizer: whether to reset the graph canonicalizer in advance of the run. Defaults to True,
+            unless the search graph is persisted across games.
+        :param num_parallel: the maximum number of simulations in flight at once, see `sample`
+        :param executor: an optional executor used to evaluate leaves concurrently, see `sample`
+        :param adaptive_budget: if True, stop sampling a vertex early when its decision can't change (see `sample`),
+            and carry the unused samples over to the following decisions.
         :return: The search path (as a list of vertexes) and the reward from this search.
         """
         self.problem.initialize_run()
+        if self.tree_store is not None:
+            # the vertices on the path of the previous game can be freed
+            self.tree_store.unpin()
+
+        if reset_canonicalizer is None:
+            reset_canonicalizer = not self.persist_graph
 
         if reset_canonicalizer:
             self.canonicalizer.reset()
+            if self._cycle_checker is not None:
+                self._cycle_checker.reset()
+            self._pending_successors = {}
+            if self.tree_store is not None:
+                self.tree_store.reset()
+            self._graph_checkpoint = self.problem.checkpoint
 
         vertex = self._get_root() if state is None else self.get_vertex_for_state(state)
+
+        if self.problem.checkpoint != self._graph_checkpoint:
+            logger.info(f"Checkpoint changed to {self.problem.checkpoint}, clearing search statistics")
+            self._reset_statistics([self._get_root(), vertex])
+            self._graph_checkpoint = self.problem.checkpoint
+
+        self.canonicalizer.advance_root(vertex)
         action_selection_function = action_selection_function if action_selection_function is not None \
             else self.softmax_selection
 
         path: [] = []
+        carry_over = 0
         for _ in range(max_depth):
             # todo: this loop is odd, we're sampling terminal nodes a whole bunch of extra times
-            self.sample(vertex, num_mcts_samples, timeout=timeout)
+            #  (unless adaptive_budget is set)
+            budget = num_mcts_samples + carry_over
+            num_samples = self.sample(vertex, budget, timeout=timeout, num_parallel=num_parallel, executor=executor,
+                                      adaptive_budget=adaptive_budget)
+            carry_over = budget - num_samples if adaptive_budget else 0
             self._accumulate_path_data(vertex, path)
+            if self.tree_store is not None:
+                # keep the vertices of the returned path valid as they're dropped from the search graph
+                self.tree_store.pin([vertex.id] + self.tree_store.child_ids(vertex.id).tolist())
             if len(vertex.children) == 0:
                 return path, self.problem.reward_wrapper(vertex)
-            logger.debug(
-                f'{vertex} has children { {child: (round(child.value, 2), child.visit_count) for child in vertex.children} }'
-            )
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'{vertex} has children '
+                             f'{ {child: (round(child.value, 2), child.visit_count) for child in vertex.children} }')
             vertex = action_selection_function(vertex)
+            self.canonicalizer.advance_root(vertex)
 
         logger.warning(f"{self} reached max_depth.")
         return path, math.nan  # todo: make sure this returns a reward class
@@ -85,20 +186,150 @@ class MCTS(GraphSearch[MCTSVertex]):
             vertex: MCTSVertex,
             num_mcts_samples: int = 1,
             timeout: Optional[float] = None,
-    ) -> None:
+            num_parallel: Optional[int] = None,
+            executor: Optional[Executor] = None,
+            adaptive_budget: bool = False,
+    ) -> int:
         """
         Perform MCTS sampling from the given vertex.
+
+        :param num_parallel: the maximum number of simulations in flight at once (self.num_parallel if not provided).
+            Pending search paths carry a virtual loss, so that concurrent selections spread across different leaves.
+        :param executor: if provided, leaf evaluations are submitted to this executor and backpropagated as they
+            complete, possibly out of order. The problem's reward and policy functions are then called from the
+            executor's workers, and must be safe to call concurrently. Without an executor, up to `num_parallel` leaves
+            are selected before being evaluated together.
+        :param adaptive_budget: if True, terminal vertices and vertices with a single child are not sampled at all,
+            and sampling stops as soon as the most visited child can no longer be overtaken by another child with the
+            remaining samples.
+        :return: the number of samples performed
         """
+        if adaptive_budget:
+            if vertex.children is None:
+                self._expand(vertex)
+            if len(vertex.children) <= 1 and vertex not in self._pending_successors:
+                return 0
+
+        num_parallel = self.num_parallel if num_parallel is None else num_parallel
+        if num_parallel > 1 or executor is not None:
+            return self._sample_parallel(vertex, num_mcts_samples, timeout, num_parallel, executor, adaptive_budget)
+
         start_time = time()
-        for _ in range(num_mcts_samples):
+        for i in range(num_mcts_samples):
+            if self.solver and vertex.solved:
+                return i
             search_path = self._select(vertex)
             value = self._evaluate(search_path)
             self._backpropagate(search_path, value)
+            # the leaf was just evaluated, collapsing it would waste that evaluation
+            self.canonicalizer.trim(in_use=search_path)
+
+            if adaptive_budget and self._is_decided(vertex, num_mcts_samples - i - 1):
+                return i + 1
 
             if timeout:
                 # Break the iterations if we're running for a fixed time
                 if (time() - start_time) > timeout:
-                    return
+                    return i + 1
+
+        return num_mcts_samples
+
+    def _sample_parallel(
+            self,
+            vertex: MCTSVertex,
+            num_mcts_samples: int,
+            timeout: Optional[float],
+            num_parallel: int,
+            executor: Optional[Executor],
+            adaptive_budget: bool = False,
+    ) -> int:
+        """
+        Perform MCTS sampling with several simulations in flight at once, see `sample`.
+
+        :return: the number of samples performed
+        """
+        start_time = time()
+        num_started = 0
+
+        if executor is None:
+            while num_started < num_mcts_samples and not (self.solver and vertex.solved):
+                num_pending = min(num_parallel, num_mcts_samples - num_started)
+                search_paths = [self._select_pending(vertex) for _ in range(num_pending)]
+                num_started += num_pending
+                for search_path, value in zip(search_paths, self._evaluate_batch(search_paths)):
+                    self._complete_pending(search_path, value)
+                self.canonicalizer.trim(in_use=[vertex for search_path in search_paths for vertex in search_path])
+
+                if adaptive_budget and self._is_decided(vertex, num_mcts_samples - num_started):
+                    break
+                if timeout and (time() - start_time) > timeout:
+                    break
+            return num_started
+
+        pending: Dict[Future, List[MCTSVertex]] = {}
+        num_samples = num_mcts_samples
+        while num_started < num_samples or pending:
+            while num_started < num_samples and len(pending) < num_parallel:
+                search_path = self._select_pending(vertex)
+                pending[executor.submit(self._evaluate, search_path)] = search_path
+                num_started += 1
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            completed = [(pending.pop(future), future.result()) for future in done]
+            for search_path, value in completed:
+                self._complete_pending(search_path, value)
+            with self._vertex_lock:
+                # the leaves of pending paths are still being evaluated
+                in_use = [vertex for search_path, _ in completed for vertex in search_path] + \
+                         [vertex for search_path in pending.values() for vertex in search_path]
+                self.canonicalizer.trim(in_use=in_use)
+
+            if (timeout and (time() - start_time) > timeout) or \
+                    (adaptive_budget and self._is_decided(vertex, num_samples - num_started)) or \
+                    (self.solver and vertex.solved):
+                # stop launching new simulations, but let the pending ones finish
+                num_samples = num_started
+
+        return num_started
+
+    def _is_decided(self, vertex: MCTSVertex, num_remaining: int) -> bool:
+        """
+        Whether the most visited child of the given vertex is certain to stay the most visited one, even if all of the
+        remaining samples went to the runner-up. Successors that haven't been admitted yet count as unvisited children.
+        """
+        if self.tree_store is not None:
+            visit_counts = self.tree_store.child_visit_counts(vertex.id)
+        else:
+            visit_counts = np.fromiter((child.visit_count for child in vertex.children), dtype=np.int64)
+        if vertex in self._pending_successors:
+            # successors that are yet to be admitted could still take the remaining samples
+            visit_counts = np.append(visit_counts, 0)
+        if len(visit_counts) < 2:
+            return True
+        runner_up, leader = np.partition(visit_counts, -2)[-2:]
+        return leader - runner_up > num_remaining
+
+    def _select_pending(self, vertex: MCTSVertex) -> [MCTSVertex]:
+        """
+        Select a search path and mark it as pending: the leaf is expanded here, so that the tree is only modified by
+        the calling thread, and a virtual loss is applied to the path until its evaluation is complete.
+        """
+        search_path = self._select(vertex)
+        self._expand(search_path[-1])
+        self._apply_virtual_loss(search_path, self.virtual_loss)
+        return search_path
+
+    def _complete_pending(self, search_path: [MCTSVertex], value: Reward) -> None:
+        self._apply_virtual_loss(search_path, -self.virtual_loss)
+        self._backpropagate(search_path, value)
+
+    def _apply_virtual_loss(self, search_path: [MCTSVertex], visits: int) -> None:
+        if self.tree_store is not None:
+            self.tree_store.update([vertex.id for vertex in search_path], 0., visits)
+            return
+
+        for vertex in search_path:
+            vertex.visit_count += visits
 
     # noinspection PyMethodMayBeStatic
     def _accumulate_path_data(self, vertex: MCTSVertex, path: []):
@@ -116,13 +347,67 @@ class MCTS(GraphSearch[MCTSVertex]):
         (playout) has yet been initiated. The section below says more about a way of biasing choice of child vertices that
         lets the game tree expand towards the most promising moves, which is the essence of Monte Carlo tree search.
         """
+        if self.tree_store is not None:
+            return self._select_ids(root)
+
         search_path = [root]
         while True:
             current = search_path[-1]
             children = current.children
-            if children is None or len(children) == 0:
+            if children is None or len(children) == 0 or current.visit_count == 0:
                 return search_path
-            search_path.append(max(children, key=lambda child: self._ucb_score(current, child)))
+            if self._pending_successors and self._widen(current):
+                children = current.children
+            num_children = len(children)
+            if self.solver:
+                solved = np.fromiter((child.solved for child in children), dtype=bool, count=num_children)
+                if solved.all():
+                    if current not in self._pending_successors:
+                        self._solve(current)
+                        return search_path
+                    # the pending successors are the only ones left to search
+                    self._admit(current, 1)
+                    children = current.children
+                    num_children = len(children)
+                    solved = np.append(solved, False)
+            visit_counts = np.fromiter((child.visit_count for child in children), dtype=np.float64, count=num_children)
+            value_sums = np.fromiter((child.value_sum for child in children), dtype=np.float64, count=num_children)
+            scores = self._ucb_scores(current.visit_count, visit_counts, value_sums,
+                                      getattr(current, 'child_prior_array', None))
+            if self.solver:
+                scores[solved] = -math.inf
+            search_path.append(children[int(np.argmax(scores))])
+
+    def _select_ids(self, root: ArrayMCTSVertex) -> [ArrayMCTSVertex]:
+        """
+        Selection step of MCTS over an ArrayTree. The search path is walked using integer vertex ids, and only
+        converted to vertex handles once a leaf has been reached.
+        """
+        tree = self.tree_store
+        search_path = [root.id]
+        while True:
+            current = search_path[-1]
+            if tree.child_count[current] == 0 or tree.visit_count[current] == 0:
+                return [tree.vertex(vertex_id) for vertex_id in search_path]
+            if self._pending_successors:
+                self._widen(tree.vertex(current))
+            edges = tree.edge_range(current)
+            children = tree.edge_child[edges]
+            if self.solver:
+                solved = ~np.isnan(tree.solved_value[children])
+                if solved.all():
+                    if tree.vertex(current) not in self._pending_successors:
+                        self._solve(tree.vertex(current))
+                        return [tree.vertex(vertex_id) for vertex_id in search_path]
+                    self._admit(tree.vertex(current), 1)
+                    edges = tree.edge_range(current)
+                    children = tree.edge_child[edges]
+                    solved = np.append(solved, False)
+            scores = self._ucb_scores(tree.visit_count[current], tree.visit_count[children], tree.value_sum[children],
+                                      tree.edge_prior[edges] if tree.has_priors[current] else None)
+            if self.solver:
+                scores[solved] = -math.inf
+            search_path.append(int(children[np.argmax(scores)]))
 
     def _expand(self, leaf: MCTSVertex) -> None:
         """
@@ -132,24 +417,100 @@ class MCTS(GraphSearch[MCTSVertex]):
         child vertices and choose vertex C from one of them. Child vertices are any valid moves from the game
         position defined by L.
         """
-
-        def dedupe(seq):  # TODO: move me
-            seen = set()
-            seen_add = seen.add
-            return [x for x in seq if not (x in seen or seen_add(x))]
-
         if leaf.children is None:
-            if self.state_builder:
+            # successors left pending when the vertex was collapsed (see BoundedHashCanonicalizer) are listed again
+            self._pending_successors.pop(leaf, None)
+            if self.lazy_children or self.widening_coefficient is not None:
+                # Successors are held as action descriptors, and only turned into states and vertices once admitted
+                descriptors = dedupe(self._get_action_descriptors(leaf.state))
+                if self.widening_coefficient is not None:
+                    random.shuffle(descriptors)
+                    num_admitted = self._num_admitted(leaf.visit_count)
+                else:
+                    num_admitted = 1
+                if len(descriptors) > num_admitted:
+                    # kept in reverse so that admitting successors pops them from the end
+                    self._pending_successors[leaf] = descriptors[:num_admitted - 1:-1]
+                children = [self._materialize(leaf.state, descriptor) for descriptor in descriptors[:num_admitted]]
+
+            elif self.state_builder:
                 children = leaf.state.get_next_actions(self.state_builder)
             else:
                 children = leaf.state.get_next_actions()
+
             leaf.children = dedupe((self.get_vertex_for_state(state) for state in children))
+            self._add_edges(leaf, leaf.children)
 
-            for child in leaf.children:
-                # child.children is initialized to None, so this only checks nodes where a transposition pointed
-                # to an already existing node in the MCTS graph.
-                if child.children is not None:
-                    dfs(set(), child, leaf)
+    def _get_action_descriptors(self, state: GraphSearchState) -> Sequence[any]:
+        if self.state_builder:
+            return state.get_next_action_descriptors(self.state_builder)
+        return state.get_next_action_descriptors()
+
+    def _materialize(self, state: GraphSearchState, descriptor: any) -> GraphSearchState:
+        if self.state_builder:
+            return state.materialize_action(descriptor, self.state_builder)
+        return state.materialize_action(descriptor)
+
+    def _num_admitted(self, visit_count: int) -> int:
+        return max(1, math.ceil(self.widening_coefficient * max(visit_count, 1) ** self.widening_exponent))
+
+    def _widen(self, vertex: MCTSVertex) -> bool:
+        """
+        Admit more of the vertex's pending successors as children. With progressive widening, this depends on the
+        vertex's visit count; otherwise (with lazy children), the next successor is admitted once every current child
+        has been visited, since UCB would select an unvisited successor first.
+
+        :return: whether new children were added
+        """
+        if vertex not in self._pending_successors:
+            return False
+
+        children = vertex.children
+        if self.widening_coefficient is not None:
+            num_new = self._num_admitted(vertex.visit_count) - len(children)
+        else:
+            num_new = 1 if all(child.visit_count > 0 for child in children) else 0
+
+        return self._admit(vertex, num_new)
+
+    def _admit(self, vertex: MCTSVertex, num_new: int) -> bool:
+        """
+        Materialize up to `num_new` of the vertex's pending successors and add them to its children.
+
+        :return: whether new children were added
+        """
+        pending = self._pending_successors[vertex]
+        num_new = min(num_new, len(pending))
+        if num_new <= 0:
+            return False
+
+        new_children = [self._admit_successor(vertex, pending.pop()) for _ in range(num_new)]
+        if not pending:
+            del self._pending_successors[vertex]
+
+        vertex.children = vertex.children + new_children
+        self._add_edges(vertex, new_children)
+        return True
+
+    def _admit_successor(self, vertex: MCTSVertex, successor: any) -> MCTSVertex:
+        """ :return: the vertex for one of the given vertex's pending successors """
+        return self.get_vertex_for_state(self._materialize(vertex.state, successor))
+
+    def _add_edges(self, parent: MCTSVertex, children: Sequence[MCTSVertex]) -> None:
+        if self._cycle_checker is not None:
+            self._cycle_checker.add_edges(parent, children)
+        self.canonicalizer.add_edges(parent, children)
+
+    def _release_vertex(self, vertex: MCTSVertex) -> None:
+        """
+        Free what the search keeps for a vertex that the canonicalizer dropped from the search graph, see
+        GraphSearchCanonicalizer.set_release_callback.
+        """
+        self._pending_successors.pop(vertex, None)
+        if self._cycle_checker is not None:
+            self._cycle_checker.remove(vertex)
+        if self.tree_store is not None:
+            self.tree_store.release(vertex.id)
 
     def _evaluate(
             self,
@@ -166,6 +527,8 @@ class MCTS(GraphSearch[MCTSVertex]):
         """
         assert len(search_path) > 0, 'Invalid attempt to evaluate an empty search path.'
         leaf = search_path[-1]
+        if self.solver and leaf.solved:
+            return self.problem.reward_class(raw_reward=leaf.solved_value)
 
         # This `expand` call sets up further visits for this node, but visits to children
         # aren't tracked below the given leaf node
@@ -173,23 +536,70 @@ class MCTS(GraphSearch[MCTSVertex]):
 
         state = leaf.state
         while True:
-            if self.state_builder:
-                children = state.get_next_actions(self.state_builder)
-            else:
-                children = state.get_next_actions()
-            if len(children) == 0:
+            # only the chosen successor is materialized at each step of the rollout
+            descriptors = self._get_action_descriptors(state)
+            if len(descriptors) == 0:
                 return self.problem.reward_wrapper(self.get_vertex_for_state(state))
-            state = random.choice(children)
+            state = self._materialize(state, random.choice(descriptors))
 
-    @staticmethod
-    def _backpropagate(search_path: [MCTSVertex], value: Reward):
+    def _evaluate_batch(self, search_paths: [[MCTSVertex]]) -> [Reward]:
+        """
+        Estimates the values of several leaf vertices, see `_evaluate`. Subclasses can override this to share work
+        between the leaves of a batch.
+        """
+        return [self._evaluate(search_path) for search_path in search_paths]
+
+    def _backpropagate(self, search_path: [MCTSVertex], value: Reward):
         """
         Backpropagation step of MCTS
         From Wikipedia (https://en.wikipedia.org/wiki/Monte_Carlo_tree_search):
         Backpropagation: Use the result of the playout to update information in the vertices on the search_path from C to R.
         """
-        for vertex in reversed(search_path):
-            vertex.update(value.scaled_reward)
+        if self.tree_store is not None:
+            self.tree_store.update([vertex.id for vertex in search_path], value.scaled_reward)
+        else:
+            for vertex in reversed(search_path):
+                vertex.update(value.scaled_reward)
+        with self._vertex_lock:
+            self.canonicalizer.touch(search_path)
+
+        if self.solver:
+            self._backpropagate_solved(search_path, value)
+
+    def _backpropagate_solved(self, search_path: [MCTSVertex], value: Reward) -> None:
+        """
+        Mark the leaf of the search path as solved if it's a terminal vertex, and then each of its ancestors on the
+        path whose children are now all solved. Other parents of a solved vertex are marked when they are next selected.
+        """
+        leaf = search_path[-1]
+        if not leaf.solved:
+            if leaf.children != [] or leaf in self._pending_successors:
+                return
+            leaf.solved_value = value.raw_reward
+
+        for vertex in reversed(search_path[:-1]):
+            if not self._solve(vertex):
+                return
+
+    def _solve(self, vertex: MCTSVertex) -> bool:
+        """
+        Mark the vertex as solved if all of its children are, and none of its successors are pending, with the best
+        of their values. Reward scaling is monotonic, so the best raw reward is also the best scaled one.
+
+        :return: whether the vertex is solved
+        """
+        if vertex.solved:
+            return True
+        children = vertex.children
+        if not children:
+            return False
+        if vertex in self._pending_successors:
+            return False
+        child_values = [child.solved_value for child in children]
+        if any(child_value is None for child_value in child_values):
+            return False
+        vertex.solved_value = max(child_values)
+        return True
 
     @staticmethod
     def visit_selection(parent: MCTSVertex) -> MCTSVertex:
@@ -203,9 +613,34 @@ class MCTS(GraphSearch[MCTSVertex]):
         visit_softmax = np.exp(visit_counts) / sum(np.exp(visit_counts))
         return children[np.random.choice(range(len(children)), size=1, p=visit_softmax)[0]]
 
+    def _reset_statistics(self, roots: [MCTSVertex]) -> None:
+        """
+        Clears the statistics of every vertex reachable from the given roots, keeping the structure of the graph.
+        Vertices with no visits are treated as leaves by `_select`, so they are evaluated again when next reached.
+        """
+        if self.tree_store is not None:
+            self.tree_store.clear_statistics()
+            return
+
+        seen = set()
+        stack = list(roots)
+        while stack:
+            vertex = stack.pop()
+            if vertex in seen:
+                continue
+            seen.add(vertex)
+            vertex.reset_statistics()
+            if vertex.children:
+                stack.extend(vertex.children)
+
     def _get_root(self) -> MCTSVertex:
         return self.get_vertex_for_state(self.problem.get_initial_state())
 
+    def _make_new_vertex(self, state: GraphSearchState) -> MCTSVertex:
+        if self.tree_store is not None:
+            return self.tree_store.vertex(self.tree_store.add_vertex(state))
+        return self._vertex_class(state)
+
     def _ucb_score(self, parent: MCTSVertex, child: MCTSVertex) -> float:
         """Calculates the UCB1 score for the given child vertex. From Auer, P., Cesa-Bianchi, N., & Fischer, P. (2002).
            Machine Learning, 47(2/3), 235–256. doi:10.1023/a:1013689704352
@@ -218,3 +653,25 @@ class MCTS(GraphSearch[MCTSVertex]):
         if child.visit_count == 0:
             return math.inf
         return child.value + self.ucb_constant * math.sqrt(math.log(parent.visit_count) / child.visit_count)
+
+    def _ucb_scores(self,
+                    parent_visits: int,
+                    visit_counts: np.ndarray,
+                    value_sums: np.ndarray,
+                    priors: Optional[np.ndarray] = None) -> np.ndarray:
+        """Vectorized version of _ucb_score, scoring all children of a vertex at once. Unvisited children score inf,
+        and np.argmax over the result picks the first of any tied children, as max() does with _ucb_score.
+
+        :param parent_visits: visit count of the parent vertex
+        :param visit_counts: visit counts of each child
+        :param value_sums: value sums of each child
+        :param priors: unused by UCB1
+        :return: UCB1 scores for each child.
+        """
+        if parent_visits == 0:
+            raise RuntimeError("Children of {} scored for a parent with zero visits".format(self))
+        unvisited = visit_counts == 0
+        visit_counts = np.where(unvisited, 1, visit_counts)
+        scores = value_sums / visit_counts + self.ucb_constant * np.sqrt(math.log(parent_visits) / visit_counts)
+        scores[unvisited] = math.inf
+        return scores
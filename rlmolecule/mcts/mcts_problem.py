@@ -1,5 +1,6 @@
 import uuid
 from abc import ABC, abstractmethod
+from typing import List, Optional, Tuple
 
 from rlmolecule.mcts.mcts_vertex import MCTSVertex
 from rlmolecule.tree_search.graph_search_state import GraphSearchState
@@ -16,6 +17,13 @@ class MCTSProblem(ABC):
     def id(self):
         return self.__id
 
+    @property
+    def checkpoint(self) -> Optional[str]:
+        """ An identifier for the model used to evaluate states (e.g., the loaded policy checkpoint). Search
+        statistics kept across games are discarded whenever this changes.
+        """
+        return None
+
     @abstractmethod
     def get_initial_state(self) -> GraphSearchState:
         pass
@@ -29,6 +37,12 @@ class MCTSProblem(ABC):
         """
         pass
 
+    def get_rewards(self, states: List[GraphSearchState]) -> List[Tuple[float, dict]]:
+        """Calculates the rewards of several states, see get_reward. Problems whose rewards are cheaper to compute
+        together can override this.
+        """
+        return [self.get_reward(state) for state in states]
+
     def initialize_run(self) -> None:
         """ Any per-game initialization, i.e., loading policy weights, should be done here. This is called once
         before conducting the MCTS search every time AlphaZero.run() is called.
@@ -40,3 +54,6 @@ class MCTSProblem(ABC):
     def reward_wrapper(self, vertex: MCTSVertex) -> Reward:
         reward, _ = self.get_reward(vertex.state)
         return self.reward_class(raw_reward=reward)
+
+    def reward_wrappers(self, vertices: List[MCTSVertex]) -> List[Reward]:
+        return [self.reward_wrapper(vertex) for vertex in vertices]
@@ -7,11 +7,17 @@ logger = logging.getLogger(__name__)
 
 
 class MCTSVertex:
+    # vertices are created for every state of the search graph, so they don't carry a __dict__. __weakref__ is kept
+    # for the CycleChecker
+    __slots__ = ('state', 'visit_count', 'value_sum', 'children', 'solved_value', '__weakref__')
+
     def __init__(self, state: GraphSearchState) -> None:
         self.state: GraphSearchState = state
         self.visit_count: int = 0
         self.value_sum: float = 0.0
         self.children: Optional[List['MCTSVertex']] = None
+        # the exact value of the vertex, once every terminal vertex below it was scored (see MCTS's solver option)
+        self.solved_value: Optional[float] = None
 
     def __eq__(self, other: any) -> bool:
         """
@@ -39,9 +45,21 @@ class MCTSVertex:
     def expanded(self) -> bool:
         return self.children is not None
 
+    @property
+    def solved(self) -> bool:
+        return self.solved_value is not None
+
     def update(self, reward: float) -> None:
         """
         Updates this vertex with a visit and a reward
         """
         self.visit_count += 1
         self.value_sum += reward
+
+    def reset_statistics(self) -> None:
+        """
+        Clears the visits and rewards of this vertex, keeping its children (and its solved value, which doesn't
+        depend on the search statistics)
+        """
+        self.visit_count = 0
+        self.value_sum = 0.0
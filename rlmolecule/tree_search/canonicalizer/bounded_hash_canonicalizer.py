@@ -0,0 +1,197 @@
+import logging
+import sys
+from collections import Counter, OrderedDict
+from typing import Callable, Collection, Optional, Sequence, TypeVar
+
+from rlmolecule.tree_search.canonicalizer.hash_canonicalizer import HashCanonicalizer
+from rlmolecule.tree_search.graph_search_state import GraphSearchState
+
+logger = logging.getLogger(__name__)
+
+Vertex = TypeVar('Vertex')
+
+
+def approximate_vertex_size(vertex: any) -> int:
+    """ A rough estimate of the memory held by a vertex and its state, in bytes """
+    size = 0
+    for obj in (vertex, vertex.state):
+        size += sys.getsizeof(obj)
+        if hasattr(obj, '__dict__'):
+            size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+class BoundedHashCanonicalizer(HashCanonicalizer[Vertex]):
+    """
+    A HashCanonicalizer that keeps the search graph within a budget on the number of vertices and/or their
+    (approximate) size in bytes.
+
+    When the search advances to a new root, vertices that can no longer be reached from it are dropped. When the graph
+    is over budget, the least recently used expanded vertices whose children are all unvisited leaves are collapsed
+    back into leaves, and their children are dropped. Vertices are used when they are looked up, and when a search
+    path through them is backpropagated (see `touch`). Children shared with another parent (through transpositions)
+    are kept, and vertices whose children are all shared aren't collapsed. Unvisited vertices no parent holds (such as
+    the terminal states of rollouts) are dropped as well. Collapsed vertices keep their own statistics, and are expanded
+    (and evaluated) again if they are selected later.
+
+    The number of parents of each vertex is kept up to date as children are added (see `add_edges`) and dropped, so
+    that trimming doesn't scan the whole graph. Dropped vertices are passed to the release callback (see
+    `set_release_callback`), with which MCTS frees their pending successors and, with an ArrayTree, their rows and ids.
+    """
+
+    def __init__(self,
+                 max_vertices: Optional[int] = None,
+                 max_bytes: Optional[int] = None,
+                 vertex_size: Callable[[Vertex], int] = approximate_vertex_size,
+                 low_water: float = 0.9):
+        """
+        :param max_vertices: the maximum number of vertices to keep
+        :param max_bytes: the maximum (approximate) size of the kept vertices, measured with `vertex_size`
+        :param vertex_size: function returning the size of a vertex in bytes, called once when a vertex is added
+        :param low_water: eviction continues until the graph is within this fraction of its budget, so that evictions
+            happen in batches rather than on every new vertex
+        """
+        super().__init__()
+        self.max_vertices: Optional[int] = max_vertices
+        self.max_bytes: Optional[int] = max_bytes
+        self._vertex_size: Callable[[Vertex], int] = vertex_size
+        self.low_water: float = low_water
+        self.reset()
+
+    def reset(self) -> None:
+        self._vertex_map: OrderedDict = OrderedDict()
+        self._sizes: {GraphSearchState: int} = {}
+        self._num_parents: Counter = Counter()
+        self.nbytes: int = 0
+        self._root: Optional[Vertex] = None
+        self._next_eviction: int = 0
+
+    def __len__(self) -> int:
+        return len(self._vertex_map)
+
+    def get_canonical_vertex(self, state: GraphSearchState) -> Optional[Vertex]:
+        vertex = self._vertex_map.get(state)
+        if vertex is None:
+            return None
+        self._vertex_map.move_to_end(state)
+        return self._get_vertex(vertex)
+
+    def canonicalize_vertex(self, vertex: Vertex) -> Vertex:
+        state = vertex.state
+        existing = self.get_canonical_vertex(state)
+        if existing is not None:
+            return existing
+
+        self._vertex_map[state] = vertex if self._vertex_for_id is None else vertex.id
+        if self.max_bytes is not None:
+            size = self._vertex_size(vertex)
+            self._sizes[state] = size
+            self.nbytes += size
+        return vertex
+
+    def advance_root(self, root: Vertex) -> None:
+        """
+        Drop every vertex that is not reachable from the new root
+        """
+        self._root = root
+        reachable = set()
+        stack = [root]
+        while stack:
+            vertex = stack.pop()
+            if vertex.state in reachable:
+                continue
+            reachable.add(vertex.state)
+            if vertex.children:
+                stack.extend(vertex.children)
+
+        unreachable = [state for state in self._vertex_map if state not in reachable]
+        for state in unreachable:
+            self._remove(state)
+        self._next_eviction = 0
+
+        logger.debug(f"Dropped {len(unreachable)} vertices unreachable from {root}, {len(self)} remaining")
+
+    def add_edges(self, parent: Vertex, children: Sequence[Vertex]) -> None:
+        self._num_parents.update(child.state for child in children)
+
+    def remove_edges(self, parent: Vertex, children: Sequence[Vertex]) -> None:
+        # children left without a parent are dropped by the next trim, unless they have been visited
+        for child in children:
+            self._remove_parent(child.state)
+
+    def touch(self, vertices: Sequence[Vertex]) -> None:
+        vertex_map = self._vertex_map
+        for vertex in vertices:
+            try:
+                vertex_map.move_to_end(vertex.state)
+            except KeyError:
+                pass
+
+    def trim(self, in_use: Collection[Vertex] = ()) -> None:
+        if not self._over_budget() or len(self._vertex_map) < self._next_eviction:
+            return
+
+        # a child is only dropped once none of its parents in the graph still hold it
+        num_parents = self._num_parents
+        in_use = {vertex.state for vertex in in_use}
+        if self._root is not None:
+            in_use.add(self._root.state)
+        num_evicted = 0
+        for state, vertex in list(self._vertex_map.items()):  # least recently used first
+            if not self._over_budget(self.low_water):
+                break
+            if state not in self._vertex_map or state in in_use:
+                continue
+            vertex = self._get_vertex(vertex)
+            children = vertex.children
+            if not children and vertex.visit_count == 0 and num_parents[state] == 0:
+                # e.g., the terminal states of rollouts, which aren't held by any parent
+                self._remove(state)
+                num_evicted += 1
+                continue
+            if not children or any(child.children is not None or child.visit_count > 0 or child.state in in_use
+                                   for child in children):
+                continue
+            if all(num_parents[child.state] > 1 for child in children):
+                # collapsing this vertex wouldn't free anything
+                continue
+
+            vertex.children = None
+            for child in children:
+                if self._remove_parent(child.state) == 0:
+                    self._remove(child.state)
+                    num_evicted += 1
+
+        if self._over_budget():
+            # Everything left is either visited, expanded or shared; wait for the graph to grow before scanning it again.
+            self._next_eviction = int(len(self._vertex_map) * (2. - self.low_water))
+            logger.warning(f"Unable to bring the search graph within budget, {len(self)} vertices remaining")
+
+        logger.debug(f"Evicted {num_evicted} vertices, {len(self)} remaining")
+
+    def _get_vertex(self, vertex: any) -> Vertex:
+        return vertex if self._vertex_for_id is None else self._vertex_for_id(vertex)
+
+    def _over_budget(self, fraction: float = 1.) -> bool:
+        return (self.max_vertices is not None and len(self._vertex_map) > fraction * self.max_vertices) or \
+               (self.max_bytes is not None and self.nbytes > fraction * self.max_bytes)
+
+    def _remove_parent(self, state: GraphSearchState) -> int:
+        """ Decrement the number of parents of the given state, and return the number left """
+        num_parents = self._num_parents.get(state, 0) - 1
+        if num_parents > 0:
+            self._num_parents[state] = num_parents
+        else:
+            self._num_parents.pop(state, None)
+        return max(num_parents, 0)
+
+    def _remove(self, state: GraphSearchState) -> None:
+        vertex = self._vertex_map.pop(state, None)
+        if vertex is None:
+            return
+        self.nbytes -= self._sizes.pop(state, 0)
+        vertex = self._get_vertex(vertex)
+        for child in vertex.children or ():
+            self._remove_parent(child.state)
+        if self._release is not None:
+            self._release(vertex)
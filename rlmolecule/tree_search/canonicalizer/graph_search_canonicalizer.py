@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Generic, Optional, TypeVar
+from typing import Callable, Collection, Generic, Optional, Sequence, TypeVar
 
 from rlmolecule.tree_search.graph_search_state import GraphSearchState
 
@@ -7,6 +7,26 @@ Vertex = TypeVar('Vertex')
 
 
 class GraphSearchCanonicalizer(Generic[Vertex], ABC):
+    # returns the vertex for a stored vertex id, see use_vertex_ids
+    _vertex_for_id: Optional[Callable[[int], Vertex]] = None
+    # called with each vertex that is dropped, see set_release_callback
+    _release: Optional[Callable[[Vertex], None]] = None
+
+    def use_vertex_ids(self, vertex_for_id: Callable[[int], Vertex]) -> None:
+        """
+        Keep the integer ids of vertices (vertex.id) rather than the vertices themselves, for vertices that are handles
+        into a store such as the ArrayTree. Vertices are then created from their ids by `vertex_for_id` whenever they
+        are returned.
+        """
+        self._vertex_for_id = vertex_for_id
+
+    def set_release_callback(self, release: Callable[[Vertex], None]) -> None:
+        """
+        Call `release` with each vertex the canonicalizer drops from the search graph, so that the search can free
+        whatever else it keeps for that vertex.
+        """
+        self._release = release
+
     @abstractmethod
     def get_canonical_vertex(self, state: GraphSearchState) -> Optional[Vertex]:
         pass
@@ -18,3 +38,39 @@ class GraphSearchCanonicalizer(Generic[Vertex], ABC):
     @abstractmethod
     def reset(self) -> None:
         pass
+
+    def advance_root(self, root: Vertex) -> None:
+        """
+        Called when the search commits to the given vertex. Canonicalizers may free vertices that can no longer be
+        reached from it.
+        """
+        pass
+
+    def add_edges(self, parent: Vertex, children: Sequence[Vertex]) -> None:
+        """
+        Called when children are added to a vertex, e.g., so that canonicalizers can keep track of the number of parents
+        of each vertex.
+        """
+        pass
+
+    def remove_edges(self, parent: Vertex, children: Sequence[Vertex]) -> None:
+        """
+        Called when children are removed from a vertex by the search, see `add_edges`.
+        """
+        pass
+
+    def touch(self, vertices: Sequence[Vertex]) -> None:
+        """
+        Called with the vertices of each search path as it's backpropagated, from the root to the leaf.
+        Canonicalizers may use this to keep track of the vertices the search is using.
+        """
+        pass
+
+    def trim(self, in_use: Collection[Vertex] = ()) -> None:
+        """
+        Called between search iterations, when no vertex is being expanded. Canonicalizers may free vertices here in
+        order to stay within a memory budget.
+
+        :param in_use: vertices that must not be modified, e.g., those on the paths of pending evaluations
+        """
+        pass
@@ -11,14 +11,18 @@ class HashCanonicalizer(GraphSearchCanonicalizer[Vertex]):
         self._vertex_map: {GraphSearchState: Vertex} = {}
 
     def get_canonical_vertex(self, state: GraphSearchState) -> Optional[Vertex]:
-        return self._vertex_map[state] if state in self._vertex_map else None
+        vertex = self._vertex_map.get(state)
+        if vertex is None or self._vertex_for_id is None:
+            return vertex
+        return self._vertex_for_id(vertex)
 
     def canonicalize_vertex(self, vertex: Vertex) -> Vertex:
         state = vertex.state
-        vertex_map = self._vertex_map
-        if state not in vertex_map:
-            vertex_map[state] = vertex
-        return vertex_map[state]
+        existing = self.get_canonical_vertex(state)
+        if existing is not None:
+            return existing
+        self._vertex_map[state] = vertex if self._vertex_for_id is None else vertex.id
+        return vertex
 
     def reset(self) -> None:
         self._vertex_map = {}
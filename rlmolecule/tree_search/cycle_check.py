@@ -0,0 +1,57 @@
+from typing import Sequence
+from weakref import WeakKeyDictionary
+
+from rlmolecule.tree_search.dfs import GraphCycleError
+
+
+class CycleChecker:
+    """
+    Incrementally checks that the search graph stays acyclic as vertices are expanded. Each vertex is given a level,
+    such that every edge leads from a lower level to a higher one. New edges that respect this order can't close a
+    cycle, so only edges that violate it trigger a search; that search only visits the descendants whose levels need
+    to be raised, and raises GraphCycleError if it reaches the parent of the new edge.
+
+    Levels are kept in a WeakKeyDictionary, so that vertices dropped from the search graph are freed as usual.
+    """
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self._levels: WeakKeyDictionary = WeakKeyDictionary()
+
+    def remove(self, vertex: 'MCTSVertex') -> None:
+        """ Forget a vertex that was dropped from the search graph """
+        self._levels.pop(vertex, None)
+
+    def add_edges(self, parent: 'MCTSVertex', children: Sequence['MCTSVertex']) -> None:
+        """ Record the edges from parent to each of its children.
+
+        :param parent: The vertex that was just expanded
+        :param children: The children of the parent vertex
+        :raises GraphCycleError: If one of the new edges closes a cycle in the search graph
+        """
+        levels = self._levels
+        parent_level = levels.get(parent)
+        if parent_level is None:
+            parent_level = levels[parent] = 0
+
+        stack = []
+        for child in children:
+            if levels.get(child, -1) <= parent_level:
+                if child == parent:
+                    raise GraphCycleError(parent)
+                levels[child] = parent_level + 1
+                if child.children:
+                    stack.append(child)
+
+        while stack:
+            vertex = stack.pop()
+            level = levels[vertex] + 1
+            for child in vertex.children:
+                if levels.get(child, -1) < level:
+                    if child == parent:
+                        raise GraphCycleError(parent)
+                    levels[child] = level
+                    if child.children:
+                        stack.append(child)
@@ -1,3 +1,4 @@
+import threading
 from abc import ABC
 from typing import Generic, Optional, Type, TypeVar
 
@@ -13,17 +14,20 @@ class GraphSearch(Generic[Vertex], ABC):
         self._canonicalizer: GraphSearchCanonicalizer[Vertex] = \
             HashCanonicalizer() if canonicalizer is None else canonicalizer
         self._vertex_class = vertex_class
+        # guards vertex creation, which may happen from several threads when evaluations run in parallel
+        self._vertex_lock = threading.RLock()
 
     @property
     def canonicalizer(self) -> GraphSearchCanonicalizer:
         return self._canonicalizer
 
     def get_vertex_for_state(self, state: GraphSearchState) -> Vertex:
-        vertex = self._canonicalizer.get_canonical_vertex(state)
-        if vertex is None:
-            vertex = self._make_new_vertex(state)
-            vertex = self._canonicalizer.canonicalize_vertex(vertex)
-        return vertex
+        with self._vertex_lock:
+            vertex = self._canonicalizer.get_canonical_vertex(state)
+            if vertex is None:
+                vertex = self._make_new_vertex(state)
+                vertex = self._canonicalizer.canonicalize_vertex(vertex)
+            return vertex
 
     # noinspection PyMethodMayBeStatic
     def _make_new_vertex(self, state: GraphSearchState) -> Vertex:
@@ -4,17 +4,58 @@ from abc import (
     ABC,
     abstractmethod,
 )
+from functools import wraps
 from typing import (
+    Callable,
     Sequence,
     # final
 )
 
+from rlmolecule.tree_search.metrics import call_metrics
+
+
+def memoize_hash(hash_function: Callable[['GraphSearchState'], int]) -> Callable[['GraphSearchState'], int]:
+    """Wraps a state's hash method so that the hash is only computed once per state. The number of computed hashes
+    and of cache hits are counted in call_metrics.execution_count, under 'hash' and 'hash_cache_hits'.
+
+    :param hash_function: The hash method to be wrapped
+    :return: Wrapped hash method that caches its result on the state.
+    """
+
+    @wraps(hash_function)
+    def hash(self) -> int:
+        try:
+            value = self._cached_hash
+        except AttributeError:
+            value = hash_function(self)
+            self._cached_hash = value
+            call_metrics.execution_count['hash'] += 1
+            return value
+
+        call_metrics.execution_count['hash_cache_hits'] += 1
+        return value
+
+    hash.memoized = True
+    return hash
+
 
 class GraphSearchState(ABC):
     """
     Simply defines a directed graph structure which is incrementally navigated via the get_successors() method.
+
+    States are treated as immutable once created: the value returned by a subclass's hash() method is computed once per
+    state and cached. Subclasses whose identity can change after construction should set `cache_hash = False`.
     """
 
+    __slots__ = ('_cached_hash',)
+    cache_hash: bool = True
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        hash_function = cls.__dict__.get('hash')
+        if cls.cache_hash and hash_function is not None and not getattr(hash_function, 'memoized', False):
+            cls.hash = memoize_hash(hash_function)
+
     @abstractmethod
     def equals(self, other: 'GraphSearchState') -> bool:
         """
@@ -64,6 +105,47 @@ class GraphSearchState(ABC):
         """
         pass
 
+    def get_next_action_descriptors(self, *args) -> Sequence[any]:
+        """
+        Lightweight, hashable descriptors of the next possible states, which can be turned into states with
+        materialize_action(). This lets a search hold on to many successors without building them. Descriptors must be
+        distinct for distinct states. Defaults to the successor states themselves.
+
+        :return: a descriptor for each of the state's successors.
+        """
+        return self.get_next_actions(*args)
+
+    def materialize_action(self, descriptor: any, *args) -> 'GraphSearchState':
+        """
+        Build the successor state described by the given descriptor, see get_next_action_descriptors().
+
+        :param descriptor: one of the descriptors returned by get_next_action_descriptors()
+        :return: the successor state
+        """
+        return descriptor
+
+    def __getstate__(self):
+        """ The cached hash isn't pickled, since hashes can differ between processes (e.g., for str hashes) """
+        slots = {}
+        for cls in type(self).__mro__:
+            cls_slots = cls.__dict__.get('__slots__', ())
+            for name in ((cls_slots,) if isinstance(cls_slots, str) else cls_slots):
+                if name not in ('_cached_hash', '__dict__', '__weakref__') and hasattr(self, name):
+                    slots[name] = getattr(self, name)
+
+        state = getattr(self, '__dict__', None)
+        return (state, slots) if slots else state
+
+    def __setstate__(self, state) -> None:
+        state, slots = state if isinstance(state, tuple) else (state, {})
+        if state and not hasattr(self, '__dict__'):
+            # states pickled before their class was given __slots__
+            slots = {**state, **slots}
+        elif state:
+            self.__dict__.update(state)
+        for name, value in slots.items():
+            object.__setattr__(self, name, value)
+
     # @final
     def __eq__(self, other: any) -> bool:
         return isinstance(other, GraphSearchState) and self.equals(other)
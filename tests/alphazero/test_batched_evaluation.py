@@ -0,0 +1,45 @@
+import pytest
+
+from rlmolecule.alphazero.alphazero import AlphaZero
+from rlmolecule.tree_search.reward import LinearBoundedRewardFactory
+from tests.chain_problem import ChainAlphaZeroProblem
+
+
+class BatchCountingProblem(ChainAlphaZeroProblem):
+    def __init__(self, **kwargs):
+        super(BatchCountingProblem, self).__init__(**kwargs)
+        self.batch_sizes = []
+
+    def get_values_and_policies(self, parents):
+        self.batch_sizes += [len(parents)]
+        return super(BatchCountingProblem, self).get_values_and_policies(parents)
+
+
+def test_leaf_batches(engine, tree_store):
+    problem = BatchCountingProblem(reward_class=LinearBoundedRewardFactory(), engine=engine, width=4, max_depth=10)
+    game = AlphaZero(problem, leaf_batch_size=4, tree_store=tree_store)
+    root = game._get_root()
+
+    game.sample(root, 1)
+    assert problem.batch_sizes == [1]
+
+    game.sample(root, 8)
+    assert root.visit_count == 9
+    assert problem.batch_sizes[1:] == [4, 4]
+    assert sum(child.visit_count for child in root.children) == 8
+    assert sum(root.child_priors.values()) == pytest.approx(1.)
+
+
+def test_batched_matches_sequential(engine):
+    """ A batch of one leaf should behave exactly as the sequential evaluation """
+    problem = ChainAlphaZeroProblem(reward_class=LinearBoundedRewardFactory(), engine=engine)
+    game = AlphaZero(problem, dirichlet_noise=False)
+    root = game._get_root()
+    game.sample(root, 10)
+
+    batched_problem = ChainAlphaZeroProblem(reward_class=LinearBoundedRewardFactory(), engine=engine)
+    batched_game = AlphaZero(batched_problem, dirichlet_noise=False)
+    batched_root = batched_game._get_root()
+    batched_game.sample(batched_root, 10, num_parallel=1)
+
+    assert [child.visit_count for child in root.children] == [child.visit_count for child in batched_root.children]
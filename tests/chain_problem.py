@@ -0,0 +1,58 @@
+from typing import Sequence
+
+import numpy as np
+
+from rlmolecule.alphazero.alphazero_problem import AlphaZeroProblem
+from rlmolecule.alphazero.alphazero_vertex import AlphaZeroVertex
+from rlmolecule.mcts.mcts_problem import MCTSProblem
+from rlmolecule.tree_search.graph_search_state import GraphSearchState
+
+
+class ChainState(GraphSearchState):
+    """A small layered DAG: each state at a given depth has `width` successors, and states at `max_depth` are
+    terminal. Successors are keyed by (depth, position % width), so different parents share their children."""
+
+    def __init__(self, depth: int = 0, position: int = 0, width: int = 3, max_depth: int = 4):
+        self.depth = depth
+        self.position = position
+        self.width = width
+        self.max_depth = max_depth
+
+    def equals(self, other: 'ChainState') -> bool:
+        return (self.depth == other.depth) & (self.position == other.position)
+
+    def __repr__(self):
+        return f"ChainState(depth={self.depth}, position={self.position})"
+
+    def get_next_actions(self) -> Sequence['ChainState']:
+        if self.depth >= self.max_depth:
+            return []
+        return [ChainState(self.depth + 1, (self.position + i) % self.width, self.width, self.max_depth)
+                for i in range(self.width)]
+
+    def hash(self) -> int:
+        return hash((self.depth, self.position))
+
+
+class ChainProblem(MCTSProblem):
+    def __init__(self, width: int = 3, max_depth: int = 4, **kwargs):
+        super(ChainProblem, self).__init__(**kwargs)
+        self.width = width
+        self.max_depth = max_depth
+
+    def get_initial_state(self) -> ChainState:
+        return ChainState(0, 0, self.width, self.max_depth)
+
+    def get_reward(self, state: ChainState) -> (float, {}):
+        return state.position / max(self.width - 1, 1), {}
+
+
+class ChainAlphaZeroProblem(ChainProblem, AlphaZeroProblem):
+    def get_value_and_policy(self, parent: AlphaZeroVertex) -> (float, {AlphaZeroVertex: float}):
+        children = parent.children
+        priors = np.arange(1, len(children) + 1, dtype=float)
+        priors /= priors.sum()
+        return 0.5, {vertex: prior for vertex, prior in zip(children, priors)}
+
+    def get_policy_inputs(self, state: ChainState) -> {str: np.ndarray}:
+        return {'position': np.array([state.depth, state.position])}
@@ -1,5 +1,7 @@
 import tempfile
 import pytest
+
+from rlmolecule.mcts.array_tree import ArrayTree
 # noinspection PyUnresolvedReferences
 from .sql import engine
 
@@ -11,3 +13,12 @@ def tmpdirname():
     """
     with tempfile.TemporaryDirectory() as tmpdir:
         yield tmpdir
+
+
+@pytest.fixture(params=['vertices', 'array_tree'])
+def tree_store(request):
+    """
+    Runs a test with the search statistics kept on the vertices (None), and in a new ArrayTree. The tree starts small,
+    so that its arrays grow during the test.
+    """
+    return ArrayTree(initial_capacity=2) if request.param == 'array_tree' else None
@@ -0,0 +1,26 @@
+import networkx as nx
+
+
+def make_action_graphs() -> (nx.DiGraph, nx.DiGraph):
+    """A small pair of action graphs: G goes from element combinations to compositions, and G2 goes from composition
+    types to decorations of a prototype structure"""
+    G = nx.DiGraph([('root', ('F', 'Li')), ('root', ('Cl', 'Na')),
+                    (('F', 'Li'), 'Li1F1'), (('Cl', 'Na'), 'Na1Cl1'), (('Cl', 'Na'), 'Na1Cl2')])
+    G2 = nx.DiGraph([('_1_1', '_1_1|cubic'), ('_1_1|cubic', '_1_1|cubic|POSCAR_sg225_icsd_1'),
+                     ('_1_1|cubic|POSCAR_sg225_icsd_1', '_1_1|cubic|POSCAR_sg225_icsd_1|1'),
+                     ('_1_1|cubic|POSCAR_sg225_icsd_1', '_1_1|cubic|POSCAR_sg225_icsd_1|2'),
+                     ('_1_2', '_1_2|trigonal'), ('_1_2|trigonal', '_1_2|trigonal|POSCAR_sg164_icsd_2'),
+                     ('_1_2|trigonal|POSCAR_sg164_icsd_2', '_1_2|trigonal|POSCAR_sg164_icsd_2|1')])
+    return G, G2
+
+
+def enumerate_states(builder, root) -> list:
+    """ All states reachable from the root, in depth-first order """
+    states = []
+    stack = [root]
+    while stack:
+        state = stack.pop()
+        states.append(state)
+        if not state.terminal:
+            stack.extend(reversed(builder.find_next_states(state)))
+    return states
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from rlmolecule.crystal.action_graph import ActionGraph, load_action_graphs, save_action_graphs
+from rlmolecule.crystal.builder import CrystalBuilder, CSRCrystalBuilder
+from rlmolecule.crystal.crystal_state import CrystalState
+from tests.crystal.action_graphs import enumerate_states, make_action_graphs
+
+
+def test_action_graph():
+    G, _ = make_action_graphs()
+    graph = ActionGraph.from_networkx(G)
+    assert graph.number_of_nodes() == G.number_of_nodes()
+    assert graph.number_of_edges() == G.number_of_edges()
+    for node in G.nodes():
+        assert graph.has_node(node)
+        assert graph.out_degree(node) == G.out_degree(node)
+        assert list(graph.neighbors(node)) == list(G.neighbors(node))
+        assert sorted(graph.predecessors(node), key=str) == sorted(G.predecessors(node), key=str)
+        assert graph.terminal[graph.index(node)] == (G.out_degree(node) == 0)
+    assert not graph.has_node('missing')
+    assert graph.mask([('Cl', 'Na'), 'missing']).sum() == 1
+
+
+@pytest.mark.parametrize('actions_to_ignore', [
+    None,
+    {'Na1Cl2'},
+    {'_1_1|cubic|POSCAR_sg225_icsd_1|1', ('F', 'Li')},
+    {'Na1Cl1|_1_1|cubic|POSCAR_sg225_icsd_1|2'},
+    {'_1_2|trigonal|POSCAR_sg164_icsd_2|1'},
+])
+def test_csr_builder_matches(actions_to_ignore):
+    G, G2 = make_action_graphs()
+    builder = CrystalBuilder(G=G, G2=G2, actions_to_ignore=actions_to_ignore)
+    csr_builder = CSRCrystalBuilder(G=G, G2=G2, actions_to_ignore=actions_to_ignore)
+    assert isinstance(csr_builder.G, ActionGraph)
+
+    states = enumerate_states(builder, CrystalState('root'))
+    csr_states = enumerate_states(csr_builder, CrystalState('root'))
+    assert [repr(state) for state in states] == [repr(state) for state in csr_states]
+    assert [state.terminal for state in states] == [state.terminal for state in csr_states]
+    assert builder.actions_to_ignore == csr_builder.actions_to_ignore
+    assert builder.actions_to_ignore_G2 == csr_builder.actions_to_ignore_G2
+
+
+def test_csr_builder_updates_masks():
+    G, G2 = make_action_graphs()
+    builder = CSRCrystalBuilder(G=G, G2=G2)
+    state = CrystalState('_1_1|cubic|POSCAR_sg225_icsd_1', composition='Li1F1')
+    assert len(builder.find_next_states(state)) == 2
+
+    builder.states_to_ignore['Li1F1'].add('_1_1|cubic|POSCAR_sg225_icsd_1|1')
+    builder.remove_dead_ends()
+    next_states = builder.find_next_states(state)
+    assert [state.action_node for state in next_states] == ['_1_1|cubic|POSCAR_sg225_icsd_1|2']
+    assert next_states[0].terminal
+
+    # other compositions keep all of their decorations
+    state = CrystalState('_1_1|cubic|POSCAR_sg225_icsd_1', composition='Na1Cl1')
+    assert len(builder.find_next_states(state)) == 2
+
+
+@pytest.mark.parametrize('builder_class', [CrystalBuilder, CSRCrystalBuilder])
+def test_compiled_action_graphs(tmp_path, builder_class):
+    G, G2 = make_action_graphs()
+    save_action_graphs(str(tmp_path), G, G2)
+    loaded_G, loaded_G2 = load_action_graphs(str(tmp_path))
+    assert isinstance(loaded_G.offsets, np.memmap)
+    assert list(loaded_G.nodes()) == list(G.nodes())
+    assert loaded_G.index(('Cl', 'Na')) == list(G.nodes()).index(('Cl', 'Na'))
+    assert not loaded_G.has_node('Cl\tNa') and not loaded_G2.has_node('missing')
+    assert list(loaded_G2.neighbors('_1_1|cubic|POSCAR_sg225_icsd_1')) == \
+           list(G2.neighbors('_1_1|cubic|POSCAR_sg225_icsd_1'))
+
+    actions_to_ignore = {'Na1Cl1|_1_1|cubic|POSCAR_sg225_icsd_1|2', '_1_2|trigonal|POSCAR_sg164_icsd_2|1'}
+    builder = CrystalBuilder(G=G, G2=G2, actions_to_ignore=actions_to_ignore)
+    compiled_builder = builder_class(action_graphs_dir=str(tmp_path), actions_to_ignore=actions_to_ignore)
+    assert compiled_builder.comp_to_comp_type == builder.comp_to_comp_type
+
+    states = enumerate_states(builder, CrystalState('root'))
+    compiled_states = enumerate_states(compiled_builder, CrystalState('root'))
+    assert [repr(state) for state in states] == [repr(state) for state in compiled_states]
+    assert compiled_builder.actions_to_ignore == builder.actions_to_ignore
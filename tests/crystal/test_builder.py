@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from rlmolecule.crystal.builder import CrystalBuilder, CSRCrystalBuilder
+from rlmolecule.crystal.crystal_state import CrystalState
+from tests.crystal.action_graphs import enumerate_states, make_action_graphs
+
+
+@pytest.mark.parametrize('builder_class', [CrystalBuilder, CSRCrystalBuilder])
+def test_successor_cache(builder_class):
+    G, G2 = make_action_graphs()
+    builder = builder_class(G=G, G2=G2, successor_cache_size=2)
+    state = CrystalState('_1_1|cubic|POSCAR_sg225_icsd_1', composition='Li1F1')
+    next_states = builder.find_next_states(state)
+    assert len(next_states) == 2
+    cached_states = builder.find_next_states(CrystalState('_1_1|cubic|POSCAR_sg225_icsd_1', composition='Li1F1'))
+    assert all(a is b for a, b in zip(next_states, cached_states))
+
+    builder.find_next_states(CrystalState('root'))
+    builder.find_next_states(CrystalState(('Cl', 'Na')))
+    assert len(builder._successor_cache) == 2
+    assert state not in builder._successor_cache
+
+    builder.find_next_states(state)
+    builder.states_to_ignore['Li1F1'].add('_1_1|cubic|POSCAR_sg225_icsd_1|1')
+    builder.remove_dead_ends()
+    assert [child.action_node for child in builder.find_next_states(state)] == ['_1_1|cubic|POSCAR_sg225_icsd_1|2']
+
+
+def get_terminal_states(builder) -> set:
+    return {repr(state) for state in enumerate_states(builder, CrystalState('root')) if state.terminal}
+
+
+@pytest.mark.parametrize('builder_class', [CrystalBuilder, CSRCrystalBuilder])
+def test_ignore(builder_class):
+    G, G2 = make_action_graphs()
+    builder = builder_class(G=G, G2=G2)
+    all_terminal_states = get_terminal_states(builder)
+    assert len(all_terminal_states) == 5
+
+    builder.ignore('Li1F1|_1_1|cubic|POSCAR_sg225_icsd_1|1')
+    assert get_terminal_states(builder) == all_terminal_states - {'Li1F1|_1_1|cubic|POSCAR_sg225_icsd_1|1'}
+
+    # once all of its decorations are ignored, the composition is a dead-end, and so are its elements
+    builder.ignore(CrystalState('_1_1|cubic|POSCAR_sg225_icsd_1|2', composition='Li1F1', terminal=True))
+    assert 'Li1F1' in builder.actions_to_ignore
+    assert ('F', 'Li') in builder.actions_to_ignore
+    assert [s.action_node for s in builder.find_next_states(CrystalState('root'))] == [('Cl', 'Na')]
+    # the other composition with the same composition type is unaffected
+    assert 'Na1Cl1|_1_1|cubic|POSCAR_sg225_icsd_1|2' in get_terminal_states(builder)
+
+    builder.unignore('Li1F1|_1_1|cubic|POSCAR_sg225_icsd_1|1')
+    assert 'Li1F1' not in builder.actions_to_ignore
+    assert get_terminal_states(builder) == all_terminal_states - {'Li1F1|_1_1|cubic|POSCAR_sg225_icsd_1|2'}
+
+    builder.ignore('_1_2|trigonal|POSCAR_sg164_icsd_2|1')
+    assert 'Na1Cl2' in builder.actions_to_ignore
+    builder.ignore('_1_1|cubic|POSCAR_sg225_icsd_1')
+    assert get_terminal_states(builder) == set()
+    assert builder.find_next_states(CrystalState('root')) == []
+
+    builder.unignore('_1_1|cubic|POSCAR_sg225_icsd_1')
+    assert get_terminal_states(builder) == {'Li1F1|_1_1|cubic|POSCAR_sg225_icsd_1|1',
+                                            'Na1Cl1|_1_1|cubic|POSCAR_sg225_icsd_1|1',
+                                            'Na1Cl1|_1_1|cubic|POSCAR_sg225_icsd_1|2'}
+
+    with pytest.raises(ValueError):
+        builder.ignore('Li1F1|_1_2|unknown')
+
+
+@pytest.mark.parametrize('builder_class', [CrystalBuilder, CSRCrystalBuilder])
+def test_ignore_matches_remove_dead_ends(builder_class):
+    G, G2 = make_action_graphs()
+    builder = builder_class(G=G, G2=G2)
+    actions = ['Li1F1|_1_1|cubic|POSCAR_sg225_icsd_1|1', 'Na1Cl1|_1_1|cubic|POSCAR_sg225_icsd_1|2',
+               '_1_1|cubic|POSCAR_sg225_icsd_1|2', 'Na1Cl1|_1_1|cubic|POSCAR_sg225_icsd_1|1', ('Cl', 'Na'),
+               '_1_2|trigonal', 'Na1Cl2']
+    rng = np.random.default_rng(0)
+    ignored = set()
+    for _ in range(50):
+        action = actions[rng.integers(len(actions))]
+        if action in ignored:
+            builder.unignore(action)
+            ignored.remove(action)
+        else:
+            builder.ignore(action)
+            ignored.add(action)
+        reference = builder_class(G=G, G2=G2, actions_to_ignore=set(ignored))
+        if 'root' in builder.actions_to_ignore:
+            # remove_dead_ends keeps the children of the nodes it ignores, so they're still found below its root
+            assert 'root' in reference.actions_to_ignore or get_terminal_states(reference) == set()
+            continue
+        assert get_terminal_states(builder) == get_terminal_states(reference)
+        # no state left to explore is a dead-end
+        for state in enumerate_states(builder, CrystalState('root')):
+            assert state.terminal or len(builder.find_next_states(state)) > 0
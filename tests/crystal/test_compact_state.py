@@ -0,0 +1,55 @@
+import copy
+import pickle
+
+from rlmolecule.crystal.builder import CrystalBuilder
+from rlmolecule.crystal.crystal_state import CompactCrystalState, CrystalState
+from tests.crystal.action_graphs import enumerate_states, make_action_graphs
+
+
+def test_compact_states_match():
+    G, G2 = make_action_graphs()
+    states = enumerate_states(CrystalBuilder(G=G, G2=G2), CrystalState('root'))
+    compact_states = enumerate_states(CrystalBuilder(G=G, G2=G2, compact_states=True), CompactCrystalState('root'))
+    assert all(isinstance(state, CompactCrystalState) for state in compact_states)
+
+    assert [repr(state) for state in states] == [repr(state) for state in compact_states]
+    for state, compact_state in zip(states, compact_states):
+        assert state.hash() == compact_state.hash()
+        assert state.action_node == compact_state.action_node
+        assert state.composition == compact_state.composition
+        assert state.terminal == compact_state.terminal
+        assert state.get_crystal_sys() == compact_state.get_crystal_sys()
+        assert state.get_proto_strc() == compact_state.get_proto_strc()
+
+    assert len(set(compact_states)) == len(set(states)) == len(states)
+
+
+def test_compact_state_ids():
+    state = CompactCrystalState('_1_1|cubic|POSCAR_sg225_icsd_1|2', composition='Na1Cl1', terminal=True)
+    same = CompactCrystalState('_1_1|cubic|POSCAR_sg225_icsd_1|2', composition='Na1Cl1', terminal=True)
+    other = CompactCrystalState('_1_1|cubic|POSCAR_sg225_icsd_1|1', composition='Na1Cl1', terminal=True)
+
+    assert state == same and hash(state) == hash(same)
+    assert state != other
+    assert state.action_node_id == same.action_node_id != other.action_node_id
+    assert state.prototype_id == other.prototype_id
+    assert CompactCrystalState.strings[state.prototype_id] == 'POSCAR_sg225_icsd_1'
+    assert state != CrystalState('_1_1|cubic|POSCAR_sg225_icsd_1|2', composition='Na1Cl1', terminal=True)
+
+
+def test_compact_state_pickle():
+    state = CompactCrystalState(('Cl', 'Na'))
+    hash(state)
+    for copied in (pickle.loads(pickle.dumps(state)), copy.deepcopy(state), CrystalState.deserialize(state.serialize())):
+        assert copied == state
+        assert copied.action_node == ('Cl', 'Na')
+        assert copied.hash() == state.hash()
+
+
+def test_unpickle_unslotted_state():
+    state = CrystalState('_1_1|cubic', composition='Na1Cl1')
+    restored = CrystalState.__new__(CrystalState)
+    restored.__setstate__({'_action_node': '_1_1|cubic', '_composition': 'Na1Cl1', '_terminal': False,
+                           '_ele_replacements': None})
+    assert restored == state
+    assert restored.hash() == state.hash()
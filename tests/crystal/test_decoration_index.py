@@ -0,0 +1,67 @@
+import copy
+import pickle
+
+import pytest
+from pymatgen.core import Lattice, Structure
+
+from rlmolecule.crystal.builder import CrystalBuilder
+from rlmolecule.crystal.crystal_state import CrystalState
+from rlmolecule.crystal.decoration_index import DecorationIndex, PrototypeInfo
+from tests.crystal.action_graphs import enumerate_states, make_action_graphs
+
+
+@pytest.fixture
+def prototypes() -> dict:
+    rocksalt = Structure.from_spacegroup('Fm-3m', Lattice.cubic(5.6), ['Na', 'Cl'], [[0, 0, 0], [0.5, 0.5, 0.5]])
+    cdi2 = Structure(Lattice.hexagonal(4.2, 6.8), ['Cd', 'I', 'I'], [[0, 0, 0], [1 / 3, 2 / 3, 0.25], [2 / 3, 1 / 3, 0.75]])
+    return {'_1_1|cubic|POSCAR_sg225_icsd_1': rocksalt, '_1_2|trigonal|POSCAR_sg164_icsd_2': cdi2}
+
+
+def test_decoration_index(tmp_path):
+    index = DecorationIndex()
+    prototype_info = PrototypeInfo((1, 1, 2), ('Li', 'Sc', 'F'))
+    assert index.get_permutations('Na1Mg1Cl2', (1, 1, 2)) == [('Na', 'Mg', 'Cl'), ('Mg', 'Na', 'Cl')]
+    assert index.get_ele_replacements('Na1Mg1Cl2', prototype_info, 1) == {'Mg': 'Li', 'Na': 'Sc', 'Cl': 'F'}
+    with pytest.raises(AssertionError):
+        index.get_ele_replacements('Na1Mg1Cl2', prototype_info, 2)
+
+    index_file = str(tmp_path / 'decorations.json.gz')
+    index.save(index_file)
+    loaded = DecorationIndex()
+    loaded.load(index_file)
+    assert loaded.permutations == index.permutations
+
+
+def test_lazy_ele_replacements(prototypes):
+    G, G2 = make_action_graphs()
+    builder = CrystalBuilder(G=G, G2=G2, prototypes=prototypes)
+    terminal_states = [state for state in enumerate_states(builder, CrystalState('root')) if state.terminal]
+    assert len(terminal_states) == 5
+
+    for state in terminal_states:
+        assert isinstance(state._ele_replacements, PrototypeInfo)
+        # the state still pickles without computing the replacements
+        copied = pickle.loads(pickle.dumps(state))
+
+        eager_state = CrystalState(state.action_node, state.composition, terminal=True)
+        eager_state.set_proto_ele_replacements(prototypes['|'.join(state.action_node.split('|')[:-1])])
+        assert state.ele_replacements == copied.ele_replacements == eager_state.ele_replacements
+        assert isinstance(state._ele_replacements, dict)
+
+    state = CrystalState('_1_2|trigonal|POSCAR_sg164_icsd_2|1', 'Na1Cl2', terminal=True)
+    state.set_prototype_info(DecorationIndex.get_prototype_info(prototypes['_1_2|trigonal|POSCAR_sg164_icsd_2']))
+    assert state.ele_replacements == {'Na': 'Cd', 'Cl': 'I'}
+
+
+def test_decorate_prototype_structure(prototypes):
+    prototype = prototypes['_1_2|trigonal|POSCAR_sg164_icsd_2']
+    structure, stoich = CrystalState.decorate_prototype_structure(prototype, 'Mg1Cl2', decoration_idx=0)
+    assert stoich == 'Mg1Cl2'
+    assert structure.lattice is prototype.lattice
+    assert [site.specie.symbol for site in structure] == ['Mg', 'Cl', 'Cl']
+
+    expected = copy.deepcopy(prototype)
+    expected.replace_species({'Cd': 'Mg', 'I': 'Cl'})
+    assert structure == expected
+    # the prototype is unchanged
+    assert prototype.formula == 'Cd1 I2'
@@ -0,0 +1,138 @@
+import pickle
+
+import numpy as np
+import pytest
+from pymatgen.analysis.phase_diagram import PDEntry, PhaseDiagram
+from pymatgen.core import Composition
+
+from rlmolecule.crystal import ehull
+
+
+@pytest.fixture
+def competing_phases() -> list:
+    return ehull.fere_entries + [PDEntry('LiF', -9.5),
+                                 PDEntry('ScF3', -24.),
+                                 PDEntry('Li3ScF6', -58.),
+                                 PDEntry('LiCl', -7.2),
+                                 PDEntry('NaCl', -6.9)]
+
+
+@pytest.mark.parametrize('comp,predicted_energy', [('Li1Sc1F4', -4.9), ('Li1Sc1F4', -4.2),
+                                                   ('Li3Sc1F6', -58. / 10), ('Na1Li1Cl2', -3.6)])
+def test_convex_hull_stability_cached(competing_phases, comp, predicted_energy):
+    cache = ehull.PhaseDiagramCache(competing_phases)
+    expected = ehull.convex_hull_stability(Composition(comp), predicted_energy, competing_phases)
+    for _ in range(2):
+        decomp_energy, stability_window = ehull.convex_hull_stability(
+            Composition(comp), predicted_energy, competing_phases, phase_diagram_cache=cache)
+        assert decomp_energy == pytest.approx(expected[0])
+        assert stability_window == (pytest.approx(expected[1]) if expected[1] is not None else None)
+    assert cache.stats() == {'size': 1, 'hits': 1, 'misses': 1, 'hit_rate': .5}
+
+
+def test_phase_diagram_cache(competing_phases):
+    cache = ehull.PhaseDiagramCache(competing_phases, max_size=2)
+    phase_diagram = cache.get_phase_diagram(Composition('LiScF4').elements)
+    assert phase_diagram is cache.get_phase_diagram(Composition('Li3ScF6').elements)
+    assert set(phase_diagram.all_entries) == set(e for e in competing_phases
+                                                 if {str(el) for el in e.composition.elements} <= {'Li', 'Sc', 'F'})
+
+    cache.get_phase_diagram(Composition('LiCl').elements)
+    cache.get_phase_diagram(Composition('NaCl').elements)
+    assert len(cache) == 2
+    assert phase_diagram is not cache.get_phase_diagram(Composition('LiScF4').elements)
+    assert (cache.hits, cache.misses) == (1, 4)
+
+    copied = pickle.loads(pickle.dumps(cache))
+    assert len(copied) == 0 and copied.hits == 0
+    assert copied.max_size == 2
+
+
+def test_skips_matching_competing_phase(competing_phases):
+    """ A competing phase with the composition and energy of the scored structure isn't part of its hull """
+    cache = ehull.PhaseDiagramCache(competing_phases)
+    decomp_energy, _ = ehull.convex_hull_stability(Composition('Li3ScF6'), -58. / 10, competing_phases,
+                                                   phase_diagram_cache=cache)
+    assert decomp_energy < 0
+
+
+def test_competing_phase_index(competing_phases, tmp_path):
+    index = ehull.CompetingPhaseIndex(competing_phases)
+    assert len(index) == len(competing_phases)
+    assert set(index.entries_by_chemsys['F-Li-Sc']) == {PDEntry('Li3ScF6', -58.)}
+
+    for comp in ['LiScF4', 'NaLiCl2', 'Li', 'LiMgScFCl']:
+        elements = Composition(comp).elements
+        expected = [e for e in competing_phases if set(e.composition.elements) <= set(elements)]
+        assert sorted(map(str, index.get_entries(elements))) == sorted(map(str, expected))
+
+    index_file = str(tmp_path / 'competing_phases.json.gz')
+    index.save(index_file)
+    loaded = ehull.CompetingPhaseIndex()
+    loaded.load(index_file)
+    assert dict(loaded.entries_by_chemsys) == dict(index.entries_by_chemsys)
+
+    decomp_energy, _ = ehull.convex_hull_stability(Composition('LiScF4'), -4.9, competing_phases)
+    assert ehull.convex_hull_stability(Composition('LiScF4'), -4.9, loaded)[0] == pytest.approx(decomp_energy)
+
+
+def test_chemsys_hull(competing_phases):
+    cache = ehull.PhaseDiagramCache(competing_phases)
+    hull = cache.get_hull(Composition('LiScF4').elements)
+    compositions = [Composition(comp) for comp in ['LiScF4', 'Li3ScF6', 'LiF', 'Sc', 'Li2ScF5']]
+    energies = [-6., -5.6, -4.1, -4.5, -5.]
+    expected = [hull.phase_diagram.get_decomp_and_e_above_hull(PDEntry(comp, energy * comp.num_atoms),
+                                                               allow_negative=True, check_stable=False)[1]
+                for comp, energy in zip(compositions, energies)]
+    e_above_hull = hull.get_e_above_hull(compositions, energies, allow_negative=True)
+    assert e_above_hull == pytest.approx(expected)
+    assert any(e < 0 for e in expected) and any(e > 0 for e in expected)
+
+    e_above_hull = hull.get_e_above_hull(compositions, energies)
+    assert [e for e, e_neg in zip(e_above_hull, expected) if e_neg >= 0] == pytest.approx(
+        [e for e in expected if e >= 0])
+    assert np.isnan([e for e, e_neg in zip(e_above_hull, expected) if e_neg < 0]).all()
+
+    with pytest.raises(ValueError):
+        hull.get_fractions([Composition('NaCl')])
+
+
+@pytest.mark.parametrize('offset', [1e-8, 1e-10, -1e-12])
+def test_chemsys_hull_degenerate_facets(offset):
+    """ A phase slightly off the LiF-ScF3 edge of the hull, with an energy on that edge, makes a sliver facet whose
+    vertices are nearly collinear """
+    comp = Composition({'Li': 1, 'Sc': 1, 'F': 4 + offset})
+    entries = [e for e in ehull.fere_entries if e.composition.reduced_formula in ('Li', 'Sc', 'F2')] + \
+              [PDEntry('LiF', -9.5), PDEntry('ScF3', -24.), PDEntry(comp, (-9.5 - 24.) / 6 * comp.num_atoms)]
+    hull = ehull.ChemsysHull(PhaseDiagram(entries))
+    assert len(hull.slopes) < len(hull.phase_diagram.facets)
+
+    compositions = [Composition(comp) for comp in ['LiScF4', 'Li3ScF6', 'LiSc2F7', 'Li2ScF4', 'LiScF5', 'Li5ScF3']]
+    energies = [-5.0, -5.0, -5.2, -4.0, -4.5, -3.5]
+    expected = [hull.phase_diagram.get_decomp_and_e_above_hull(PDEntry(comp, energy * comp.num_atoms),
+                                                               allow_negative=True, check_stable=False)[1]
+                for comp, energy in zip(compositions, energies)]
+    assert hull.get_e_above_hull(compositions, energies, allow_negative=True) == pytest.approx(expected, abs=1e-9)
+
+
+def test_convex_hull_stabilities(competing_phases):
+    rng = np.random.default_rng(0)
+    compositions = [Composition(comp) for comp in ['Li1Sc1F4', 'Li3Sc1F6', 'Li2Sc1F5', 'Na1Li1Cl2', 'Li1Cl1',
+                                                   'Li1Mg1Sc1F6', 'Na1Sc1F4']] * 4
+    predicted_energies = list(rng.uniform(-6, -3, len(compositions)))
+    # matches one of the competing phases exactly
+    compositions.append(Composition('Li3Sc1F6'))
+    predicted_energies.append(-58. / 10)
+
+    cache = ehull.PhaseDiagramCache(competing_phases)
+    results = ehull.convex_hull_stabilities(compositions, predicted_energies, competing_phases,
+                                            phase_diagram_cache=cache)
+    assert len(cache) == 5
+    for comp, predicted_energy, (decomp_energy, stability_window) in zip(compositions, predicted_energies, results):
+        expected_energy, expected_window = ehull.convex_hull_stability(comp, predicted_energy, competing_phases)
+        assert decomp_energy == pytest.approx(expected_energy, abs=1e-8)
+        if expected_window is None:
+            assert stability_window is None
+        else:
+            assert stability_window == pytest.approx(expected_window)
+    assert any(window is not None for _, window in results)
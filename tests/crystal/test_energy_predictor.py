@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from rlmolecule.crystal.energy_predictor import EnergyPredictor, bucket_size, pad_inputs
+
+sizes = [3, 6, 1, 12]
+list_of_inputs = [{'site': np.arange(size, dtype=np.float32), 'distance': np.ones(size, dtype=np.float32)}
+                  for size in sizes]
+
+
+def test_bucket_size():
+    assert [bucket_size(size, [4, 8]) for size in [1, 4, 5, 9, 20]] == [4, 4, 8, 16, 32]
+    assert [bucket_size(size) for size in [0, 1, 3, 8]] == [1, 1, 4, 8]
+
+
+def test_pad_inputs():
+    batch = pad_inputs(list_of_inputs, [4, 8], {'site': 0., 'distance': np.nan})
+    assert batch['site'].shape == batch['distance'].shape == (4, 16)
+    assert batch['site'].dtype == np.float32
+    assert np.isnan(batch['distance'][0, 3])
+    assert batch['site'][3].tolist() == list(range(12)) + [0.] * 4
+
+
+def importorskip_tensorflow():
+    """ rlmolecule registers tensorflow as a lazy module, which only fails to import once it's used """
+    pytest.importorskip("tensorflow.keras", exc_type=ImportError)
+    return pytest.importorskip("tensorflow")
+
+
+@pytest.fixture(scope='function')
+def energy_model():
+    """ The sum of the site values, so that the prediction doesn't depend on the padding """
+    tf = importorskip_tensorflow()
+    layers = tf.keras.layers
+    site = layers.Input([None], dtype=tf.float32, name="site")
+    distance = layers.Input([None], dtype=tf.float32, name="distance")
+    energy = layers.Lambda(lambda x: tf.reduce_sum(x, axis=1, keepdims=True))(site)
+    return tf.keras.Model({'site': site, 'distance': distance}, energy, name="energy_model")
+
+
+@pytest.mark.parametrize('signature', [True, False])
+def test_predict_energies(energy_model, signature):
+    tf = importorskip_tensorflow()
+    output_signature = {'site': tf.TensorSpec([None], tf.float32), 'distance': tf.TensorSpec([None], tf.float32)}
+    predictor = EnergyPredictor(energy_model,
+                                output_signature=output_signature if signature else None,
+                                padding_values={'site': 0., 'distance': tf.constant(np.nan)},
+                                bucket_sizes=[4, 8],
+                                max_batch_size=2)
+    assert [predictor.bucket_size(size) for size in [1, 4, 5, 9, 20]] == [4, 4, 8, 16, 32]
+    batch = predictor.pad_inputs(list_of_inputs)
+    assert batch['site'].shape == (4, 16)
+    assert np.isnan(batch['distance'][0, 3])
+
+    energies = predictor.predict_energies(list_of_inputs[:2] + [None] + list_of_inputs[2:])
+    assert energies[2] is None
+    expected = [size * (size - 1) / 2 for size in sizes]
+    assert [energy for energy in energies if energy is not None] == pytest.approx(expected)
@@ -0,0 +1,92 @@
+import gc
+import os
+import threading
+import time
+
+import pytest
+
+from rlmolecule.crystal.pipeline import Pipeline, PipelineFailure, PipelineStage
+
+
+def add_one(items):
+    return [item + 1 for item in items]
+
+
+def square(items):
+    return [item ** 2 for item in items]
+
+
+class BatchRecorder:
+    def __init__(self):
+        self.batch_sizes = []
+        self.lock = threading.Lock()
+
+    def __call__(self, items):
+        # slow enough for items to queue up
+        time.sleep(0.01)
+        with self.lock:
+            self.batch_sizes.append(len(items))
+        return [-item for item in items]
+
+
+def test_pipeline():
+    recorder = BatchRecorder()
+    pipeline = Pipeline([PipelineStage('add', add_one, num_workers=3),
+                         PipelineStage('batch', recorder, batch_size=8),
+                         PipelineStage('square', square, num_workers=2)],
+                        queue_size=4)
+    assert pipeline.run(range(50)) == [(i + 1) ** 2 for i in range(50)]
+    assert sum(recorder.batch_sizes) == 50
+    assert max(recorder.batch_sizes) > 1
+    assert max(recorder.batch_sizes) <= 8
+    assert pipeline.run([]) == []
+
+
+def test_process_stage():
+    pipeline = Pipeline([PipelineStage('add', add_one, num_workers=2, processes=True, batch_size=4),
+                         PipelineStage('square', square)])
+    assert pipeline.run(range(20)) == [(i + 1) ** 2 for i in range(20)]
+
+
+def get_pid(items):
+    time.sleep(0.01)
+    return [os.getpid()] * len(items)
+
+
+def test_processes_reused():
+    with Pipeline([PipelineStage('pid', get_pid, num_workers=2, processes=True)]) as pipeline:
+        assert os.getpid() not in pipeline.run(range(10))
+        executors = pipeline._executors
+        # the worker processes (and whatever they cached) are kept between runs
+        pipeline.run(range(10))
+        assert pipeline._executors is executors
+    assert pipeline._executors is None
+
+    # closed pipelines start new workers
+    assert pipeline.run(range(4)) != [os.getpid()] * 4
+    pipeline.close()
+
+
+def fail_on_three(items):
+    if 3 in items:
+        raise ValueError("three")
+    return items
+
+
+@pytest.mark.parametrize('batch_size', [1, 4])
+def test_failure(batch_size):
+    pipeline = Pipeline([PipelineStage('fail', fail_on_three, batch_size=batch_size), PipelineStage('add', add_one)])
+    results = pipeline.run(range(10))
+    # only the failing item is lost, even when it's part of a batch
+    assert isinstance(results[3], PipelineFailure)
+    assert results[3].stage == 'fail' and isinstance(results[3].error, ValueError)
+    assert results[:3] + results[4:] == [i + 1 for i in range(10) if i != 3]
+
+
+def test_workers_stopped_when_collected():
+    pipeline = Pipeline([PipelineStage('pid', get_pid, processes=True)])
+    pipeline.run(range(2))
+    executor, = pipeline._executors
+    del pipeline
+    gc.collect()
+    assert executor._shutdown_thread
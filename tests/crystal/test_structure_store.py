@@ -0,0 +1,56 @@
+import pickle
+
+import numpy as np
+import pytest
+from pymatgen.core import Lattice, Structure
+
+from rlmolecule.crystal.structure_store import StructureStore
+
+
+@pytest.fixture
+def structures() -> dict:
+    rocksalt = Structure.from_spacegroup('Fm-3m', Lattice.cubic(5.6), ['Na', 'Cl'], [[0, 0, 0], [0.5, 0.5, 0.5]])
+    rocksalt.add_oxidation_state_by_element({'Na': 1, 'Cl': -1})
+    fluorite = Structure.from_spacegroup('Fm-3m', Lattice.cubic(5.5), ['Ca', 'F'], [[0, 0, 0], [0.25, 0.25, 0.25]])
+    return {'_1_1|cubic|POSCAR_sg225_icsd_1': rocksalt, '_1_2|cubic|POSCAR_sg225_icsd_2': fluorite}
+
+
+def test_structure_store(tmp_path, structures):
+    StructureStore.write(str(tmp_path), structures)
+    store = StructureStore(str(tmp_path), cache_size=1)
+
+    assert len(store) == 2
+    assert list(store) == list(structures)
+    assert '_1_1|cubic|POSCAR_sg225_icsd_1' in store
+    assert 'missing' not in store
+    with pytest.raises(KeyError):
+        store['missing']
+
+    for key, structure in structures.items():
+        stored = store[key]
+        assert stored.formula == structure.formula
+        assert [site.specie.symbol for site in stored] == [site.specie.symbol for site in structure]
+        assert np.allclose(stored.frac_coords, structure.frac_coords)
+        assert np.allclose(stored.lattice.matrix, structure.lattice.matrix)
+
+    # oxidation states aren't stored
+    assert all(site.specie.__class__.__name__ == 'Element' for site in store['_1_1|cubic|POSCAR_sg225_icsd_1'])
+
+    # structures are cached, up to cache_size
+    fluorite = store['_1_2|cubic|POSCAR_sg225_icsd_2']
+    assert store['_1_2|cubic|POSCAR_sg225_icsd_2'] is fluorite
+    store['_1_1|cubic|POSCAR_sg225_icsd_1']
+    assert store['_1_2|cubic|POSCAR_sg225_icsd_2'] is not fluorite
+
+    lattice, atomic_numbers, frac_coords = store.get_arrays('_1_2|cubic|POSCAR_sg225_icsd_2')
+    assert lattice.shape == (3, 3)
+    assert sorted(set(atomic_numbers.tolist())) == [9, 20]
+    assert frac_coords.shape == (12, 3)
+
+
+def test_pickle(tmp_path, structures):
+    StructureStore.write(str(tmp_path), structures)
+    store = pickle.loads(pickle.dumps(StructureStore(str(tmp_path), cache_size=4)))
+    assert store.cache_size == 4
+    assert isinstance(store.lattices, np.memmap)
+    assert store['_1_2|cubic|POSCAR_sg225_icsd_2'].formula == structures['_1_2|cubic|POSCAR_sg225_icsd_2'].formula
@@ -0,0 +1,79 @@
+import random
+from typing import Sequence
+
+import pytest
+
+from rlmolecule.alphazero.alphazero import AlphaZero
+from rlmolecule.mcts.mcts import MCTS
+from rlmolecule.tree_search.reward import LinearBoundedRewardFactory
+from tests.chain_problem import ChainAlphaZeroProblem, ChainProblem, ChainState
+
+
+class ForcedChainState(ChainState):
+    """ A ChainState where every other level only has a single successor """
+
+    def get_next_actions(self) -> Sequence['ForcedChainState']:
+        if self.depth >= self.max_depth:
+            return []
+        width = 1 if self.depth % 2 else self.width
+        return [ForcedChainState(self.depth + 1, (self.position + i) % self.width, self.width, self.max_depth)
+                for i in range(width)]
+
+
+class ForcedChainProblem(ChainProblem):
+    def get_initial_state(self) -> ForcedChainState:
+        return ForcedChainState(0, 0, self.width, self.max_depth)
+
+
+def test_forced_and_terminal_vertices(tree_store):
+    game = MCTS(ForcedChainProblem(reward_class=LinearBoundedRewardFactory()), tree_store=tree_store)
+    root = game._get_root()
+    num_samples = game.sample(root, 10, adaptive_budget=True)
+    # each of the 3 children is visited once first, so the leader can't be decided before 7 samples
+    assert 7 <= num_samples <= 10
+    assert len(root.children) == 3 and all(child.visit_count > 0 for child in root.children)
+
+    forced = root.children[0]
+    assert game.sample(forced, 10, adaptive_budget=True) == 0
+    assert len(forced.children) == 1
+
+    terminal = game.get_vertex_for_state(ForcedChainState(4, 0))
+    assert game.sample(terminal, 10, adaptive_budget=True) == 0
+    assert terminal.children == []
+
+
+def test_stops_when_decided(tree_store):
+    random.seed(0)
+    game = MCTS(ChainProblem(reward_class=LinearBoundedRewardFactory(), width=2), tree_store=tree_store,
+                ucb_constant=0.1)
+    root = game._get_root()
+    num_samples = game.sample(root, 100, adaptive_budget=True)
+    assert num_samples < 100
+
+    first, second = sorted(child.visit_count for child in root.children)[::-1]
+    assert first - second > 100 - num_samples
+
+
+@pytest.mark.parametrize('widening_coefficient,lazy_children', [(1., False), (None, True)])
+def test_pending_successors(tree_store, widening_coefficient, lazy_children):
+    """ A vertex whose successors are admitted one at a time isn't decided by its first child """
+    random.seed(0)
+    game = MCTS(ChainProblem(reward_class=LinearBoundedRewardFactory(), width=5, max_depth=6), tree_store=tree_store,
+                widening_coefficient=widening_coefficient, lazy_children=lazy_children)
+    root = game._get_root()
+    num_samples = game.sample(root, 20, adaptive_budget=True)
+    assert num_samples > 1
+    assert len(root.children) > 1
+
+    first, second = (sorted(child.visit_count for child in root.children)[::-1] + [0])[:2]
+    assert num_samples == 20 or first - second > 20 - num_samples
+
+
+def test_carry_over(engine):
+    problem = ChainAlphaZeroProblem(reward_class=LinearBoundedRewardFactory(), engine=engine, width=1)
+    game = AlphaZero(problem)
+    path, reward = game.run(num_mcts_samples=10, adaptive_budget=True)
+    assert len(path) == problem.max_depth + 1
+    # every move is forced, so no samples are spent
+    assert all(vertex.visit_count == 0 for vertex, _ in path)
+    assert all(probabilities == [(vertex.children[0], 1.)] for vertex, probabilities in path[:-1])
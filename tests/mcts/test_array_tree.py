@@ -0,0 +1,145 @@
+import gc
+import random
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from rlmolecule.alphazero.alphazero import AlphaZero
+from rlmolecule.alphazero.array_alphazero_vertex import ArrayAlphaZeroVertex
+from rlmolecule.mcts.array_tree import ArrayMCTSVertex, ArrayTree
+from rlmolecule.mcts.mcts import MCTS
+from rlmolecule.tree_search.reward import LinearBoundedRewardFactory
+from tests.chain_problem import ChainAlphaZeroProblem, ChainProblem
+
+
+def test_array_tree_growth():
+    tree = ArrayTree(initial_capacity=2)
+    vertices = [tree.vertex(tree.add_vertex(i)) for i in range(5)]
+    assert [vertex.id for vertex in vertices] == list(range(5))
+    assert [vertex.state for vertex in vertices] == list(range(5))
+    assert len(tree.visit_count) >= 5
+    # handles are created on demand, and compare by id
+    assert tree.vertex(3) == vertices[3] and hash(tree.vertex(3)) == hash(vertices[3])
+    assert tree.vertex(3) != vertices[2]
+
+    vertices[0].children = vertices[1:]
+    vertices[1].children = vertices[3:]
+    assert vertices[0].children == vertices[1:]
+    assert vertices[1].children == vertices[3:]
+    assert vertices[2].children is None
+    assert not vertices[2].expanded
+
+    tree.update([0, 1, 3], 0.5)
+    vertices[3].update(1.)
+    assert vertices[0].visit_count == 1
+    assert vertices[3].visit_count == 2
+    assert vertices[3].value == pytest.approx(0.75)
+
+
+def test_array_tree_release():
+    tree = ArrayTree(initial_capacity=2)
+    vertices = [tree.vertex(tree.add_vertex(i)) for i in range(6)]
+    vertices[0].children = vertices[1:3]
+    for _ in range(4):
+        # replaced edge ranges are reclaimed as they pile up
+        vertices[1].children = vertices[2:4]
+        vertices[1].children = vertices[3:6]
+    assert tree.num_edges <= 2 * 5
+    assert vertices[0].children == vertices[1:3]
+    assert vertices[1].children == vertices[3:6]
+
+    tree.update([0, 2], 1.)
+    tree.pin([2])
+    tree.release(2)
+    assert vertices[2].state == 2
+    tree.unpin()
+    assert vertices[2].state is None and vertices[2].visit_count == 0
+    assert len(tree) == 5
+
+    # released ids are reused
+    assert tree.add_vertex(6) == 2
+    assert tree.vertex(2).state == 6 and tree.vertex(2).children is None
+    assert len(tree) == 6 and tree.num_vertices == 6
+
+
+def test_mcts_matches_object_tree():
+    problem = ChainProblem(reward_class=LinearBoundedRewardFactory())
+
+    random.seed(42)
+    game = MCTS(problem)
+    root = game._get_root()
+    game.sample(root, 50)
+
+    random.seed(42)
+    array_game = MCTS(problem, tree_store=ArrayTree(initial_capacity=4))
+    array_root = array_game._get_root()
+    assert isinstance(array_root, ArrayMCTSVertex)
+    array_game.sample(array_root, 50)
+
+    assert array_root.visit_count == root.visit_count == 50
+    assert array_root.value == pytest.approx(root.value)
+    assert [child.visit_count for child in array_root.children] == [child.visit_count for child in root.children]
+
+
+def test_alphazero_array_tree(engine):
+    problem = ChainAlphaZeroProblem(reward_class=LinearBoundedRewardFactory(), engine=engine)
+    game = AlphaZero(problem, dirichlet_noise=False, tree_store=ArrayTree())
+    root = game._get_root()
+    assert isinstance(root, ArrayAlphaZeroVertex)
+
+    game.sample(root, 20)
+    assert root.visit_count == 20
+    assert sum(root.child_priors.values()) == pytest.approx(1.)
+    assert np.argmax([root.child_priors[child] for child in root.children]) == 2
+
+    path = []
+    game._accumulate_path_data(root, path)
+    assert sum(prob for _, prob in path[0][1]) == pytest.approx(1.)
+
+    history, reward = game.run(num_mcts_samples=5)
+    assert len(history) == problem.max_depth + 1
+    assert np.isfinite(reward.raw_reward)
+
+
+def test_vertices_have_no_dict(engine, tree_store):
+    """ Vertices are created for every state of the search graph, so they only hold their slots """
+    game = AlphaZero(ChainAlphaZeroProblem(reward_class=LinearBoundedRewardFactory(), engine=engine),
+                     tree_store=tree_store)
+    root = game._get_root()
+    game.sample(root, 5)
+    for vertex in [root] + root.children:
+        assert not hasattr(vertex, '__dict__')
+    if tree_store is not None:
+        # each test gets a new tree
+        assert root.id == 0
+
+
+def _bytes_per_vertex(tree_store):
+    """ Memory held by the search per vertex, excluding the states themselves """
+    from tests.mcts import test_lazy_children
+
+    class WidePathProblem(test_lazy_children.PathProblem):
+        def get_initial_state(self):
+            return test_lazy_children.PathState((), 20, 5)
+
+    random.seed(0)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        game = MCTS(WidePathProblem(reward_class=LinearBoundedRewardFactory()), tree_store=tree_store)
+        game.sample(game._get_root(), 500)
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, test_lazy_children.__file__), tracemalloc.Filter(False, tracemalloc.__file__)])
+    finally:
+        tracemalloc.stop()
+    num_vertices = len(game.canonicalizer._vertex_map)
+    assert num_vertices > 5000
+    return sum(stat.size for stat in snapshot.statistics('filename')) / num_vertices
+
+
+def test_array_tree_bytes_per_vertex():
+    """ The array store keeps no object per vertex: only the arrays, the state list and the canonicalizer entry """
+    array_bytes = _bytes_per_vertex(ArrayTree())
+    assert array_bytes < 160
+    assert array_bytes < _bytes_per_vertex(None)
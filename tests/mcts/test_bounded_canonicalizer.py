@@ -0,0 +1,160 @@
+import gc
+import random
+import weakref
+from collections import Counter
+
+from rlmolecule.mcts.array_tree import ArrayTree
+from rlmolecule.mcts.mcts import MCTS
+from rlmolecule.tree_search.canonicalizer.bounded_hash_canonicalizer import BoundedHashCanonicalizer
+from rlmolecule.tree_search.reward import LinearBoundedRewardFactory
+from tests.chain_problem import ChainProblem
+from tests.mcts.test_lazy_children import PathProblem, PathState
+
+
+def reachable(root):
+    seen = set()
+    stack = [root]
+    while stack:
+        vertex = stack.pop()
+        if vertex not in seen:
+            seen.add(vertex)
+            stack.extend(vertex.children or [])
+    return seen
+
+
+def test_advance_root_drops_unreachable():
+    random.seed(1)
+    canonicalizer = BoundedHashCanonicalizer()
+    game = MCTS(ChainProblem(reward_class=LinearBoundedRewardFactory(), width=5, max_depth=3),
+                canonicalizer=canonicalizer)
+    root = game._get_root()
+    game.sample(root, 40)
+    num_vertices = len(canonicalizer)
+
+    child = max(root.children, key=lambda vertex: vertex.visit_count)
+    canonicalizer.advance_root(child)
+    assert len(canonicalizer) < num_vertices
+    assert len(canonicalizer) == len(reachable(child))
+    assert canonicalizer.get_canonical_vertex(root.state) is None
+    assert canonicalizer.get_canonical_vertex(child.state) is child
+
+
+class SmallPathProblem(PathProblem):
+    def get_initial_state(self) -> PathState:
+        return PathState(width=5, max_depth=6)
+
+
+def test_vertex_budget():
+    random.seed(1)
+    canonicalizer = BoundedHashCanonicalizer(max_vertices=12)
+    game = MCTS(SmallPathProblem(reward_class=LinearBoundedRewardFactory()), canonicalizer=canonicalizer)
+    root = game._get_root()
+    canonicalizer.advance_root(root)
+    for _ in range(30):
+        game.sample(root, 1)
+        # a single expansion can add at most `width` new vertices before the next trim
+        assert len(canonicalizer) <= 12 + 5
+    assert root.visit_count == 30
+
+    # collapsed vertices still hold their statistics, and every kept vertex is canonical
+    for vertex in reachable(root):
+        canonical = canonicalizer.get_canonical_vertex(vertex.state)
+        assert canonical is None or canonical is vertex
+
+
+def test_keeps_shared_children():
+    """ In the chain problem every state can be reached through several parents, so no child is ever dropped while
+    another parent in the graph still holds it """
+    random.seed(1)
+    canonicalizer = BoundedHashCanonicalizer(max_vertices=12)
+    game = MCTS(ChainProblem(reward_class=LinearBoundedRewardFactory(), width=5, max_depth=6),
+                canonicalizer=canonicalizer)
+    root = game._get_root()
+    canonicalizer.advance_root(root)
+    game.sample(root, 30)
+    assert all(canonicalizer.get_canonical_vertex(vertex.state) is vertex for vertex in reachable(root))
+
+
+def test_trim_skips_vertices_in_use():
+    random.seed(1)
+    canonicalizer = BoundedHashCanonicalizer()
+    game = MCTS(SmallPathProblem(reward_class=LinearBoundedRewardFactory()), canonicalizer=canonicalizer)
+    root = game._get_root()
+    canonicalizer.advance_root(root)
+    game.sample(root, 10)
+    collapsible = [vertex for vertex in reachable(root) if vertex.children and vertex is not root
+                   and all(child.visit_count == 0 for child in vertex.children)]
+    assert collapsible
+
+    canonicalizer.max_vertices = 1
+    canonicalizer.trim(in_use=collapsible)
+    assert all(vertex.children for vertex in collapsible)
+
+    # advancing the root lets the next trim scan the graph again
+    canonicalizer.advance_root(root)
+    canonicalizer.trim()
+    assert all(vertex.children is None for vertex in collapsible)
+    assert all(canonicalizer.get_canonical_vertex(vertex.state) is vertex for vertex in reachable(root))
+
+
+def test_collapses_least_recently_used():
+    random.seed(1)
+    canonicalizer = BoundedHashCanonicalizer()
+    game = MCTS(SmallPathProblem(reward_class=LinearBoundedRewardFactory()), canonicalizer=canonicalizer)
+    root = game._get_root()
+    canonicalizer.advance_root(root)
+    game.sample(root, 10)
+    canonicalizer.advance_root(root)  # drops the terminal states of rollouts
+    collapsible = [vertex for vertex in reachable(root) if vertex.children and vertex is not root
+                   and all(child.visit_count == 0 for child in vertex.children)]
+    assert len(collapsible) > 1
+
+    # a search path through the oldest candidate makes it the most recently used
+    oldest = next(vertex for vertex in canonicalizer._vertex_map.values() if vertex in collapsible)
+    canonicalizer.touch([oldest])
+    canonicalizer.max_vertices = len(canonicalizer) - 1
+    canonicalizer.low_water = 1.
+    canonicalizer.trim()
+    assert oldest.children is not None
+    assert sum(vertex.children is None for vertex in collapsible) == 1
+
+
+def test_byte_budget_with_run():
+    canonicalizer = BoundedHashCanonicalizer(max_bytes=20 * 1024)
+    tree = ArrayTree()
+    game = MCTS(ChainProblem(reward_class=LinearBoundedRewardFactory(), width=6, max_depth=5),
+                canonicalizer=canonicalizer, tree_store=tree)
+    history, reward = game.run(num_mcts_samples=50)
+    assert len(history) == 6
+    assert canonicalizer.nbytes <= 20 * 1024 + 6 * 1024
+    # the tree only holds the kept vertices, and the vertices of the game's path, which stay valid until the next game
+    assert len(tree) <= len(canonicalizer) + sum(len(vertex.children) + 1 for vertex in history)
+    assert all(vertex.state is not None for vertex in history)
+
+    game.run(num_mcts_samples=50, reset_canonicalizer=False)
+    assert len(tree) <= len(canonicalizer) + sum(len(vertex.children) + 1 for vertex in history)
+
+
+def test_evicted_vertices_are_freed(tree_store):
+    random.seed(1)
+    canonicalizer = BoundedHashCanonicalizer(max_vertices=20)
+    game = MCTS(SmallPathProblem(reward_class=LinearBoundedRewardFactory()), canonicalizer=canonicalizer,
+                tree_store=tree_store, widening_coefficient=1.)
+    root = game._get_root()
+    canonicalizer.advance_root(root)
+    states = []
+    for _ in range(50):
+        game.sample(root, 1)
+        states += [weakref.ref(state) for state in canonicalizer._vertex_map]
+
+    gc.collect()
+    kept = set(canonicalizer._vertex_map)
+    assert len({ref() for ref in states} - {None}) == len(kept)
+    assert all(vertex.state in kept for vertex in game._pending_successors)
+    if tree_store is not None:
+        assert len(tree_store) == len(kept)
+        assert tree_store.num_vertices <= 20 + 2 * 5
+
+    # the parent counts are kept up to date as the graph changes
+    vertices = [canonicalizer.get_canonical_vertex(state) for state in kept]
+    assert canonicalizer._num_parents == Counter(child.state for vertex in vertices for child in vertex.children or ())
@@ -0,0 +1,131 @@
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Sequence
+
+import pytest
+
+from rlmolecule.alphazero.alphazero import AlphaZero
+from rlmolecule.mcts.mcts import MCTS
+from rlmolecule.mcts.mcts_problem import MCTSProblem
+from rlmolecule.tree_search.graph_search_state import GraphSearchState
+from rlmolecule.tree_search.reward import LinearBoundedRewardFactory
+from tests.chain_problem import ChainAlphaZeroProblem
+
+
+class PathState(GraphSearchState):
+    """ A tree-shaped search space, where each state is the sequence of actions taken to reach it. Successors are
+    described by their action alone, and the number of materialized states is counted. """
+    num_materialized = 0
+
+    def __init__(self, path: tuple = (), width: int = 6, max_depth: int = 3):
+        self.path = path
+        self.width = width
+        self.max_depth = max_depth
+        PathState.num_materialized += 1
+
+    def equals(self, other: 'PathState') -> bool:
+        return self.path == other.path
+
+    def hash(self) -> int:
+        return hash(self.path)
+
+    def __repr__(self):
+        return f"PathState{self.path}"
+
+    def get_next_actions(self) -> Sequence['PathState']:
+        return [self.materialize_action(action) for action in self.get_next_action_descriptors()]
+
+    def get_next_action_descriptors(self) -> Sequence[int]:
+        return list(range(self.width)) if len(self.path) < self.max_depth else []
+
+    def materialize_action(self, descriptor: int) -> 'PathState':
+        return PathState(self.path + (descriptor,), self.width, self.max_depth)
+
+
+class PathProblem(MCTSProblem):
+    def get_initial_state(self) -> PathState:
+        return PathState()
+
+    def get_reward(self, state: PathState) -> (float, {}):
+        return sum(state.path) / (state.width * state.max_depth), {}
+
+
+def test_lazy_matches_eager(tree_store):
+    random.seed(3)
+    PathState.num_materialized = 0
+    game = MCTS(PathProblem(reward_class=LinearBoundedRewardFactory()))
+    root = game._get_root()
+    game.sample(root, 30)
+    num_eager = PathState.num_materialized
+
+    random.seed(3)
+    PathState.num_materialized = 0
+    lazy_game = MCTS(PathProblem(reward_class=LinearBoundedRewardFactory()), lazy_children=True,
+                     tree_store=tree_store)
+    lazy_root = lazy_game._get_root()
+    lazy_game.sample(lazy_root, 30)
+
+    assert [child.visit_count for child in lazy_root.children] == [child.visit_count for child in root.children]
+    assert lazy_root.value == pytest.approx(root.value)
+    assert PathState.num_materialized < num_eager
+
+
+def test_children_admitted_one_at_a_time():
+    game = MCTS(PathProblem(reward_class=LinearBoundedRewardFactory()), lazy_children=True)
+    root = game._get_root()
+    game.sample(root, 1)
+    assert len(root.children) == 1
+    game.sample(root, 3)
+    assert len(root.children) == 3
+    assert all(child.visit_count == 1 for child in root.children)
+
+
+def test_lazy_alphazero(engine):
+    problem = ChainAlphaZeroProblem(reward_class=LinearBoundedRewardFactory(), engine=engine, width=5)
+    game = AlphaZero(problem, lazy_children=True)
+    root = game._get_root()
+    game.sample(root, 3)
+    # the policy needs every child, so they are all built when the vertex is evaluated
+    assert len(root.children) == 5
+    assert len(root.child_prior_array) == 5
+
+
+def test_lazy_alphazero_adaptive_budget(engine, tree_store):
+    problem = ChainAlphaZeroProblem(reward_class=LinearBoundedRewardFactory(), engine=engine, width=5)
+    game = AlphaZero(problem, lazy_children=True, tree_store=tree_store)
+    root = game._get_root()
+    assert game.sample(root, 10, adaptive_budget=True) > 1
+    assert len(root.children) == 5
+
+
+class LockedChainAlphaZeroProblem(ChainAlphaZeroProblem):
+    """ Serializes the calls that use the problem's database session, which isn't thread safe """
+    lock = threading.Lock()
+
+    def get_values_and_policies(self, parents):
+        with self.lock:
+            return super().get_values_and_policies(parents)
+
+    def reward_wrappers(self, vertices):
+        with self.lock:
+            return super().reward_wrappers(vertices)
+
+
+class ThreadCheckingAlphaZero(AlphaZero):
+    admitting_threads = set()
+
+    def _admit(self, vertex, num_new: int) -> bool:
+        self.admitting_threads.add(threading.get_ident())
+        return super()._admit(vertex, num_new)
+
+
+def test_lazy_alphazero_executor(engine):
+    problem = LockedChainAlphaZeroProblem(reward_class=LinearBoundedRewardFactory(), engine=engine, width=5)
+    game = ThreadCheckingAlphaZero(problem, lazy_children=True)
+    root = game._get_root()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        game.sample(root, 20, num_parallel=4, executor=executor)
+    # children are only admitted by the thread that modifies the tree
+    assert game.admitting_threads == {threading.get_ident()}
+    assert len(root.children) == 5
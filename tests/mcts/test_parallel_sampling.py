@@ -0,0 +1,52 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from rlmolecule.alphazero.alphazero import AlphaZero
+from rlmolecule.mcts.mcts import MCTS
+from rlmolecule.tree_search.reward import LinearBoundedRewardFactory
+from tests.chain_problem import ChainAlphaZeroProblem, ChainProblem
+
+
+def check_visits(vertex, seen=None):
+    """ Once all virtual losses are reverted, every vertex should hold an average reward between zero and one """
+    seen = set() if seen is None else seen
+    if vertex in seen or not vertex.children:
+        return
+    seen.add(vertex)
+    for child in vertex.children:
+        assert 0 <= child.value_sum <= child.visit_count
+        check_visits(child, seen)
+
+
+def test_parallel_sample_without_executor(tree_store):
+    random.seed(0)
+    game = MCTS(ChainProblem(reward_class=LinearBoundedRewardFactory()), tree_store=tree_store)
+    root = game._get_root()
+    game.sample(root, 40, num_parallel=4)
+
+    assert root.visit_count == 40
+    assert sum(child.visit_count for child in root.children) == 39
+    # the virtual loss spreads the first pending selections over different children
+    assert all(child.visit_count > 0 for child in root.children)
+    check_visits(root)
+
+
+def test_parallel_sample_with_executor(tree_store):
+    game = MCTS(ChainProblem(reward_class=LinearBoundedRewardFactory(), width=4), tree_store=tree_store)
+    root = game._get_root()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        game.sample(root, 60, num_parallel=4, executor=executor)
+
+    assert root.visit_count == 60
+    assert sum(child.visit_count for child in root.children) == 59
+    check_visits(root)
+
+
+def test_parallel_alphazero(engine):
+    problem = ChainAlphaZeroProblem(reward_class=LinearBoundedRewardFactory(), engine=engine)
+    game = AlphaZero(problem, dirichlet_noise=False)
+    history, reward = game.run(num_mcts_samples=8, num_parallel=3)
+    assert len(history) == problem.max_depth + 1
+    assert history[0][0].visit_count == 8
@@ -0,0 +1,61 @@
+import pytest
+
+from rlmolecule.alphazero.alphazero import AlphaZero
+from rlmolecule.tree_search.reward import LinearBoundedRewardFactory
+from tests.chain_problem import ChainAlphaZeroProblem
+
+
+class CheckpointProblem(ChainAlphaZeroProblem):
+    def __init__(self, **kwargs):
+        super(CheckpointProblem, self).__init__(**kwargs)
+        self.current_checkpoint = 'policy.01'
+        self.num_evaluations = 0
+
+    @property
+    def checkpoint(self):
+        return self.current_checkpoint
+
+    def get_value_and_policy(self, parent):
+        self.num_evaluations += 1
+        return super(CheckpointProblem, self).get_value_and_policy(parent)
+
+
+def same_vertex(vertex, other) -> bool:
+    # ArrayTree vertices are handles created on demand, which are equal when they refer to the same vertex
+    return vertex is other or (hasattr(vertex, 'tree') and vertex == other)
+
+
+def test_persistent_graph(engine, tree_store):
+    problem = CheckpointProblem(reward_class=LinearBoundedRewardFactory(), engine=engine)
+    game = AlphaZero(problem, persist_graph=True, tree_store=tree_store)
+
+    game.run(num_mcts_samples=10)
+    root = game._get_root()
+    root_visits = root.visit_count
+    first_child = root.children[0]
+    assert root_visits > 0
+
+    # The graph and its statistics are kept while the checkpoint is unchanged
+    game.run(num_mcts_samples=10)
+    assert same_vertex(game._get_root(), root)
+    assert same_vertex(root.children[0], first_child)
+    assert root.visit_count > root_visits
+
+    # Loading a new checkpoint clears visits and priors, but keeps the graph
+    problem.current_checkpoint = 'policy.02'
+    num_evaluations = problem.num_evaluations
+    game.run(num_mcts_samples=3)
+    assert same_vertex(game._get_root(), root)
+    assert same_vertex(root.children[0], first_child)
+    assert root.visit_count == 3
+    assert root.child_priors is not None
+    assert problem.num_evaluations > num_evaluations
+
+
+def test_reset_by_default(engine):
+    problem = CheckpointProblem(reward_class=LinearBoundedRewardFactory(), engine=engine)
+    game = AlphaZero(problem)
+    game.run(num_mcts_samples=5)
+    root = game._get_root()
+    game.run(num_mcts_samples=5)
+    assert game._get_root() is not root
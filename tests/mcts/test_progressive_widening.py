@@ -0,0 +1,82 @@
+import math
+import random
+
+import numpy as np
+import pytest
+
+from rlmolecule.alphazero.alphazero import AlphaZero
+from rlmolecule.mcts.mcts import MCTS
+from rlmolecule.tree_search.reward import LinearBoundedRewardFactory
+from tests.chain_problem import ChainAlphaZeroProblem, ChainProblem
+
+
+class CountingProblem(ChainAlphaZeroProblem):
+    def __init__(self, **kwargs):
+        super(CountingProblem, self).__init__(**kwargs)
+        self.num_policy_inputs = 0
+
+    def get_policy_inputs(self, state):
+        self.num_policy_inputs += 1
+        return super(CountingProblem, self).get_policy_inputs(state)
+
+
+def test_widening(tree_store):
+    random.seed(0)
+    game = MCTS(ChainProblem(reward_class=LinearBoundedRewardFactory(), width=50, max_depth=2),
+                tree_store=tree_store, widening_coefficient=1., widening_exponent=0.5)
+    root = game._get_root()
+    game.sample(root, 1)
+    assert len(root.children) == 1
+
+    game.sample(root, 99)
+    assert len(root.children) == math.ceil(100 ** 0.5)
+    assert sum(child.visit_count for child in root.children) == 99
+    assert len(set(root.children)) == len(root.children)
+
+
+def test_alphazero_widening(engine, tree_store):
+    problem = CountingProblem(reward_class=LinearBoundedRewardFactory(), engine=engine, width=40, max_depth=2)
+    game = AlphaZero(problem, tree_store=tree_store, widening_coefficient=2.)
+    root = game._get_root()
+    game.sample(root, 16)
+
+    assert len(root.children) == 8
+    assert root.child_prior_array is not None
+    assert len(root.child_prior_array) == len(root.children)
+    # admitted children keep their share of the priors of all 40 successors
+    assert np.sum(root.child_prior_array) < 1.
+    # policy inputs are computed once for each successor, when its parent is first evaluated (the successors of the
+    # vertices at depth 1 are shared)
+    assert problem.num_policy_inputs <= 1 + 40 + 40
+
+    path, reward = game.run(num_mcts_samples=16, adaptive_budget=True)
+    assert len(path) == 3
+
+
+class PositionPriorProblem(ChainAlphaZeroProblem):
+    """ Priors grow with the position of each child, whatever the order of the children """
+
+    def __init__(self, **kwargs):
+        super(PositionPriorProblem, self).__init__(**kwargs)
+        self.num_evaluations = 0
+
+    def get_value_and_policy(self, parent):
+        self.num_evaluations += 1
+        priors = np.array([child.state.position + 1. for child in parent.children])
+        priors /= priors.sum()
+        return 0.5, dict(zip(parent.children, priors))
+
+
+def test_alphazero_widening_admits_highest_priors(engine, tree_store):
+    random.seed(0)
+    problem = PositionPriorProblem(reward_class=LinearBoundedRewardFactory(), engine=engine, width=20, max_depth=1)
+    game = AlphaZero(problem, tree_store=tree_store, widening_coefficient=1., dirichlet_noise=False)
+    root = game._get_root()
+    game.sample(root, 1)
+    assert [child.state.position for child in root.children] == [19]
+
+    game.sample(root, 15)
+    assert [child.state.position for child in root.children] == [19, 18, 17, 16]
+    assert root.child_prior_array == pytest.approx(np.array([20., 19., 18., 17.]) / 210.)
+    # the priors of the admitted children come from the first evaluation
+    assert problem.num_evaluations == 1
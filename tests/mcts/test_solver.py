@@ -0,0 +1,116 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from rlmolecule.alphazero.alphazero import AlphaZero
+from rlmolecule.mcts.mcts import MCTS
+from rlmolecule.tree_search.reward import LinearBoundedRewardFactory
+from tests.chain_problem import ChainAlphaZeroProblem, ChainProblem, ChainState
+from tests.mcts.test_lazy_children import PathProblem, PathState
+
+
+def count_evaluations(game):
+    """ Count the leaf evaluations of the given game """
+    evaluate = game._evaluate
+    game.num_evaluations = 0
+
+    def counted_evaluate(search_path):
+        game.num_evaluations += 1
+        return evaluate(search_path)
+
+    game._evaluate = counted_evaluate
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'lazy_children': True}, {'widening_coefficient': 1.}])
+def test_solved_root(tree_store, kwargs):
+    random.seed(0)
+    game = MCTS(ChainProblem(reward_class=LinearBoundedRewardFactory(), max_depth=2), tree_store=tree_store,
+                solver=True, **kwargs)
+    root = game._get_root()
+    num_samples = game.sample(root, 1000)
+
+    # once every decoration was scored, the search stops
+    assert num_samples < 1000
+    assert root.solved
+    assert root.solved_value == 1.
+    assert all(child.solved_value == 1. for child in root.children)
+    terminal = game.get_vertex_for_state(ChainState(2, 1))
+    assert terminal.solved_value == 0.5
+
+    assert game.sample(root, 10) == 0
+
+
+class SmallPathProblem(PathProblem):
+    def get_initial_state(self) -> PathState:
+        return PathState(width=4, max_depth=3)
+
+
+def get_vertices(root) -> list:
+    vertices = [root]
+    for vertex in vertices:
+        vertices.extend(vertex.children or [])
+    return vertices
+
+
+def test_solved_vertices_are_not_selected(tree_store):
+    random.seed(0)
+    game = MCTS(SmallPathProblem(reward_class=LinearBoundedRewardFactory()), tree_store=tree_store, solver=True)
+    root = game._get_root()
+    game.sample(root, 40)
+    solved = [vertex for vertex in get_vertices(root) if vertex.solved]
+    assert len(solved) > 0
+    assert not root.solved
+    visit_counts = [vertex.visit_count for vertex in solved]
+
+    count_evaluations(game)
+    assert game.sample(root, 10) == 10
+    assert game.num_evaluations == 10
+    assert [vertex.visit_count for vertex in solved] == visit_counts
+
+
+def test_without_solver():
+    random.seed(0)
+    game = MCTS(ChainProblem(reward_class=LinearBoundedRewardFactory(), max_depth=2))
+    root = game._get_root()
+    assert game.sample(root, 100) == 100
+    assert not root.solved
+
+
+def test_parallel_solver():
+    game = MCTS(ChainProblem(reward_class=LinearBoundedRewardFactory(), max_depth=2), solver=True)
+    root = game._get_root()
+    assert game.sample(root, 1000, num_parallel=4) < 1000
+    assert root.solved_value == 1.
+
+    game = MCTS(ChainProblem(reward_class=LinearBoundedRewardFactory(), max_depth=2), solver=True)
+    root = game._get_root()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert game.sample(root, 1000, num_parallel=4, executor=executor) < 1000
+    assert root.solved_value == 1.
+
+
+def test_alphazero_solver(engine, tree_store):
+    problem = ChainAlphaZeroProblem(reward_class=LinearBoundedRewardFactory(), engine=engine, max_depth=2)
+    game = AlphaZero(problem, tree_store=tree_store, solver=True, persist_graph=True)
+    root = game._get_root()
+    assert game.sample(root, 1000) < 1000
+    assert root.solved_value == 1.
+
+    path, reward = game.run(num_mcts_samples=10)
+    assert len(path) == 3
+    assert root.solved
+
+
+def test_solved_values_follow_reward_scaling(tree_store):
+    """ Solved values are raw rewards, so a reward factory whose scaling changes between games applies to them """
+    random.seed(0)
+    reward_class = LinearBoundedRewardFactory(max_reward=2.)
+    game = MCTS(ChainProblem(reward_class=reward_class, max_depth=2), tree_store=tree_store, solver=True)
+    root = game._get_root()
+    game.sample(root, 1000)
+    assert root.solved_value == 1.
+    assert game._evaluate([root]).scaled_reward == .5
+
+    reward_class.max_reward = 1.
+    assert game._evaluate([root]).scaled_reward == 1.
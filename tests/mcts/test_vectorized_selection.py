@@ -0,0 +1,55 @@
+import random
+
+import numpy as np
+import pytest
+
+from rlmolecule.alphazero.alphazero import AlphaZero
+from rlmolecule.mcts.mcts import MCTS
+from rlmolecule.tree_search.reward import LinearBoundedRewardFactory
+from tests.chain_problem import ChainAlphaZeroProblem, ChainProblem
+
+
+def check_scores(game, root):
+    """ Every expanded vertex should pick the same child with the vectorized scores as with max() over _ucb_score """
+    stack = [root]
+    seen = set()
+    while stack:
+        vertex = stack.pop()
+        if vertex in seen or not vertex.children or vertex.visit_count == 0:
+            continue
+        seen.add(vertex)
+        children = vertex.children
+        scores = game._ucb_scores(vertex.visit_count,
+                                  np.array([child.visit_count for child in children], dtype=float),
+                                  np.array([child.value_sum for child in children]),
+                                  getattr(vertex, 'child_prior_array', None))
+        expected = [game._ucb_score(vertex, child) for child in children]
+        np.testing.assert_allclose(scores, expected)
+        assert children[int(np.argmax(scores))] == max(children, key=lambda child: game._ucb_score(vertex, child))
+        stack.extend(children)
+
+
+def test_mcts_vectorized_scores(tree_store):
+    random.seed(0)
+    game = MCTS(ChainProblem(reward_class=LinearBoundedRewardFactory()), tree_store=tree_store)
+    root = game._get_root()
+    game.sample(root, 30)
+    check_scores(game, root)
+
+
+def test_alphazero_vectorized_scores(engine, tree_store):
+    problem = ChainAlphaZeroProblem(reward_class=LinearBoundedRewardFactory(), engine=engine)
+    game = AlphaZero(problem, tree_store=tree_store)
+    root = game._get_root()
+    game.sample(root, 30)
+    check_scores(game, root)
+
+
+def test_ucb_scores_ties():
+    game = MCTS(ChainProblem(reward_class=LinearBoundedRewardFactory()))
+    scores = game._ucb_scores(4, np.array([0., 2., 0.]), np.array([0., 1., 0.]))
+    assert np.isinf(scores[0]) and np.isinf(scores[2])
+    assert np.argmax(scores) == 0
+
+    with pytest.raises(RuntimeError):
+        game._ucb_scores(0, np.array([0.]), np.array([0.]))
@@ -0,0 +1,64 @@
+import pytest
+
+from rlmolecule.mcts.mcts import MCTS
+from rlmolecule.mcts.mcts_vertex import MCTSVertex
+from rlmolecule.tree_search.cycle_check import CycleChecker
+from rlmolecule.tree_search.dfs import GraphCycleError
+from rlmolecule.tree_search.reward import LinearBoundedRewardFactory
+from tests.tree_search.test_dfs import AcyclicProblem, CyclicProblem
+
+
+def make_vertices(n):
+    return [MCTSVertex(i) for i in range(n)]
+
+
+def expand(checker, parent, children):
+    parent.children = children
+    checker.add_edges(parent, children)
+
+
+def test_back_edge_raises():
+    checker = CycleChecker()
+    a, b, c, d = make_vertices(4)
+    expand(checker, a, [b, c])
+    expand(checker, b, [d])
+    expand(checker, c, [d])  # transposition, not a cycle
+
+    with pytest.raises(GraphCycleError):
+        expand(checker, d, [a])
+
+    with pytest.raises(GraphCycleError):
+        expand(checker, d, [d])
+
+
+def test_levels_are_raised_for_descendants():
+    checker = CycleChecker()
+    a, b, c, d, e = make_vertices(5)
+    expand(checker, a, [b])
+    expand(checker, b, [c])
+    expand(checker, d, [a])  # a new edge into the existing graph violates the level order
+    expand(checker, e, [d])
+
+    with pytest.raises(GraphCycleError):
+        expand(checker, c, [e])
+
+
+def test_deep_graph():
+    """ Checks are iterative, so deep graphs don't hit the recursion limit """
+    checker = CycleChecker()
+    vertices = make_vertices(5000)
+    for parent, child in zip(vertices[1:], vertices[2:]):
+        expand(checker, parent, [child])
+    expand(checker, vertices[0], [vertices[1]])
+
+    with pytest.raises(GraphCycleError):
+        expand(checker, vertices[-1], [vertices[0]])
+
+
+def test_acyclic_option():
+    game = MCTS(CyclicProblem(reward_class=LinearBoundedRewardFactory(min_reward=0, max_reward=5)))
+    with pytest.raises(GraphCycleError):
+        game.run(num_mcts_samples=100)
+
+    game = MCTS(AcyclicProblem(reward_class=LinearBoundedRewardFactory(min_reward=0, max_reward=5)), acyclic=True)
+    game.run(num_mcts_samples=100)
@@ -0,0 +1,84 @@
+import copy
+import pickle
+
+from rlmolecule.tree_search.graph_search_state import GraphSearchState
+from rlmolecule.tree_search.metrics import call_metrics
+from tests.chain_problem import ChainState
+
+
+class CountingState(ChainState):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.num_hashes = 0
+
+    def hash(self) -> int:
+        self.num_hashes += 1
+        return super().hash() + 1
+
+
+class MutableState(ChainState):
+    cache_hash = False
+
+    def hash(self) -> int:
+        return hash((self.depth, self.position, self.width))
+
+
+def test_hash_is_computed_once():
+    call_metrics.reset()
+    state = ChainState(1, 2)
+    assert hash(state) == hash(state) == state.hash()
+    assert call_metrics.execution_count['hash'] == 1
+    assert call_metrics.execution_count['hash_cache_hits'] == 2
+    assert state.equals(ChainState(1, 2))
+    assert state == ChainState(1, 2)
+
+
+def test_subclass_hash_is_cached():
+    state = CountingState(1, 2)
+    assert hash(state) == hash(ChainState(1, 2)) + 1
+    hash(state)
+    assert state.num_hashes == 1
+    assert getattr(CountingState.hash, 'memoized', False)
+
+
+def test_opt_out():
+    assert not getattr(MutableState.hash, 'memoized', False)
+    state = MutableState(1, 2)
+    first = hash(state)
+    state.width = 5
+    assert hash(state) != first
+
+
+def test_cached_hash_is_not_pickled():
+    state = ChainState(1, 2)
+    hash(state)
+    assert hasattr(state, '_cached_hash')
+
+    for copied in (pickle.loads(pickle.dumps(state)), copy.deepcopy(state)):
+        assert not hasattr(copied, '_cached_hash')
+        assert copied.__dict__ == state.__dict__
+        assert copied == state
+
+
+def test_slotted_subclass_is_pickled():
+    class SlottedState(GraphSearchState):
+        __slots__ = ('value',)
+
+        def __init__(self, value: int):
+            self.value = value
+
+        def equals(self, other: 'SlottedState') -> bool:
+            return self.value == other.value
+
+        def get_next_actions(self):
+            return []
+
+        def hash(self) -> int:
+            return hash(self.value)
+
+    state = SlottedState(3)
+    hash(state)
+    copied = copy.copy(state)
+    assert copied.value == 3
+    assert not hasattr(copied, '_cached_hash')
+    assert copied == state